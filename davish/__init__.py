@@ -1,2 +1,7 @@
+from .aio import AsyncBaseStorage, SyncToAsyncStorage, handle_dav_request_async
+from .cache import ETagCache, ResponseCache
 from .http import ALLOWED_METHODS, handle_dav_request
+from .metrics import Metrics, RequestMetrics
+from .ops.propfind import register_property
 from .storage import BaseStorage
+from .storages import FileSystemStorage, SQLiteStorage
@@ -0,0 +1,535 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+from davish.cache import ETagCache, ResponseCache
+from davish.http import handle_dav_request
+from davish.index import IndexCache
+from davish.storage import (
+    SERIALIZE_BATCH_SIZE,
+    BaseStorage,
+    Collection,
+    Item,
+    ItemBatch,
+    SyncChanges,
+)
+from davish.types import WSGIEnviron
+from davish.utils import utils_path, utils_vobject
+
+T = TypeVar("T")
+
+# Methods that compute the etag of the collections and items they go through
+ETAG_METHODS = ("GET", "HEAD", "PROPFIND")
+
+# The requests and the sync storage calls they wait for run in separate
+# worker threads: sharing them, waiting requests could take every worker
+REQUEST_EXECUTOR = ThreadPoolExecutor(thread_name_prefix="davish-request")
+STORAGE_EXECUTOR = ThreadPoolExecutor(thread_name_prefix="davish-storage")
+
+
+class AsyncBaseStorage:
+    """Async counterpart of ``BaseStorage``, to be used with
+    ``handle_dav_request_async``.
+
+    Only the backend methods are async: the implemented ``BaseStorage``
+    methods (etags, digests, indexes, ...) are shared with the sync storages.
+
+    """
+
+    user: str = "anon"
+    # Set to an ``ETagCache`` instance to share item etags across requests
+    etag_cache: Optional[ETagCache] = None
+    # Set to a ``ResponseCache`` instance to cache PROPFIND and REPORT responses
+    response_cache: Optional[ResponseCache] = None
+    # In-process indexes of the collections, see ``BaseStorage.indexes``
+    indexes: Optional[IndexCache] = BaseStorage.indexes
+    # Maximum number of storage calls awaited at once by a single request
+    max_concurrency: int = 16
+
+    async def collection_list(self) -> list[Collection]:
+        raise NotImplementedError
+
+    async def collection_get(
+        self,
+        slug: str,
+    ) -> Optional[Collection]:
+        raise NotImplementedError
+
+    async def collection_items(
+        self,
+        collection: Collection,
+    ) -> list[Item] | ItemBatch:
+        raise NotImplementedError
+
+    async def item_get(
+        self,
+        href: str,
+        collection: Collection,
+    ) -> Optional[Item]:
+        raise NotImplementedError
+
+    async def item_serialize(self, item: Item) -> str:
+        raise NotImplementedError
+
+    async def item_time_range(self, item: Item) -> tuple[int, int]:
+        raise NotImplementedError
+
+    async def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        raise NotImplementedError
+
+    async def item_delete(
+        self,
+        item: Item,
+    ) -> None:
+        raise NotImplementedError
+
+    # Batched lookups, override them to fetch many items in a single round
+    # trip to the backend
+
+    async def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        items = {item.href: item for item in await self.collection_items(collection)}
+        return {href: items[href] for href in hrefs if href in items}
+
+    async def items_href_by_uid(
+        self,
+        uids: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, str]:
+        wanted = set(uids)
+        found: dict[str, str] = {}
+        items = list(await self.collection_items(collection))
+        for item, content in zip(items, await self.items_serialize_many(items)):
+            for uid in utils_vobject.parse_properties(content).get("UID", []):
+                if uid.value in wanted:
+                    found.setdefault(uid.value, item.href)
+        return found
+
+    async def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        return await asyncio.gather(*(self.item_serialize(item) for item in items))
+
+    async def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        uploaded: dict[str, Optional[Item]] = {}
+        for href, content in contents.items():
+            try:
+                uploaded[href] = await self.item_upload(href, collection, content)
+            except Exception:
+                uploaded[href] = None
+        return uploaded
+
+    # Optional change log, read `BaseStorage.collection_changes` for info
+
+    async def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return None
+
+    async def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        raise NotImplementedError
+
+
+class SyncToAsyncStorage(AsyncBaseStorage):
+    """Adapt a ``BaseStorage`` to ``AsyncBaseStorage``, every call runs in a
+    worker thread of ``executor`` (``STORAGE_EXECUTOR`` by default).
+
+    The executor mustn't be the one running the requests, see
+    ``handle_dav_request_async``.
+
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.storage = storage
+        self.executor = executor or STORAGE_EXECUTOR
+        self.user = storage.user
+        self.etag_cache = storage.etag_cache
+        self.response_cache = storage.response_cache
+        self.indexes = storage.indexes
+
+    async def _call(self, function: Callable[..., T], *args: Any) -> T:
+        # Like `asyncio.to_thread`, on the storage executor
+        call = functools.partial(contextvars.copy_context().run, function, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def collection_list(self) -> list[Collection]:
+        return await self._call(self.storage.collection_list)
+
+    async def collection_get(self, slug: str) -> Optional[Collection]:
+        return await self._call(self.storage.collection_get, slug)
+
+    async def collection_items(self, collection: Collection) -> list[Item] | ItemBatch:
+        return await self._call(self.storage.collection_items, collection)
+
+    async def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        return await self._call(self.storage.item_get, href, collection)
+
+    async def item_serialize(self, item: Item) -> str:
+        return await self._call(self.storage.item_serialize, item)
+
+    async def item_time_range(self, item: Item) -> tuple[int, int]:
+        return await self._call(self.storage.item_time_range, item)
+
+    async def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        return await self._call(self.storage.item_upload, href, collection, content)
+
+    async def item_delete(self, item: Item) -> None:
+        await self._call(self.storage.item_delete, item)
+
+    async def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        return await self._call(
+            self.storage.item_upload_many, dict(contents), collection
+        )
+
+    async def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        return await self._call(self.storage.items_get_many, list(hrefs), collection)
+
+    async def items_href_by_uid(
+        self,
+        uids: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, str]:
+        return await self._call(self.storage.items_href_by_uid, list(uids), collection)
+
+    async def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        return await self._call(self.storage.items_serialize_many, list(items))
+
+    async def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return await self._call(self.storage.collection_sync_token, collection)
+
+    async def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        return await self._call(self.storage.collection_changes, collection, sync_token)
+
+
+class AsyncStorageBridge(BaseStorage):
+    """``BaseStorage`` view of an ``AsyncBaseStorage`` for a single request.
+
+    The ops run in a worker thread against the bridge. Before that,
+    ``prefetch`` awaits concurrently what the request is going to read, every
+    other call is awaited on the event loop while the worker thread waits.
+    The serializations etags are computed from are awaited concurrently a
+    batch at a time, when the etags are needed.
+
+    """
+
+    def __init__(
+        self,
+        storage: AsyncBaseStorage,
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        self.storage = storage
+        self.loop = loop
+        self.user = storage.user
+        self.etag_cache = storage.etag_cache
+        self.response_cache = storage.response_cache
+        self.indexes = storage.indexes
+        self.collections: dict[str, Optional[Collection]] = {}
+        self.collection_list_result: Optional[list[Collection]] = None
+        self.listings: dict[str, list[Item] | ItemBatch] = {}
+        self.items: dict[tuple[str, str], Optional[Item]] = {}
+        # Prefetched serializations are handed out once, callers that need
+        # them again go through the request memo
+        self.serialized: dict[tuple[str, str, object], str] = {}
+        self._semaphore = asyncio.Semaphore(storage.max_concurrency)
+
+    def _run(self, coroutine: Coroutine[None, None, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def prefetch(self, method: str, path: str, depth: str = "0") -> None:
+        """Fetch concurrently the collections, listings and item that
+        ``method`` on ``path`` is going to read."""
+        slug, href = self.split_path(path)
+        if not slug:
+            return
+
+        if slug == self.user:
+            if method != "PROPFIND" or depth == "0":
+                return
+            collections = await self._bounded(self.storage.collection_list())
+            self.collection_list_result = collections
+        else:
+            lookups = {slug, path.strip("/")}
+            found = await asyncio.gather(
+                *(
+                    self._bounded(self.storage.collection_get(lookup))
+                    for lookup in lookups
+                )
+            )
+            self.collections.update(zip(lookups, found))
+            collection = self.collections[slug]
+            if collection is None:
+                return
+            if href is not None:
+                item = await self._bounded(self.storage.item_get(href, collection))
+                self.items[(slug, href)] = item
+                if item is not None and method in ETAG_METHODS:
+                    await self._prefetch_serialized([item])
+                return
+            collections = [collection]
+
+        if method not in ETAG_METHODS + ("REPORT",):
+            return
+
+        async def prefetch_collection(collection: Collection) -> None:
+            items = await self._bounded(self.storage.collection_items(collection))
+            self.listings[collection.slug] = items
+
+        await asyncio.gather(*map(prefetch_collection, collections))
+
+    async def _bounded(self, awaitable: Awaitable[T]) -> T:
+        async with self._semaphore:
+            return await awaitable
+
+    async def _prefetch_serialized(self, items: Iterable[Item]) -> None:
+        # Etags known from the listing or cached don't need the serialization
+        items = [item for item in items if self._needs_etag(item)]
+        keys = [(item.collection.slug, item.href, item.last_modified) for item in items]
+        serialized = await asyncio.gather(
+            *(self._bounded(self.storage.item_serialize(item)) for item in items)
+        )
+        self.serialized.update(zip(keys, serialized))
+
+    def invalidate(self, collection: Collection) -> None:
+        slug = collection.slug
+        self.listings.pop(slug, None)
+        for key in [key for key in self.items if key[0] == slug]:
+            del self.items[key]
+        for key in [key for key in self.serialized if key[0] == slug]:
+            del self.serialized[key]
+
+    def collection_list(self) -> list[Collection]:
+        if self.collection_list_result is not None:
+            return self.collection_list_result
+        return self._run(self.storage.collection_list())
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        if slug in self.collections:
+            return self.collections[slug]
+        return self._run(self.storage.collection_get(slug))
+
+    def collection_items(self, collection: Collection) -> list[Item] | ItemBatch:
+        if collection.slug in self.listings:
+            return self.listings[collection.slug]
+        return self._run(self.storage.collection_items(collection))
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        if (collection.slug, href) in self.items:
+            return self.items[(collection.slug, href)]
+        return self._run(self.storage.item_get(href, collection))
+
+    def item_serialize(self, item: Item) -> str:
+        key = (item.collection.slug, item.href, item.last_modified)
+        serialized = self.serialized.pop(key, None)
+        if serialized is not None:
+            return serialized
+        return self._run(self.storage.item_serialize(item))
+
+    def item_time_range(self, item: Item) -> tuple[int, int]:
+        return self._run(self.storage.item_time_range(item))
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        try:
+            return self._run(self.storage.item_upload(href, collection, content))
+        finally:
+            self.invalidate(collection)
+
+    def item_delete(self, item: Item) -> None:
+        try:
+            self._run(self.storage.item_delete(item))
+        finally:
+            self.invalidate(item.collection)
+
+    def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        try:
+            return self._run(self.storage.item_upload_many(contents, collection))
+        finally:
+            self.invalidate(collection)
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        if collection.slug in self.listings:
+            return super().items_get_many(hrefs, collection)
+        return self._run(self.storage.items_get_many(list(hrefs), collection))
+
+    def items_href_by_uid(
+        self,
+        uids: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, str]:
+        return self._run(self.storage.items_href_by_uid(list(uids), collection))
+
+    def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        items = list(items)
+        keys = [(item.collection.slug, item.href, item.last_modified) for item in items]
+        found = {
+            key: self.serialized.pop(key) for key in keys if key in self.serialized
+        }
+        missing = {key: item for key, item in zip(keys, items) if key not in found}
+        if missing:
+            serialized = self._run(
+                self.storage.items_serialize_many(list(missing.values()))
+            )
+            found.update(zip(missing, serialized))
+        return [found[key] for key in keys]
+
+    def items_etag_many(self, items: Iterable[Item]) -> list[str]:
+        return self._map_serialized(super().items_etag_many, items, self._needs_etag)
+
+    def items_size_many(self, items: Iterable[Item]) -> list[int]:
+        return self._map_serialized(
+            super().items_size_many, items, lambda item: item.size is None
+        )
+
+    def _needs_etag(self, item: Item) -> bool:
+        if item.etag is not None:
+            return False
+        return (
+            self.etag_cache is None or self.etag_cache.get(self._etag_key(item)) is None
+        )
+
+    def _map_serialized(
+        self,
+        function: Callable[[list[Item]], list[T]],
+        items: Iterable[Item],
+        needs_serialization: Callable[[Item], bool],
+    ) -> list[T]:
+        """Call ``function`` on ``items`` a batch at a time, the
+        serializations a batch needs are fetched at once beforehand."""
+        items = list(items)
+        results = []
+        for start in range(0, len(items), SERIALIZE_BATCH_SIZE):
+            batch = items[start : start + SERIALIZE_BATCH_SIZE]
+            missing = [item for item in batch if needs_serialization(item)]
+            keys = [(i.collection.slug, i.href, i.last_modified) for i in missing]
+            # Handed out once to ``item_serialize``
+            self.serialized.update(zip(keys, self.items_serialize_many(missing)))
+            try:
+                results.extend(function(batch))
+            finally:
+                for key in keys:
+                    self.serialized.pop(key, None)
+        return results
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return self._run(self.storage.collection_sync_token(collection))
+
+    def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        return self._run(self.storage.collection_changes(collection, sync_token))
+
+
+async def handle_dav_request_async(
+    environ: WSGIEnviron,
+    storage: AsyncBaseStorage,
+    memoize: bool = True,
+    stream: bool = False,
+    executor: Optional[Executor] = None,
+    **options: Any,
+) -> tuple[int, dict[str, str], Union[bytes, AsyncIterator[bytes]]]:
+    """Async version of ``handle_dav_request``, for an ``AsyncBaseStorage``.
+
+    The storage calls the request needs are awaited concurrently up front,
+    then the request is handled in a worker thread of ``executor``
+    (``REQUEST_EXECUTOR`` by default), which waits for the other storage
+    calls. The storage mustn't run its calls on that executor. With
+    ``stream`` the content is an async iterator of byte chunks. The other
+    ``options`` are passed to ``handle_dav_request``.
+
+    """
+    request_method = environ["REQUEST_METHOD"].upper()
+    path = utils_path.sanitize_path(environ.get("PATH_INFO", ""))
+
+    bridge = AsyncStorageBridge(storage, asyncio.get_running_loop())
+    await bridge.prefetch(request_method, path, environ.get("HTTP_DEPTH", "0"))
+
+    executor = executor or REQUEST_EXECUTOR
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(
+        executor,
+        functools.partial(
+            handle_dav_request, environ, bridge, memoize, stream, **options
+        ),
+    )
+    if isinstance(content, bytes):
+        return status, headers, content
+    return status, headers, _aiter_chunks(content, executor)
+
+
+async def _aiter_chunks(
+    chunks: Iterator[bytes],
+    executor: Executor,
+) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Chunks are generated in a worker thread, as they may hit the storage
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            await loop.run_in_executor(executor, close)
@@ -0,0 +1,9 @@
+"""Benchmarks of ``handle_dav_request`` on a synthetic in-memory storage.
+
+Run ``python -m davish.bench --help`` for the options.
+
+"""
+
+from .runner import ScenarioResult, run, run_scenario
+from .scenarios import SCENARIOS, Client
+from .storage import Dataset, MemoryStorage
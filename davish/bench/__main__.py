@@ -0,0 +1,54 @@
+import argparse
+
+from davish.bench.runner import format_results, load, run, save
+from davish.bench.scenarios import SCENARIOS
+from davish.bench.storage import BACKENDS, Dataset
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m davish.bench",
+        description="Run the davish benchmarks on a synthetic in-memory storage.",
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help="scenarios to run, among %s (all by default)" % ", ".join(SCENARIOS),
+    )
+    parser.add_argument("--users", type=int, default=Dataset.users)
+    parser.add_argument(
+        "--collections", type=int, default=Dataset.collections, help="per user"
+    )
+    parser.add_argument(
+        "--items", type=int, default=Dataset.items, help="per collection"
+    )
+    parser.add_argument("--seed", type=int, default=Dataset.seed)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", choices=BACKENDS, default="memory")
+    parser.add_argument("--stream", action="store_true", help="stream the responses")
+    parser.add_argument("--no-memoize", action="store_true", help="disable the memo")
+    parser.add_argument("-o", "--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario: %r" % name)
+
+    dataset = Dataset(
+        users=args.users,
+        collections=args.collections,
+        items=args.items,
+        seed=args.seed,
+    )
+    options = {"stream": args.stream, "memoize": not args.no_memoize}
+    results = run(
+        args.scenarios or SCENARIOS, dataset, args.runs, options, args.backend
+    )
+    if args.output:
+        save(results, args.output)
+    baseline = load(args.compare) if args.compare else None
+    print(format_results(results, baseline))
+
+
+if __name__ == "__main__":
+    main()
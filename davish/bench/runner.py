@@ -0,0 +1,179 @@
+import dataclasses
+import gc
+import json
+import math
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+
+from davish.bench.scenarios import SCENARIOS, Client
+from davish.bench.storage import Dataset
+
+
+@dataclass
+class ScenarioResult:
+    """Timings of a scenario over its runs, latencies are in milliseconds.
+
+    ``storage_calls`` and ``statuses`` are those of a single run and
+    ``peak_memory`` is the peak of the memory allocated by a run (traced in
+    a run of its own, as tracing slows everything down).
+
+    """
+
+    name: str
+    runs: int
+    requests: int
+    seconds: float
+    throughput: float
+    p50: float
+    p99: float
+    peak_memory: int = 0
+    storage_calls: dict[str, int] = field(default_factory=dict)
+    statuses: dict[str, int] = field(default_factory=dict)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[rank]
+
+
+def run_scenario(
+    name: str,
+    dataset: Dataset,
+    runs: int = 5,
+    options: Optional[dict[str, Any]] = None,
+    backend: str = "memory",
+) -> ScenarioResult:
+    """Run the scenario ``name`` ``runs`` times, each on a fresh copy of
+    ``dataset`` on ``backend``, passing ``options`` to
+    ``handle_dav_request``."""
+    scenario = SCENARIOS[name]
+    latencies: list[float] = []
+    seconds = 0.0
+    storage_calls: Counter[str] = Counter()
+    statuses: Counter[int] = Counter()
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(runs):
+            storages = dataset.open(backend, directory)
+            client = Client(storages, dataset.user_names(), options)
+            gc.collect()
+            start = time.perf_counter()
+            scenario(client)
+            seconds += time.perf_counter() - start
+            latencies.extend(client.latencies)
+            if run == 0:
+                storage_calls, statuses = client.storage_calls, client.statuses
+
+        storages = dataset.open(backend, directory)
+        client = Client(storages, dataset.user_names(), options)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            scenario(client)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return ScenarioResult(
+        name=name,
+        runs=runs,
+        requests=len(latencies),
+        seconds=seconds,
+        throughput=len(latencies) / seconds if seconds else 0.0,
+        p50=percentile(latencies, 0.5) * 1000,
+        p99=percentile(latencies, 0.99) * 1000,
+        peak_memory=peak_memory,
+        storage_calls=dict(sorted(storage_calls.items())),
+        statuses={str(status): count for status, count in sorted(statuses.items())},
+    )
+
+
+def run(
+    names: Iterable[str],
+    dataset: Dataset,
+    runs: int = 5,
+    options: Optional[dict[str, Any]] = None,
+    backend: str = "memory",
+) -> dict[str, Any]:
+    """Run the scenarios ``names`` and return the results, ready to be
+    saved as JSON."""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backend": backend,
+        "dataset": dataclasses.asdict(dataset),
+        "options": options or {},
+        "scenarios": [
+            dataclasses.asdict(run_scenario(name, dataset, runs, options, backend))
+            for name in names
+        ],
+    }
+
+
+def save(results: dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path: str) -> dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_results(
+    results: dict[str, Any],
+    baseline: Optional[dict[str, Any]] = None,
+) -> str:
+    """Format the results as a table, with the change from ``baseline``
+    (the results of a previous run) if given."""
+    previous = {s["name"]: s for s in (baseline or {}).get("scenarios", [])}
+    lines = [
+        "%-20s %8s %10s %10s %10s %12s %12s"
+        % ("scenario", "requests", "req/s", "p50 ms", "p99 ms", "peak KiB", "calls")
+    ]
+    for scenario in results["scenarios"]:
+        calls = sum(scenario["storage_calls"].values())
+        lines.append(
+            "%-20s %8d %10.1f %10.3f %10.3f %12.1f %12d"
+            % (
+                scenario["name"],
+                scenario["requests"],
+                scenario["throughput"],
+                scenario["p50"],
+                scenario["p99"],
+                scenario["peak_memory"] / 1024,
+                calls,
+            )
+        )
+        old = previous.get(scenario["name"])
+        if old is not None:
+            lines.append(
+                "%-20s %8s %10s %10s %10s %12s %12s"
+                % (
+                    "  vs baseline",
+                    "",
+                    _change(scenario["throughput"], old["throughput"]),
+                    _change(scenario["p50"], old["p50"]),
+                    _change(scenario["p99"], old["p99"]),
+                    _change(scenario["peak_memory"], old["peak_memory"]),
+                    _change(calls, sum(old["storage_calls"].values())),
+                )
+            )
+    return "\n".join(lines)
+
+
+def _change(value: float, old: float) -> str:
+    if not old:
+        return "-"
+    return "%+.1f%%" % ((value - old) / old * 100)
@@ -0,0 +1,251 @@
+import io
+import posixpath
+import random
+import re
+import time
+from collections import Counter
+from html import unescape
+from typing import Any, Callable, Optional
+from xml.sax.saxutils import escape
+
+from davish.bench.storage import make_vcard, make_vevent
+from davish.http import handle_dav_request
+from davish.metrics import Metrics, RequestMetrics
+from davish.storage import BaseStorage, Collection
+from davish.utils import utils_path
+
+XMLNS = (
+    'xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav" '
+    'xmlns:CR="urn:ietf:params:xml:ns:carddav" '
+    'xmlns:CS="http://calendarserver.org/ns/"'
+)
+
+# Properties asked by DAVx⁵ while discovering the collections
+HOME_SET_PROPFIND = (
+    '<?xml version="1.0" encoding="utf-8"?><D:propfind %s><D:prop>'
+    "<D:resourcetype/><D:displayname/><D:current-user-privilege-set/>"
+    "<CS:getctag/><D:sync-token/><C:supported-calendar-component-set/>"
+    "</D:prop></D:propfind>" % XMLNS
+).encode()
+
+PRINCIPAL_PROPFIND = (
+    '<?xml version="1.0" encoding="utf-8"?><D:propfind %s><D:prop>'
+    "<D:current-user-principal/><C:calendar-home-set/>"
+    "<CR:addressbook-home-set/></D:prop></D:propfind>" % XMLNS
+).encode()
+
+ETAG_PROPFIND = (
+    '<?xml version="1.0" encoding="utf-8"?><D:propfind %s><D:prop>'
+    "<D:getetag/><D:getcontenttype/></D:prop></D:propfind>" % XMLNS
+).encode()
+
+# Hrefs per multiget, clients fetch the items they miss in batches
+MULTIGET_BATCH_SIZE = 50
+
+SYNC_TOKEN_RE = re.compile(rb"<sync-token>([^<]*)</sync-token>")
+
+
+class Client:
+    """Sends requests to ``handle_dav_request`` as a user would and keeps
+    their latencies and storage calls."""
+
+    def __init__(
+        self,
+        storages: Callable[[str], BaseStorage],
+        users: list[str],
+        options: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self.storages = storages
+        self._users = users
+        self.options = options or {}
+        self.latencies: list[float] = []
+        self.statuses: Counter[int] = Counter()
+        self.storage_calls: Counter[str] = Counter()
+        self.metrics = Metrics(hook=self._record)
+
+    def _record(self, request: RequestMetrics) -> None:
+        self.storage_calls.update(request.storage_calls)
+
+    def request(
+        self,
+        user: str,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        **headers: str,
+    ) -> tuple[int, bytes]:
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        }
+        for name, value in headers.items():
+            environ["HTTP_" + name.upper()] = value
+        storage = self.storages(user)
+
+        start = time.perf_counter()
+        status, _, content = handle_dav_request(
+            environ, storage, metrics=self.metrics, **self.options
+        )
+        if not isinstance(content, bytes):
+            content = b"".join(content)
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses[int(status)] += 1
+        return int(status), content
+
+    # Lookups made by the scenarios, outside of the measured requests
+
+    def users(self) -> list[str]:
+        return list(self._users)
+
+    def collections(self, user: str) -> list[Collection]:
+        return self.storages(user).collection_list()
+
+    def hrefs(self, user: str, collection: Collection) -> list[str]:
+        return [item.href for item in self.storages(user).collection_items(collection)]
+
+    def etag(self, user: str, collection: Collection, href: str) -> str:
+        storage = self.storages(user)
+        item = storage.item_get(href, collection)
+        assert item is not None
+        return storage.item_etag(item)
+
+
+def _path(collection: Collection, href: str = "") -> str:
+    if not href:
+        return utils_path.unstrip_path(collection.slug, True)
+    return utils_path.unstrip_path(posixpath.join(collection.slug, href))
+
+
+def _multiget(collection: Collection, hrefs: list[str]) -> bytes:
+    if collection.is_calendar:
+        report, data = "C:calendar-multiget", "C:calendar-data"
+    else:
+        report, data = "CR:addressbook-multiget", "CR:address-data"
+    elements = "".join(
+        "<D:href>%s</D:href>" % escape(_path(collection, href)) for href in hrefs
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><%s %s><D:prop><D:getetag/><%s/>'
+        "</D:prop>%s</%s>" % (report, XMLNS, data, elements, report)
+    ).encode()
+
+
+def _sync_collection(sync_token: str = "") -> bytes:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><D:sync-collection %s>'
+        "<D:sync-token>%s</D:sync-token><D:sync-level>1</D:sync-level>"
+        "<D:prop><D:getetag/></D:prop></D:sync-collection>"
+        % (XMLNS, escape(sync_token))
+    ).encode()
+
+
+def _sync_token(content: bytes) -> str:
+    match = SYNC_TOKEN_RE.search(content)
+    return unescape(match.group(1).decode()) if match else ""
+
+
+def initial_sync(client: Client) -> None:
+    """First sync of an account by DAVx⁵: discovery, a sync-collection of
+    every collection and multigets of all the items."""
+    for user in client.users():
+        client.request(user, "PROPFIND", "/", PRINCIPAL_PROPFIND, depth="0")
+        client.request(user, "PROPFIND", "/%s/" % user, HOME_SET_PROPFIND, depth="1")
+        for collection in client.collections(user):
+            path = _path(collection)
+            client.request(user, "PROPFIND", path, HOME_SET_PROPFIND, depth="0")
+            client.request(user, "REPORT", path, _sync_collection())
+            hrefs = client.hrefs(user, collection)
+            for start in range(0, len(hrefs), MULTIGET_BATCH_SIZE):
+                batch = hrefs[start : start + MULTIGET_BATCH_SIZE]
+                client.request(user, "REPORT", path, _multiget(collection, batch))
+
+
+def propfind_principal(client: Client) -> None:
+    """Depth:1 PROPFIND of the collections of every user, with their ctags
+    and sync tokens."""
+    for user in client.users():
+        client.request(user, "PROPFIND", "/%s/" % user, HOME_SET_PROPFIND, depth="1")
+
+
+def propfind_collection(client: Client) -> None:
+    """Depth:1 PROPFIND of the etags of every collection."""
+    for user in client.users():
+        for collection in client.collections(user):
+            path = _path(collection)
+            client.request(user, "PROPFIND", path, ETAG_PROPFIND, depth="1")
+
+
+def multiget(client: Client, size: int = 500) -> None:
+    """Multiget of (up to) ``size`` hrefs of every collection."""
+    for user in client.users():
+        for collection in client.collections(user):
+            hrefs = client.hrefs(user, collection)[:size]
+            body = _multiget(collection, hrefs)
+            client.request(user, "REPORT", _path(collection), body)
+
+
+def sync_collection(client: Client) -> None:
+    """Initial sync-collection of every collection, then one with the
+    returned token after a few changes."""
+    rng = random.Random(0)
+    for user in client.users():
+        for collection in client.collections(user):
+            path = _path(collection)
+            _, content = client.request(user, "REPORT", path, _sync_collection())
+            sync_token = _sync_token(content)
+            hrefs = client.hrefs(user, collection)
+            for href in rng.sample(hrefs, min(5, len(hrefs))):
+                uid = href.rpartition(".")[0]
+                item_content = _make_content(collection, rng, uid)
+                client.request(user, "PUT", _path(collection, href), item_content)
+            client.request(user, "REPORT", path, _sync_collection(sync_token))
+
+
+def collection_get(client: Client) -> None:
+    """Export of every collection with GET."""
+    for user in client.users():
+        for collection in client.collections(user):
+            client.request(user, "GET", _path(collection))
+
+
+def put_storm(client: Client, count: int = 200) -> None:
+    """``count`` new items uploaded to every collection, one after the
+    other, then as many updates with If-Match."""
+    rng = random.Random(0)
+    for user in client.users():
+        for collection in client.collections(user):
+            extension = "ics" if collection.is_calendar else "vcf"
+            for i in range(count):
+                uid = "%s-new-%d" % (collection.slug, i)
+                href = "%s.%s" % (uid, extension)
+                content = _make_content(collection, rng, uid)
+                client.request(
+                    user, "PUT", _path(collection, href), content, if_none_match="*"
+                )
+            hrefs = client.hrefs(user, collection)
+            for href in rng.sample(hrefs, min(count, len(hrefs))):
+                etag = client.etag(user, collection, href)
+                uid = href.rpartition(".")[0]
+                content = _make_content(collection, rng, uid)
+                client.request(
+                    user, "PUT", _path(collection, href), content, if_match=etag
+                )
+
+
+def _make_content(collection: Collection, rng: random.Random, uid: str) -> bytes:
+    if collection.is_calendar:
+        return make_vevent(rng, uid).encode()
+    return make_vcard(rng, uid).encode()
+
+
+SCENARIOS: dict[str, Callable[[Client], None]] = {
+    "initial_sync": initial_sync,
+    "propfind_principal": propfind_principal,
+    "propfind_collection": propfind_collection,
+    "multiget": multiget,
+    "sync_collection": sync_collection,
+    "collection_get": collection_get,
+    "put_storm": put_storm,
+}
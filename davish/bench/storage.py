@@ -0,0 +1,249 @@
+import functools
+import os
+import random
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from davish.index import IndexCache, component_time_range
+from davish.storage import BaseStorage, Collection, Item, ItemTag, SyncChanges, Tag
+from davish.storages import FileSystemStorage, SQLiteStorage
+
+EPOCH = datetime(2024, 1, 1)
+
+FIRST_NAMES = ("Ada", "Alan", "Grace", "Edsger", "Barbara", "Donald", "Frances")
+LAST_NAMES = ("Lovelace", "Turing", "Hopper", "Dijkstra", "Liskov", "Knuth", "Allen")
+SUMMARIES = ("Standup", "Planning", "Review", "1:1", "Lunch", "Dentist", "Retro")
+
+
+def make_vcard(rng: random.Random, uid: str) -> str:
+    """Return a vCard 3.0 like the ones synced by mobile clients."""
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    number = rng.randrange(10**9)
+    lines = [
+        "BEGIN:VCARD",
+        "VERSION:3.0",
+        "PRODID:-//davish//bench//EN",
+        "UID:%s" % uid,
+        "FN:%s %s" % (first, last),
+        "N:%s;%s;;;" % (last, first),
+        "EMAIL;TYPE=INTERNET,WORK:%s.%s@example.com" % (first.lower(), uid),
+        "EMAIL;TYPE=INTERNET,HOME:%s%d@example.org" % (last.lower(), number % 97),
+        "TEL;TYPE=CELL:+39 3%09d" % number,
+        "TEL;TYPE=WORK:+39 06 %07d" % (number % 10**7),
+        "ADR;TYPE=HOME:;;Via Roma %d;Roma;;00100;Italy" % (number % 200),
+        "ORG:Example Corp;R&D",
+        "NOTE:%s" % " ".join(rng.choice(SUMMARIES) for _ in range(rng.randrange(20))),
+        "REV:%s" % EPOCH.strftime("%Y%m%dT%H%M%SZ"),
+        "END:VCARD",
+    ]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def make_vevent(rng: random.Random, uid: str) -> str:
+    """Return a VCALENDAR with a single VEVENT, some of them recurring."""
+    start = EPOCH + timedelta(hours=rng.randrange(24 * 365))
+    end = start + timedelta(minutes=rng.choice((15, 30, 60, 90)))
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//davish//bench//EN",
+        "BEGIN:VEVENT",
+        "UID:%s" % uid,
+        "DTSTAMP:%s" % EPOCH.strftime("%Y%m%dT%H%M%SZ"),
+        "DTSTART:%s" % start.strftime("%Y%m%dT%H%M%SZ"),
+        "DTEND:%s" % end.strftime("%Y%m%dT%H%M%SZ"),
+        "SUMMARY:%s" % rng.choice(SUMMARIES),
+        "DESCRIPTION:%s" % " ".join(rng.choice(SUMMARIES) for _ in range(30)),
+        "LOCATION:Room %d" % rng.randrange(100),
+    ]
+    if rng.random() < 0.2:
+        lines.append("RRULE:FREQ=WEEKLY;COUNT=10")
+    lines += [
+        "BEGIN:VALARM",
+        "ACTION:DISPLAY",
+        "TRIGGER:-PT15M",
+        "END:VALARM",
+        "END:VEVENT",
+        "END:VCALENDAR",
+    ]
+    return "\r\n".join(lines) + "\r\n"
+
+
+@dataclass
+class Dataset:
+    """Synthetic data: ``users`` users, with ``collections`` collections
+    each (alternately calendars and address books) of ``items`` items."""
+
+    users: int = 2
+    collections: int = 2
+    items: int = 500
+    seed: int = 0
+
+    def user_names(self) -> list[str]:
+        return ["user%d" % u for u in range(self.users)]
+
+    def build(self) -> "MemoryData":
+        rng = random.Random(self.seed)
+        data = MemoryData()
+        for user in self.user_names():
+            data.collections[user] = {}
+            for c in range(self.collections):
+                if c % 2:
+                    slug, tag = "%s-contacts-%d" % (user, c), Tag.ADDRESS_BOOK
+                else:
+                    slug, tag = "%s-calendar-%d" % (user, c), Tag.CALENDAR
+                collection = Collection(slug=slug, name=slug, tag=tag)
+                data.collections[user][slug] = collection
+                data.items[slug] = {}
+                for i in range(self.items):
+                    uid = "%s-%d" % (slug, i)
+                    if tag == Tag.CALENDAR:
+                        href, content = "%s.ics" % uid, make_vevent(rng, uid)
+                    else:
+                        href, content = "%s.vcf" % uid, make_vcard(rng, uid)
+                    data.store(collection, href, content)
+        return data
+
+    def open(
+        self,
+        backend: str = "memory",
+        directory: Optional[str] = None,
+    ) -> Callable[[str], BaseStorage]:
+        """Build the dataset on ``backend`` and return a factory of the
+        storages of the users.
+
+        With the ``sqlite`` and ``filesystem`` backends the data is loaded
+        in a new ``SQLiteStorage`` database or ``FileSystemStorage`` root in
+        ``directory``.
+
+        """
+        data = self.build()
+        if backend == "memory":
+            return functools.partial(MemoryStorage, data)
+
+        storages: Callable[[str], BaseStorage]
+        name = "davish-bench-%s" % uuid.uuid4().hex
+        path = os.path.join(directory or tempfile.gettempdir(), name)
+        if backend == "sqlite":
+            storages = functools.partial(SQLiteStorage, path + ".sqlite")
+        elif backend == "filesystem":
+            storages = functools.partial(FileSystemStorage, path)
+        else:
+            raise ValueError("Unknown backend: %r" % backend)
+
+        for user, collections in data.collections.items():
+            storage = storages(user)
+            for collection in collections.values():
+                storage.collection_create(collection)  # type: ignore[attr-defined]
+                for href, (_, content, _) in data.items[collection.slug].items():
+                    storage.item_upload(href, collection, content)
+        return storages
+
+
+BACKENDS = ("memory", "sqlite", "filesystem")
+
+
+@dataclass
+class MemoryData:
+    """The collections and items shared by the ``MemoryStorage`` of every
+    request."""
+
+    collections: dict[str, dict[str, Collection]] = field(default_factory=dict)
+    # Collection slug -> href -> (item, content, time range)
+    items: dict[str, dict[str, tuple[Item, str, tuple[int, int]]]] = field(
+        default_factory=dict
+    )
+    # Collection slug -> hrefs changed, in order
+    changes: dict[str, list[str]] = field(default_factory=dict)
+    indexes: IndexCache = field(default_factory=IndexCache)
+    clock: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def store(self, collection: Collection, href: str, content: str) -> Item:
+        tag = ItemTag.VEVENT if collection.is_calendar else ItemTag.VCARD
+        span = component_time_range(content) if collection.is_calendar else (0, 0)
+        with self.lock:
+            # Every change gets a distinct last_modified
+            self.clock += 1
+            item = Item(
+                tag=tag,
+                href=href,
+                collection=collection,
+                last_modified=EPOCH + timedelta(seconds=self.clock),
+            )
+            self.items[collection.slug][href] = (item, content, span)
+            self.changes.setdefault(collection.slug, []).append(href)
+        return item
+
+    def delete(self, item: Item) -> None:
+        with self.lock:
+            del self.items[item.collection.slug][item.href]
+            self.changes.setdefault(item.collection.slug, []).append(item.href)
+
+
+class MemoryStorage(BaseStorage):
+    """In-memory storage of a user, backed by a ``MemoryData``.
+
+    Only the required methods and the change log are implemented, so the
+    benchmarks go through the default implementations of the other optional
+    ones.
+
+    """
+
+    def __init__(self, data: MemoryData, user: str) -> None:
+        self.data = data
+        self.user = user
+        self.indexes = data.indexes
+
+    def collection_list(self) -> list[Collection]:
+        return list(self.data.collections.get(self.user, {}).values())
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        return self.data.collections.get(self.user, {}).get(slug)
+
+    def collection_items(self, collection: Collection) -> list[Item]:
+        # The principal and the root have no items
+        items = self.data.items.get(collection.slug, {})
+        return [item for item, _, _ in items.values()]
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        entry = self.data.items.get(collection.slug, {}).get(href)
+        return entry[0] if entry else None
+
+    def item_serialize(self, item: Item) -> str:
+        return self.data.items[item.collection.slug][item.href][1]
+
+    def item_time_range(self, item: Item) -> tuple[int, int]:
+        return self.data.items[item.collection.slug][item.href][2]
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        return self.data.store(collection, href, content)
+
+    def item_delete(self, item: Item) -> None:
+        self.data.delete(item)
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return str(len(self.data.changes.get(collection.slug, [])))
+
+    def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        changes = self.data.changes.get(collection.slug, [])
+        if not sync_token.isdigit() or int(sync_token) > len(changes):
+            return None
+        items = self.data.items.get(collection.slug, {})
+        result = SyncChanges(sync_token=str(len(changes)))
+        for href in dict.fromkeys(changes[int(sync_token) :]):
+            (result.modified if href in items else result.deleted).append(href)
+        return result
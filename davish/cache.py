@@ -0,0 +1,311 @@
+import dataclasses
+import io
+import socket
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha256
+from http import client
+from typing import TYPE_CHECKING, Callable, Generator, Iterable, Optional
+
+from davish.utils import utils_app, utils_http
+
+if TYPE_CHECKING:
+    from davish.storage import BaseStorage, Collection, LastModified
+    from davish.types import Context, WSGIResponse
+
+
+# The user, collection slug, item href and last_modified of an item
+ETagKey = tuple[str, str, str, "LastModified"]
+
+
+class ETagCache:
+    """Size-bounded LRU cache of item etags, shared across requests.
+
+    Entries are keyed on the user, the collection slug, the item href and its
+    ``last_modified``: an item that changed gets a new key, so it never hits
+    a stale etag. Subclass and override ``get``/``set``/``clear`` to plug in
+    a different backend.
+
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[ETagKey, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: ETagKey) -> Optional[str]:
+        with self._lock:
+            etag = self._data.get(key)
+            if etag is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return etag
+
+    def set(self, key: ETagKey, etag: str) -> None:
+        with self._lock:
+            self._data[key] = etag
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Responses of these methods can be cached by ``ResponseCache``
+CACHED_METHODS = ("PROPFIND", "REPORT")
+
+# User, method, path, Depth and digest of the request body
+ResponseKey = tuple[str, str, str, str, str]
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: dict[str, str]
+    content: bytes
+    # Slugs and validators of the collections the response covers, see
+    # `collection_validator`
+    validators: tuple[tuple[str, str], ...]
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of whole PROPFIND and REPORT responses, shared
+    across requests.
+
+    Entries are keyed on the user, method, path, Depth and a digest of the
+    request body, and hold validators of the collections the response covers
+    (and of the collection list for the principal and the root): an entry is
+    only served while they are unchanged. PUT, DELETE and POST drop the
+    entries of the user's collection they change right away.
+
+    The cached contents are kept under ``max_bytes`` in total, responses
+    bigger than ``max_entry_bytes`` aren't cached.
+
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_entry_bytes: Optional[int] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = (
+            max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        )
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[ResponseKey, CachedResponse] = OrderedDict()
+        # Keys of the entries covering each collection, by user and slug
+        self._by_collection: dict[tuple[str, str], set[ResponseKey]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(
+        self,
+        key: ResponseKey,
+        validators: tuple[tuple[str, str], ...],
+    ) -> Optional[CachedResponse]:
+        """Return the entry of ``key`` if it was stored with ``validators``."""
+        with self._lock:
+            response = self._data.get(key)
+            if response is None or response.validators != validators:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return response
+
+    def set(self, key: ResponseKey, response: CachedResponse) -> None:
+        if len(response.content) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._data[key] = response
+            self.size += len(response.content)
+            for slug, _ in response.validators:
+                self._by_collection.setdefault((key[0], slug), set()).add(key)
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._data)))
+
+    def invalidate(self, user: str, slug: str) -> None:
+        """Drop the entries covering the collection ``slug`` of ``user``."""
+        with self._lock:
+            for key in list(self._by_collection.get((user, slug), ())):
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._by_collection.clear()
+            self.size = 0
+
+    def _discard(self, key: ResponseKey) -> None:
+        response = self._data.pop(key, None)
+        if response is None:
+            return
+        self.size -= len(response.content)
+        for slug, _ in response.validators:
+            keys = self._by_collection.get((key[0], slug))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_collection[(key[0], slug)]
+
+
+def cached_response(
+    cache: ResponseCache,
+    function: Callable[["Context", str], "WSGIResponse"],
+    context: "Context",
+    path: str,
+) -> "WSGIResponse":
+    """Answer the PROPFIND or REPORT request on ``path`` from ``cache``, or
+    with ``function`` storing its response in ``cache``."""
+    environ = context.env
+    storage = context.storage
+    depth = environ.get("HTTP_DEPTH", "0")
+    try:
+        int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        # Answered by the request function
+        return function(context, path)
+    # Decoded and limited like `utils_app.read_xml_request_body` does
+    digest = sha256()
+    chunks = []
+    size = 0
+    try:
+        for chunk in utils_http.iter_request_body(environ):
+            size += len(chunk)
+            if size > utils_app.MAX_XML_SIZE:
+                return utils_http.BAD_REQUEST
+            digest.update(chunk)
+            chunks.append(chunk)
+    except RuntimeError:
+        return utils_http.BAD_REQUEST
+    except socket.timeout:
+        return utils_http.REQUEST_TIMEOUT
+    # The body is read again, decoded, by the request function
+    environ = dict(environ, CONTENT_LENGTH=str(size))
+    environ.pop("HTTP_CONTENT_ENCODING", None)
+    environ["wsgi.input"] = io.BytesIO(b"".join(chunks))
+    context = dataclasses.replace(context, env=environ)
+
+    digest.update(environ.get("CONTENT_TYPE", "").encode())
+    key = (
+        storage.user,
+        environ["REQUEST_METHOD"].upper(),
+        path,
+        depth,
+        digest.hexdigest(),
+    )
+    # Read before answering, a change in between only makes the entry stale
+    validators = _validators(storage, path, depth)
+    cached = cache.get(key, validators)
+    if cached is not None:
+        return cached.status, dict(cached.headers), cached.content
+
+    status, headers, content = function(context, path)
+    if status != client.MULTI_STATUS:
+        return status, headers, content
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if content is None or isinstance(content, bytes):
+        response = CachedResponse(status, dict(headers), content or b"", validators)
+        cache.set(key, response)
+        return status, headers, content
+    return (
+        status,
+        headers,
+        _cached_chunks(cache, key, status, headers, validators, content),
+    )
+
+
+# Validator of the collection list in the validators of a response
+COLLECTION_LIST = ""
+
+
+def collection_validator(storage: "BaseStorage", collection: "Collection") -> str:
+    """Return a value that changes whenever ``collection`` or its items change.
+
+    That's the ctag when the storage persists the collection digest, else the
+    sync token when it keeps a change log, both O(1). Only the other storages
+    compute the ctag from the etags of all the items.
+
+    """
+    if storage.collection_digest_get(collection) is None:
+        sync_token = storage.collection_sync_token(collection)
+        if sync_token is not None:
+            return "%s %r" % (sync_token, dataclasses.astuple(collection))
+    return storage.collection_etag(collection)
+
+
+def _validators(
+    storage: "BaseStorage",
+    path: str,
+    depth: str,
+) -> tuple[tuple[str, str], ...]:
+    """Return the slugs and validators of the collections whose changes
+    change a response on ``path``."""
+    path = path.strip("/")
+    if path == "" or path == storage.user:
+        collections = storage.collection_list()
+        # Created or deleted collections change the principal, and the root
+        # lists it
+        listing = sha256(repr(collections).encode()).hexdigest()
+        validators = [(COLLECTION_LIST, listing)]
+        if path and depth != "0":
+            validators.extend(
+                (collection.slug, collection_validator(storage, collection))
+                for collection in collections
+            )
+        return tuple(validators)
+    slug, _ = storage.split_path(path)
+    collection = storage.collection_get(slug)
+    if collection is None:
+        return ()
+    return ((collection.slug, collection_validator(storage, collection)),)
+
+
+def _cached_chunks(
+    cache: ResponseCache,
+    key: ResponseKey,
+    status: int,
+    headers: dict[str, str],
+    validators: tuple[tuple[str, str], ...],
+    content: Iterable[str] | Iterable[bytes],
+) -> Generator[bytes, None, None]:
+    chunks: Optional[list[bytes]] = []
+    size = 0
+    try:
+        for chunk in content:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunks is not None:
+                size += len(chunk)
+                if size > cache.max_entry_bytes:
+                    # Too big to be cached, stop collecting it
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+    finally:
+        close = getattr(content, "close", None)
+        if close is not None:
+            close()
+    if chunks is not None:
+        response = CachedResponse(status, dict(headers), b"".join(chunks), validators)
+        cache.set(key, response)
@@ -0,0 +1,124 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from davish.utils.utils_vobject import Property
+
+COLLATIONS = ("i;unicode-casemap", "i;ascii-casemap", "i;octet")
+MATCH_TYPES = ("equals", "contains", "starts-with", "ends-with")
+TESTS = ("anyof", "allof")
+
+
+def fold(value: str, collation: str = "i;unicode-casemap") -> str:
+    """Fold ``value`` according to ``collation``, read rfc4790 for info."""
+    if collation == "i;octet":
+        return value
+    if collation == "i;ascii-casemap":
+        return "".join(c.lower() if c.isascii() else c for c in value)
+    return value.casefold()
+
+
+@dataclass
+class TextMatch:
+    """A CR:text-match, read rfc6352-10.5.4 for info."""
+
+    value: str
+    match_type: str = "contains"
+    collation: str = "i;unicode-casemap"
+    negate: bool = False
+
+    def __post_init__(self) -> None:
+        if self.match_type not in MATCH_TYPES:
+            raise ValueError("Unsupported match type: %r" % self.match_type)
+        if self.collation not in COLLATIONS:
+            raise ValueError("Unsupported collation: %r" % self.collation)
+
+    def match(self, value: str) -> bool:
+        needle = fold(self.value, self.collation)
+        value = fold(value, self.collation)
+        if self.match_type == "equals":
+            matched = value == needle
+        elif self.match_type == "starts-with":
+            matched = value.startswith(needle)
+        elif self.match_type == "ends-with":
+            matched = value.endswith(needle)
+        else:
+            matched = needle in value
+        return matched != self.negate
+
+
+@dataclass
+class ParamFilter:
+    """A CR:param-filter, read rfc6352-10.5.2 for info."""
+
+    name: str
+    is_not_defined: bool = False
+    text_match: Optional[TextMatch] = None
+
+    def match(self, params: dict[str, list[str]]) -> bool:
+        values = params.get(self.name.upper())
+        if self.is_not_defined:
+            return values is None
+        if values is None:
+            return False
+        if self.text_match is None:
+            return True
+        text_match = self.text_match
+        return any(text_match.match(value) for value in values)
+
+
+@dataclass
+class PropFilter:
+    """A CR:prop-filter, read rfc6352-10.5.1 for info.
+
+    The filter matches if any instance of the property matches its
+    text-match and param-filter conditions.
+
+    """
+
+    name: str
+    test: str = "anyof"
+    is_not_defined: bool = False
+    text_matches: list[TextMatch] = field(default_factory=list)
+    param_filters: list[ParamFilter] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.name = self.name.upper()
+        if self.test not in TESTS:
+            raise ValueError("Unsupported test: %r" % self.test)
+
+    def match(self, properties: list[Property]) -> bool:
+        if self.is_not_defined:
+            return not properties
+        if not self.text_matches and not self.param_filters:
+            return bool(properties)
+
+        test = all if self.test == "allof" else any
+        for prop in properties:
+            results = [text_match.match(prop.value) for text_match in self.text_matches]
+            results.extend(
+                param_filter.match(prop.params) for param_filter in self.param_filters
+            )
+            if test(results):
+                return True
+        return False
+
+
+@dataclass
+class AddressbookFilter:
+    """A CR:filter of an addressbook-query, read rfc6352-10.5 for info."""
+
+    test: str = "anyof"
+    prop_filters: list[PropFilter] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        if self.test not in TESTS:
+            raise ValueError("Unsupported test: %r" % self.test)
+
+    def match(self, properties: dict[str, list[Property]]) -> bool:
+        if not self.prop_filters:
+            return True
+        test = all if self.test == "allof" else any
+        return test(
+            prop_filter.match(properties.get(prop_filter.name, []))
+            for prop_filter in self.prop_filters
+        )
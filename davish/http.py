@@ -1,4 +1,10 @@
+import itertools
+from typing import Generator, Iterable, Iterator, Optional, Union
+
+from davish.cache import CACHED_METHODS, cached_response
+from davish.metrics import Metrics, StorageProbe
 from davish.ops import METHODS_MAP
+from davish.request import RequestStorage
 from davish.storage import BaseStorage
 from davish.types import Context, WSGIEnviron
 from davish.utils import utils_http, utils_path
@@ -9,26 +15,177 @@ ALLOWED_METHODS = METHODS_MAP.keys()
 def handle_dav_request(
     environ: WSGIEnviron,
     storage: BaseStorage,
-) -> tuple[int, dict[str, str], bytes]:
+    memoize: bool = True,
+    stream: bool = False,
+    compress: bool = False,
+    compress_level: int = 6,
+    compress_min_size: int = 1024,
+    metrics: Optional[Metrics] = None,
+) -> tuple[int, dict[str, str], Union[bytes, Iterator[bytes]]]:
+    """Handle a DAV request and return its status, headers and content.
+
+    With ``stream`` the content of the responses that support it (like the
+    PROPFIND and REPORT multistatus) is an iterator of byte chunks, generated
+    while it's consumed.
+
+    With ``compress`` the content is compressed with the coding negotiated
+    from Accept-Encoding (gzip or deflate), unless it's smaller than
+    ``compress_min_size`` bytes.
+
+    With ``metrics`` the request and the storage calls it makes are measured
+    and recorded once the content has been generated.
+
+    """
+    if metrics is None:
+        return _handle_dav_request(
+            environ,
+            RequestStorage(storage, memoize),
+            stream,
+            compress,
+            compress_level,
+            compress_min_size,
+        )
+
+    request_method = environ["REQUEST_METHOD"].upper()
+    # Unknown methods share a label, clients can't grow the metrics at will
+    if request_method not in METHODS_MAP:
+        request_method = "OTHER"
+    probe = metrics.request(request_method)
+    try:
+        status, headers, content = _handle_dav_request(
+            environ,
+            RequestStorage(storage, memoize, probe),
+            stream,
+            compress,
+            compress_level,
+            compress_min_size,
+            probe,
+        )
+    except Exception:
+        probe.finish(500, 0)
+        raise
+    if isinstance(content, bytes):
+        probe.finish(status, len(content))
+        return status, headers, content
+    # The storage calls made while streaming are measured too
+    return status, headers, _metered_chunks(content, status, probe)
+
+
+def _handle_dav_request(
+    environ: WSGIEnviron,
+    storage: RequestStorage,
+    stream: bool,
+    compress: bool,
+    compress_level: int,
+    compress_min_size: int,
+    probe: Optional[StorageProbe] = None,
+) -> tuple[int, dict[str, str], Union[bytes, Iterator[bytes]]]:
     request_method = environ["REQUEST_METHOD"].upper()
     unsafe_path = environ.get("PATH_INFO", "")
 
     path = utils_path.sanitize_path(unsafe_path)
+    coding = utils_http.negotiate_content_coding(environ) if compress else None
 
     function = METHODS_MAP.get(request_method, None)
     if not function:
         status, headers, content = utils_http.METHOD_NOT_ALLOWED
     else:
-        status, headers, content = function(
-            Context(
-                env=environ,
-                storage=storage,
-            ),
-            path,
+        context = Context(
+            env=environ,
+            storage=storage,
+            metrics=probe.request if probe is not None else None,
         )
+        response_cache = storage.response_cache
+        if response_cache is not None and request_method in CACHED_METHODS:
+            status, headers, content = cached_response(
+                response_cache, function, context, path
+            )
+        else:
+            status, headers, content = function(context, path)
 
     if isinstance(content, str):
+        # Copy, canned responses share their headers
+        headers = dict(headers)
         headers["Content-Type"] += "; charset=utf-8"
         content = content.encode("utf-8")
 
-    return status, headers, content or b""
+    if content is None or isinstance(content, bytes):
+        content = content or b""
+        if coding and len(content) >= compress_min_size:
+            headers = _content_coding_headers(headers, coding)
+            compressor = utils_http.compressobj(coding, compress_level)
+            content = compressor.compress(content) + compressor.flush()
+        return status, headers, content
+
+    chunks: Iterator[bytes] = _iter_chunks(content)
+
+    if coding:
+        # The first chunks tell whether the content is worth compressing
+        head, size = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= compress_min_size:
+                break
+        if size >= compress_min_size:
+            headers = _content_coding_headers(headers, coding)
+            chunks = _compress_chunks(head, chunks, coding, compress_level)
+        else:
+            # The content has been generated entirely
+            chunks = iter(head)
+
+    if not stream:
+        return status, headers, b"".join(chunks)
+    return status, headers, chunks
+
+
+def _content_coding_headers(headers: dict[str, str], coding: str) -> dict[str, str]:
+    headers = dict(headers)
+    headers["Content-Encoding"] = coding
+    headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Accept-Encoding"]))
+    return headers
+
+
+def _iter_chunks(
+    content: Union[Iterable[str], Iterable[bytes]],
+) -> Generator[bytes, None, None]:
+    for chunk in content:
+        yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def _metered_chunks(
+    chunks: Iterator[bytes],
+    status: int,
+    probe: StorageProbe,
+) -> Generator[bytes, None, None]:
+    size = 0
+    try:
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+    finally:
+        probe.finish(status, size)
+
+
+def _compress_chunks(
+    head: list[bytes],
+    chunks: Iterator[bytes],
+    coding: str,
+    level: int,
+) -> Generator[bytes, None, None]:
+    compressor = utils_http.compressobj(coding, level)
+    try:
+        for chunk in itertools.chain(head, chunks):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
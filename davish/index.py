@@ -0,0 +1,721 @@
+import contextlib
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, TypeVar
+
+from davish.filters import AddressbookFilter, PropFilter, TextMatch, fold
+from davish.utils import utils_vobject
+from davish.utils.utils_vobject import Property
+
+if TYPE_CHECKING:
+    from davish.storage import BaseStorage, Collection, Item, LastModified
+
+# Bounds used for open ended time ranges
+TIME_RANGE_MIN = -(2**63)
+TIME_RANGE_MAX = 2**63 - 1
+
+
+def time_range_overlaps(item_range: tuple[int, int], start: int, end: int) -> bool:
+    """Check if ``item_range`` overlaps ``start``-``end``, read rfc4791-9.9."""
+    item_start, item_end = item_range
+    if item_start == item_end:
+        return start <= item_start < end
+    return item_start < end and item_end > start
+
+
+TIME_RANGE_COMPONENTS = ("VEVENT", "VTODO", "VJOURNAL")
+
+DURATION_RE = re.compile(
+    r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$"
+)
+
+
+def component_time_range(text: str) -> tuple[int, int]:
+    """Return the time range of the first VEVENT, VTODO or VJOURNAL of an
+    iCalendar object as timestamps, read rfc4791-9.9 for info.
+
+    Recurring components are open ended and components without a readable
+    DTSTART span every time range. Floating times and times with a TZID are
+    read as UTC.
+
+    """
+    components: list[str] = []
+    properties: dict[str, tuple[dict[str, list[str]], str]] = {}
+    for line in utils_vobject.unfold(text):
+        try:
+            name, params, value = utils_vobject.split_line(line)
+        except ValueError:
+            continue
+        if name == "BEGIN":
+            components.append(value.upper())
+        elif name == "END":
+            if components and components.pop() in TIME_RANGE_COMPONENTS:
+                break
+        elif components and components[-1] in TIME_RANGE_COMPONENTS:
+            properties.setdefault(name, (params, value))
+
+    try:
+        start = _timestamp(*properties["DTSTART"])
+    except (KeyError, ValueError):
+        return TIME_RANGE_MIN, TIME_RANGE_MAX
+    if "RRULE" in properties or "RDATE" in properties:
+        return start, TIME_RANGE_MAX
+
+    try:
+        if "DTEND" in properties:
+            end = _timestamp(*properties["DTEND"])
+        elif "DUE" in properties:
+            end = _timestamp(*properties["DUE"])
+        elif "DURATION" in properties:
+            end = start + _duration(properties["DURATION"][1])
+        elif _is_date(*properties["DTSTART"]):
+            end = start + 86400
+        else:
+            end = start
+    except ValueError:
+        return start, TIME_RANGE_MAX
+    return start, max(start, end)
+
+
+def _is_date(params: dict[str, list[str]], value: str) -> bool:
+    return params.get("VALUE") == ["DATE"] or len(value.strip()) == 8
+
+
+def _timestamp(params: dict[str, list[str]], value: str) -> int:
+    value = value.strip()
+    if _is_date(params, value):
+        dt = datetime.strptime(value[:8], "%Y%m%d")
+    else:
+        dt = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _duration(value: str) -> int:
+    match = DURATION_RE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid duration: %r" % value)
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = (
+        int(weeks or 0) * 604800
+        + int(days or 0) * 86400
+        + int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + int(seconds or 0)
+    )
+    return -duration if sign == "-" else duration
+
+
+class CollectionIndex:
+    """In-process index over the items of a collection.
+
+    The index is validated in O(1) before every use: against the collection
+    digest when the storage persists it, else against the sync token when
+    the storage keeps a change log, the changes since the token seen at the
+    last refresh being re-indexed. Otherwise the ``last_modified`` of every
+    indexed item is compared with a listing, and only what changed is
+    re-indexed.
+
+    """
+
+    def __init__(self) -> None:
+        self.digest: Optional[int] = None
+        self.sync_token: Optional[str] = None
+        self.last_modified: dict[str, "LastModified"] = {}
+        self.lock = threading.RLock()
+
+    def add(self, storage: "BaseStorage", item: "Item") -> None:
+        raise NotImplementedError
+
+    def discard(self, href: str) -> None:
+        raise NotImplementedError
+
+    def update(
+        self,
+        storage: "BaseStorage",
+        items: Iterable["Item"] = (),
+        removed: Iterable[str] = (),
+    ) -> None:
+        with self.lock:
+            # Discarded before their last_modified is dropped
+            for href in removed:
+                if href in self.last_modified:
+                    self.discard(href)
+                    del self.last_modified[href]
+            for item in items:
+                if item.href in self.last_modified:
+                    self.discard(item.href)
+                    del self.last_modified[item.href]
+                self.add(storage, item)
+                self.last_modified[item.href] = item.last_modified
+
+    def refresh(self, storage: "BaseStorage", collection: "Collection") -> None:
+        with self.lock:
+            # Read before the changes or the listing, a change in between
+            # triggers a new refresh
+            digest = storage.collection_digest_get(collection)
+            if digest is not None:
+                if digest == self.digest:
+                    return
+                sync_token = None
+            else:
+                sync_token = storage.collection_sync_token(collection)
+                if sync_token is not None and self.sync_token is not None:
+                    if sync_token == self.sync_token:
+                        return
+                    if self.apply_changes(storage, collection):
+                        return
+
+            # Imported here, davish.storage imports this module
+            from davish.storage import ItemBatch
+
+            items = storage.collection_items(collection)
+            if isinstance(items, ItemBatch):
+                # Only the changed items are created
+                hrefs = set(items.hrefs)
+                changed = [
+                    items[i]
+                    for i, (href, last_modified) in enumerate(
+                        zip(items.hrefs, items.last_modified)
+                    )
+                    if self.last_modified.get(href) != last_modified
+                ]
+            else:
+                hrefs = {item.href for item in items}
+                changed = [
+                    item
+                    for item in items
+                    if self.last_modified.get(item.href) != item.last_modified
+                ]
+            removed = [href for href in self.last_modified if href not in hrefs]
+
+            self.update(storage, changed, removed)
+            self.digest = digest
+            self.sync_token = sync_token
+
+    def apply_changes(self, storage: "BaseStorage", collection: "Collection") -> bool:
+        """Re-index the items changed since ``sync_token``, return False if
+        the storage doesn't know the token anymore."""
+        assert self.sync_token is not None
+        changes = storage.collection_changes(collection, self.sync_token)
+        if changes is None:
+            return False
+        changed = changes.added + changes.modified
+        items = storage.items_get_many(changed, collection)
+        # Deleted again since the changes were read
+        removed = changes.deleted + [href for href in changed if href not in items]
+        self.update(storage, items.values(), removed)
+        self.sync_token = changes.sync_token
+        return True
+
+
+class TimeRangeIndex(CollectionIndex):
+    """Interval index of the ``item_time_range`` of the items.
+
+    Items are kept sorted both by start and by end: the candidates of an
+    overlap query are taken from the shortest of the two sides, so the cost
+    depends on the matching items rather than on the collection size.
+
+    """
+
+    # Above this number of changes the sorted lists are rebuilt at once
+    REBUILD_THRESHOLD = 32
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.ranges: dict[str, tuple[int, int]] = {}
+        self.starts: list[tuple[int, str]] = []
+        self.ends: list[tuple[int, str]] = []
+
+    def add(self, storage: "BaseStorage", item: "Item") -> None:
+        start, end = storage.item_time_range(item)
+        self.ranges[item.href] = (start, end)
+        insort(self.starts, (start, item.href))
+        insort(self.ends, (end, item.href))
+
+    def discard(self, href: str) -> None:
+        start, end = self.ranges.pop(href)
+        del self.starts[bisect_left(self.starts, (start, href))]
+        del self.ends[bisect_left(self.ends, (end, href))]
+
+    def update(
+        self,
+        storage: "BaseStorage",
+        items: Iterable["Item"] = (),
+        removed: Iterable[str] = (),
+    ) -> None:
+        items = list(items)
+        removed = list(removed)
+        if len(items) + len(removed) <= self.REBUILD_THRESHOLD:
+            return super().update(storage, items, removed)
+
+        with self.lock:
+            for href in removed:
+                self.ranges.pop(href, None)
+                self.last_modified.pop(href, None)
+            for item in items:
+                self.ranges[item.href] = storage.item_time_range(item)
+                self.last_modified[item.href] = item.last_modified
+            self.starts = sorted((s, href) for href, (s, _) in self.ranges.items())
+            self.ends = sorted((e, href) for href, (_, e) in self.ranges.items())
+
+    def overlapping(self, start: int, end: int) -> list[str]:
+        """Return the hrefs of the items overlapping ``start``-``end``."""
+        with self.lock:
+            # Items starting before the end of the range
+            starting_before = bisect_left(self.starts, (end,))
+            # Items ending after the start of the range (or on it)
+            ending_after = bisect_left(self.ends, (start,))
+
+            if starting_before <= len(self.ends) - ending_after:
+                candidates = self.starts[:starting_before]
+            else:
+                candidates = self.ends[ending_after:]
+
+            return [
+                href
+                for _, href in candidates
+                if time_range_overlaps(self.ranges[href], start, end)
+            ]
+
+
+class SummaryIndex(CollectionIndex):
+    """Item count, total size and newest last_modified of a collection.
+
+    The newest last_modified is only recomputed from the indexed ones when
+    the item holding it changes.
+
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.sizes: dict[str, int] = {}
+        self.size = 0
+        self._newest: Optional["LastModified"] = None
+
+    def add(self, storage: "BaseStorage", item: "Item") -> None:
+        size = storage.item_size(item)
+        self.sizes[item.href] = size
+        self.size += size
+        if self._newest is not None and item.last_modified > self._newest:
+            self._newest = item.last_modified
+
+    def discard(self, href: str) -> None:
+        self.size -= self.sizes.pop(href)
+        if self.last_modified[href] == self._newest:
+            self._newest = None
+
+    def summary(self) -> tuple[int, int, Optional["LastModified"]]:
+        """Return the item count, total size and newest last_modified."""
+        with self.lock:
+            if self._newest is None and self.last_modified:
+                self._newest = max(self.last_modified.values())
+            return len(self.sizes), self.size, self._newest
+
+
+class SyncIndex(CollectionIndex):
+    """The items seen at the last sync tokens of a collection, for storages
+    without a change log.
+
+    A sync from one of the ``MAX_SNAPSHOTS`` last tokens sent is answered
+    with the items whose last_modified changed since, and the ones gone.
+
+    """
+
+    MAX_SNAPSHOTS = 8
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.snapshots: OrderedDict[str, dict[str, Optional["LastModified"]]] = (
+            OrderedDict()
+        )
+
+    def add(self, storage: "BaseStorage", item: "Item") -> None:
+        pass
+
+    def discard(self, href: str) -> None:
+        pass
+
+    def remember(self, sync_token: str) -> None:
+        """Remember the indexed items as the ones seen at ``sync_token``."""
+        with self.lock:
+            snapshot: dict[str, Optional["LastModified"]] = dict(self.last_modified)
+            previous = self.snapshots.get(sync_token)
+            if previous is not None and previous != snapshot:
+                # The token was sent with different items (it's read before
+                # the refresh), the ones that differ are sent again
+                snapshot = {
+                    href: (
+                        snapshot.get(href)
+                        if snapshot.get(href) == previous.get(href)
+                        else None
+                    )
+                    for href in previous.keys() | snapshot.keys()
+                }
+            self.snapshots[sync_token] = snapshot
+            self.snapshots.move_to_end(sync_token)
+            while len(self.snapshots) > self.MAX_SNAPSHOTS:
+                self.snapshots.popitem(last=False)
+
+    def changes(self, sync_token: str) -> Optional[tuple[list[str], list[str]]]:
+        """Return the hrefs changed and deleted since ``sync_token``, or None
+        if it isn't remembered."""
+        with self.lock:
+            snapshot = self.snapshots.get(sync_token)
+            if snapshot is None:
+                return None
+            changed = [
+                href
+                for href, last_modified in self.last_modified.items()
+                if snapshot.get(href) != last_modified
+            ]
+            deleted = [href for href in snapshot if href not in self.last_modified]
+            return changed, deleted
+
+
+Index = TypeVar("Index", bound=CollectionIndex)
+
+
+# The user and the slug of a collection, slugs are only unique per user
+IndexKey = tuple[str, str]
+
+
+class IndexCache:
+    """LRU of the in-process indexes of the collections, shared across
+    requests.
+
+    Indexes are kept up to date by PUT, DELETE and POST through
+    ``item_changed`` and validated against the storage before every use.
+    They are keyed on the user and the collection slug: storages backed by
+    different data in the same process need an ``IndexCache`` each.
+
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict[IndexKey, dict[type, CollectionIndex]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    @contextlib.contextmanager
+    def get(
+        self,
+        index_class: type[Index],
+        storage: "BaseStorage",
+        collection: "Collection",
+    ) -> Iterator[Index]:
+        """Return the up to date index of type ``index_class`` of
+        ``collection``, building it if needed.
+
+        The index is locked until the block ends, so it doesn't change
+        between the refresh and the queries.
+
+        """
+        key = (storage.user, collection.slug)
+        with self._lock:
+            indexes = self._data.setdefault(key, {})
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            index = indexes.get(index_class)
+            if index is None:
+                index = indexes[index_class] = index_class()
+
+        with index.lock:
+            try:
+                index.refresh(storage, collection)
+            except Exception:
+                self._discard(storage, collection, index)
+                raise
+            assert isinstance(index, index_class)
+            yield index
+
+    def item_changed(
+        self,
+        storage: "BaseStorage",
+        collection: "Collection",
+        href: str,
+        item: Optional["Item"],
+        digest: Optional[int],
+    ) -> None:
+        """Update the indexes of ``collection`` after ``href`` has been
+        uploaded (``item``) or deleted (``None``).
+
+        ``digest`` is the collection digest before the change: indexes that
+        were up to date with it are moved to the new one.
+
+        """
+        if item:
+            self.items_changed(storage, collection, [item], (), digest)
+        else:
+            self.items_changed(storage, collection, (), [href], digest)
+
+    def items_changed(
+        self,
+        storage: "BaseStorage",
+        collection: "Collection",
+        items: Iterable["Item"],
+        removed: Iterable[str],
+        digest: Optional[int],
+    ) -> None:
+        """Update the indexes of ``collection`` after ``items`` have been
+        uploaded and the ``removed`` hrefs deleted, read ``item_changed`` for
+        info."""
+        items, removed = list(items), list(removed)
+        with self._lock:
+            key = (storage.user, collection.slug)
+            indexes = list(self._data.get(key, {}).values())
+
+        for index in indexes:
+            with index.lock:
+                up_to_date = digest is not None and index.digest == digest
+                try:
+                    index.update(storage, items=items, removed=removed)
+                except Exception:
+                    self._discard(storage, collection, index)
+                    continue
+                if up_to_date:
+                    index.digest = storage.collection_digest_get(collection)
+                else:
+                    index.digest = None
+
+    def _discard(
+        self,
+        storage: "BaseStorage",
+        collection: "Collection",
+        index: CollectionIndex,
+    ) -> None:
+        with self._lock:
+            indexes = self._data.get((storage.user, collection.slug), {})
+            if indexes.get(type(index)) is index:
+                del indexes[type(index)]
+
+
+class PropertyIndex(CollectionIndex):
+    """Inverted index of the vCard properties used to look up contacts.
+
+    Every distinct (case folded) value points to the hrefs of the items that
+    have it. Values are also kept sorted, reversed and split in trigrams, so
+    that equals, starts-with, ends-with and contains text matches only look at
+    the values that can match.
+
+    """
+
+    PROPERTIES = ("FN", "EMAIL", "TEL", "UID")
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.properties: dict[str, dict[str, list[Property]]] = {}
+        self.postings: dict[str, dict[str, set[str]]] = {
+            name: {} for name in self.PROPERTIES
+        }
+        self.sorted_values: dict[str, list[str]] = {
+            name: [] for name in self.PROPERTIES
+        }
+        self.reversed_values: dict[str, list[str]] = {
+            name: [] for name in self.PROPERTIES
+        }
+        self.trigrams: dict[str, dict[str, set[str]]] = {
+            name: {} for name in self.PROPERTIES
+        }
+
+    def add(self, storage: "BaseStorage", item: "Item") -> None:
+        properties = utils_vobject.parse_properties(storage.item_serialize(item))
+        self.properties[item.href] = {
+            name: properties[name] for name in self.PROPERTIES if name in properties
+        }
+        for name, value in self._values(item.href):
+            hrefs = self.postings[name].setdefault(value, set())
+            if not hrefs:
+                self._add_value(name, value)
+            hrefs.add(item.href)
+
+    def discard(self, href: str) -> None:
+        for name, value in self._values(href):
+            hrefs = self.postings[name].get(value)
+            if not hrefs:
+                continue
+            hrefs.discard(href)
+            if not hrefs:
+                del self.postings[name][value]
+                self._discard_value(name, value)
+        del self.properties[href]
+
+    def update(
+        self,
+        storage: "BaseStorage",
+        items: Iterable["Item"] = (),
+        removed: Iterable[str] = (),
+    ) -> None:
+        items = list(items)
+        removed = list(removed)
+        if len(items) + len(removed) <= TimeRangeIndex.REBUILD_THRESHOLD:
+            return super().update(storage, items, removed)
+
+        with self.lock:
+            for href in removed:
+                self.properties.pop(href, None)
+                self.last_modified.pop(href, None)
+            for item in items:
+                text = storage.item_serialize(item)
+                properties = utils_vobject.parse_properties(text)
+                self.properties[item.href] = {
+                    name: properties[name]
+                    for name in self.PROPERTIES
+                    if name in properties
+                }
+                self.last_modified[item.href] = item.last_modified
+            self._rebuild()
+
+    def search(self, card_filter: AddressbookFilter) -> set[str]:
+        """Return the hrefs of the items matching ``card_filter``, all of its
+        prop-filters must be on indexed properties."""
+        with self.lock:
+            if not card_filter.prop_filters:
+                return set(self.properties)
+
+            result: Optional[set[str]] = None
+            for prop_filter in card_filter.prop_filters:
+                hrefs = {
+                    href
+                    for href in self._candidates(prop_filter)
+                    if prop_filter.match(
+                        self.properties[href].get(prop_filter.name, [])
+                    )
+                }
+                if result is None:
+                    result = hrefs
+                elif card_filter.test == "allof":
+                    result &= hrefs
+                else:
+                    result |= hrefs
+            assert result is not None
+            return result
+
+    def hrefs_by_uid(self, uids: Iterable[str]) -> dict[str, str]:
+        """Return the href of an item with each of the ``uids``, leaving out
+        the missing ones. UIDs are compared exactly, not folded."""
+        found = {}
+        with self.lock:
+            for uid in uids:
+                for href in sorted(self.postings["UID"].get(fold(uid), ())):
+                    if any(prop.value == uid for prop in self.properties[href]["UID"]):
+                        found[uid] = href
+                        break
+        return found
+
+    def _values(self, href: str) -> Iterator[tuple[str, str]]:
+        for name, properties in self.properties.get(href, {}).items():
+            for value in {fold(prop.value) for prop in properties}:
+                yield name, value
+
+    def _add_value(self, name: str, value: str) -> None:
+        insort(self.sorted_values[name], value)
+        insort(self.reversed_values[name], value[::-1])
+        for trigram in _trigrams(value):
+            self.trigrams[name].setdefault(trigram, set()).add(value)
+
+    def _discard_value(self, name: str, value: str) -> None:
+        for values, key in (
+            (self.sorted_values[name], value),
+            (self.reversed_values[name], value[::-1]),
+        ):
+            position = bisect_left(values, key)
+            if position < len(values) and values[position] == key:
+                del values[position]
+        for trigram in _trigrams(value):
+            values_set = self.trigrams[name].get(trigram)
+            if values_set is not None:
+                values_set.discard(value)
+                if not values_set:
+                    del self.trigrams[name][trigram]
+
+    def _rebuild(self) -> None:
+        for name in self.PROPERTIES:
+            self.postings[name] = {}
+            self.trigrams[name] = {}
+        for href in self.properties:
+            for name, value in self._values(href):
+                self.postings[name].setdefault(value, set()).add(href)
+        for name in self.PROPERTIES:
+            values = list(self.postings[name])
+            self.sorted_values[name] = sorted(values)
+            self.reversed_values[name] = sorted(value[::-1] for value in values)
+            for value in values:
+                for trigram in _trigrams(value):
+                    self.trigrams[name].setdefault(trigram, set()).add(value)
+
+    def _candidates(self, prop_filter: PropFilter) -> set[str]:
+        """Return a superset of the hrefs matching ``prop_filter``."""
+        if prop_filter.is_not_defined:
+            return set(self.properties)
+
+        # Only text matches that aren't negated can be looked up, the other
+        # conditions must be checked on every item having the property
+        postings = self.postings[prop_filter.name]
+        lookups = [
+            text_match
+            for text_match in prop_filter.text_matches
+            if not text_match.negate
+        ]
+        other_conditions = prop_filter.param_filters or len(lookups) < len(
+            prop_filter.text_matches
+        )
+        if not lookups or other_conditions and prop_filter.test == "anyof":
+            return set().union(*postings.values())
+
+        candidates: Optional[set[str]] = None
+        for text_match in lookups:
+            hrefs: set[str] = set().union(
+                *(
+                    postings[value]
+                    for value in self._matching_values(prop_filter.name, text_match)
+                )
+            )
+            if candidates is None:
+                candidates = hrefs
+            elif prop_filter.test == "allof":
+                candidates &= hrefs
+            else:
+                candidates |= hrefs
+        assert candidates is not None
+        return candidates
+
+    def _matching_values(self, name: str, text_match: TextMatch) -> Iterable[str]:
+        """Return a superset of the folded values matching ``text_match``."""
+        needle = fold(text_match.value)
+        if text_match.match_type == "equals":
+            return (needle,) if needle in self.postings[name] else ()
+
+        if text_match.match_type in ("starts-with", "ends-with"):
+            if text_match.match_type == "starts-with":
+                values = self.sorted_values[name]
+            else:
+                values = self.reversed_values[name]
+                needle = needle[::-1]
+            matching = []
+            for value in values[bisect_left(values, needle) :]:
+                if not value.startswith(needle):
+                    break
+                matching.append(value)
+            if text_match.match_type == "ends-with":
+                return [value[::-1] for value in matching]
+            return matching
+
+        trigrams = _trigrams(needle)
+        if not trigrams:
+            return [value for value in self.sorted_values[name] if needle in value]
+        sets = sorted(
+            (self.trigrams[name].get(trigram, set()) for trigram in trigrams),
+            key=len,
+        )
+        return [value for value in set.intersection(*sets) if needle in value]
+
+
+def _trigrams(value: str) -> set[str]:
+    return {value[i : i + 3] for i in range(len(value) - 2)}
@@ -0,0 +1,306 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+from davish.storage import BaseStorage
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the buckets of the response size histograms, in bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# The ``BaseStorage`` methods whose calls are counted and timed
+STORAGE_CALLS = (
+    "collection_list",
+    "collection_get",
+    "collection_items",
+    "item_get",
+    "item_serialize",
+    "item_time_range",
+    "item_upload",
+    "item_upload_many",
+    "item_delete",
+    "items_get_many",
+    "items_href_by_uid",
+    "items_serialize_many",
+    "item_version",
+    "item_size",
+    "collection_size",
+    "collection_summary",
+    "collection_sync_token",
+    "collection_changes",
+    "collection_digest_get",
+    "collection_digest_set",
+    "collection_stats_get",
+    "collection_stats_set",
+)
+
+
+@dataclass
+class RequestMetrics:
+    """What a single request cost, passed to the ``Metrics.hook``.
+
+    ``storage_calls`` and ``storage_time`` are keyed on the ``BaseStorage``
+    method name and count the calls reaching the storage, after the request
+    memo. Calls made by other storage methods (like the default
+    ``items_serialize_many`` calling ``item_serialize``) are counted too.
+
+    """
+
+    method: str
+    report: Optional[str] = None
+    status: int = 0
+    duration: float = 0.0
+    storage_calls: Counter[str] = field(default_factory=Counter)
+    storage_time: defaultdict[str, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+    serialized_bytes: int = 0
+    response_bytes: int = 0
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+Labels = tuple[str, str]
+
+
+class Metrics:
+    """Request and storage metrics, aggregated across requests.
+
+    Pass an instance as ``metrics`` to ``handle_dav_request``: every request
+    is timed and the ``BaseStorage`` calls it makes are counted, grouped by
+    DAV method and REPORT type. ``prometheus`` returns a snapshot in the
+    Prometheus text format and ``hook``, if set, is called with the
+    ``RequestMetrics`` of every request once its content has been generated.
+
+    """
+
+    def __init__(
+        self,
+        hook: Optional[Callable[[RequestMetrics], None]] = None,
+        duration_buckets: tuple[float, ...] = DURATION_BUCKETS,
+        size_buckets: tuple[float, ...] = SIZE_BUCKETS,
+    ) -> None:
+        self.hook = hook
+        self.duration_buckets = duration_buckets
+        self.size_buckets = size_buckets
+        self.requests: Counter[tuple[str, str, int]] = Counter()
+        self.durations: dict[Labels, Histogram] = {}
+        self.response_sizes: dict[Labels, Histogram] = {}
+        self.serialized_bytes: Counter[Labels] = Counter()
+        self.storage_calls: Counter[tuple[str, str, str]] = Counter()
+        self.storage_time: defaultdict[tuple[str, str, str], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def request(self, method: str) -> "StorageProbe":
+        """Start measuring a request, whose storage calls are passed to the
+        returned probe."""
+        return StorageProbe(self, RequestMetrics(method=method))
+
+    def record(self, request: RequestMetrics) -> None:
+        labels = (request.method, request.report or "")
+        with self._lock:
+            self.requests[labels + (request.status,)] += 1
+            if labels not in self.durations:
+                self.durations[labels] = Histogram(self.duration_buckets)
+                self.response_sizes[labels] = Histogram(self.size_buckets)
+            self.durations[labels].observe(request.duration)
+            self.response_sizes[labels].observe(request.response_bytes)
+            self.serialized_bytes[labels] += request.serialized_bytes
+            for name, calls in request.storage_calls.items():
+                self.storage_calls[labels + (name,)] += calls
+                self.storage_time[labels + (name,)] += request.storage_time[name]
+        if self.hook is not None:
+            self.hook(request)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.durations.clear()
+            self.response_sizes.clear()
+            self.serialized_bytes.clear()
+            self.storage_calls.clear()
+            self.storage_time.clear()
+
+    def prometheus(self, prefix: str = "davish") -> str:
+        """Return a snapshot of the metrics in the Prometheus text format."""
+        lines: list[str] = []
+        with self._lock:
+            _counter(
+                lines,
+                "%s_requests_total" % prefix,
+                "DAV requests handled.",
+                (
+                    (_labels(method, report, status=str(status)), value)
+                    for (method, report, status), value in sorted(self.requests.items())
+                ),
+            )
+            _histogram(
+                lines,
+                "%s_request_duration_seconds" % prefix,
+                "Time spent handling DAV requests.",
+                self.durations,
+            )
+            _histogram(
+                lines,
+                "%s_response_size_bytes" % prefix,
+                "Size of the DAV response contents.",
+                self.response_sizes,
+            )
+            _counter(
+                lines,
+                "%s_serialized_bytes_total" % prefix,
+                "Bytes of items serialized by the storage.",
+                (
+                    (_labels(*labels), value)
+                    for labels, value in sorted(self.serialized_bytes.items())
+                ),
+            )
+            _counter(
+                lines,
+                "%s_storage_calls_total" % prefix,
+                "Storage method calls.",
+                (
+                    (_labels(method, report, call=name), value)
+                    for (method, report, name), value in sorted(
+                        self.storage_calls.items()
+                    )
+                ),
+            )
+            _counter(
+                lines,
+                "%s_storage_call_seconds_total" % prefix,
+                "Time spent in storage method calls.",
+                (
+                    (_labels(method, report, call=name), value)
+                    for (method, report, name), value in sorted(
+                        self.storage_time.items()
+                    )
+                ),
+            )
+        return "\n".join(lines) + "\n"
+
+
+class StorageProbe:
+    """Request-scoped instrumentation of ``BaseStorage`` calls.
+
+    The ``RequestStorage`` of the request measures the ``STORAGE_CALLS``
+    through ``call``, ``finish`` records the request in its ``Metrics``.
+
+    """
+
+    def __init__(self, metrics: Metrics, request: RequestMetrics) -> None:
+        self.metrics = metrics
+        self.request = request
+        self._start = time.perf_counter()
+        # Items may be serialized in parallel, see `BaseStorage.executor`
+        self._lock = threading.Lock()
+
+    def call(
+        self,
+        name: str,
+        function: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Call ``function``, the ``name`` storage method, and measure it."""
+        if name not in STORAGE_CALLS:
+            return function(*args, **kwargs)
+        request = self.request
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                request.storage_calls[name] += 1
+                request.storage_time[name] += elapsed
+        if name == "item_serialize":
+            size = _text_size(result)
+        elif name == "items_serialize_many" and _is_batched(function):
+            size = _texts_size(result)
+        else:
+            return result
+        with self._lock:
+            request.serialized_bytes += size
+        return result
+
+    def finish(self, status: int, response_bytes: int) -> None:
+        """Record the request, once its content has been generated."""
+        self.request.status = status
+        self.request.response_bytes = response_bytes
+        self.request.duration = time.perf_counter() - self._start
+        self.metrics.record(self.request)
+
+
+def _is_batched(function: Callable[..., Any]) -> bool:
+    # The default batched serialization calls ``item_serialize``, its bytes
+    # aren't counted twice
+    return getattr(function, "__func__", None) is not BaseStorage.items_serialize_many
+
+
+def _text_size(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+def _texts_size(texts: Iterable[str]) -> int:
+    return sum(_text_size(text) for text in texts)
+
+
+def _labels(method: str, report: str, **extra: str) -> str:
+    labels = {"method": method, "report": report, **extra}
+    return ",".join(
+        '%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+def _counter(
+    lines: list[str],
+    name: str,
+    help_text: str,
+    samples: Iterable[tuple[str, float]],
+) -> None:
+    lines.append("# HELP %s %s" % (name, help_text))
+    lines.append("# TYPE %s counter" % name)
+    for labels, value in samples:
+        lines.append("%s{%s} %s" % (name, labels, _number(value)))
+
+
+def _histogram(
+    lines: list[str],
+    name: str,
+    help_text: str,
+    histograms: dict[Labels, Histogram],
+) -> None:
+    lines.append("# HELP %s %s" % (name, help_text))
+    lines.append("# TYPE %s histogram" % name)
+    for (method, report), histogram in sorted(histograms.items()):
+        cumulative = 0
+        bounds = [_number(bound) for bound in histogram.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            labels = _labels(method, report, le=bound)
+            lines.append("%s_bucket{%s} %d" % (name, labels, cumulative))
+        labels = _labels(method, report)
+        lines.append("%s_sum{%s} %s" % (name, labels, _number(histogram.sum)))
+        lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
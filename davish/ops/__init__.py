@@ -2,6 +2,7 @@ from .delete import do_DELETE
 from .get import do_GET
 from .head import do_HEAD
 from .options import do_OPTIONS
+from .post import do_POST
 from .propfind import do_PROPFIND
 from .put import do_PUT
 from .report import do_REPORT
@@ -11,6 +12,7 @@ METHODS_MAP = {
     "GET": do_GET,
     "HEAD": do_HEAD,
     "OPTIONS": do_OPTIONS,
+    "POST": do_POST,
     "PROPFIND": do_PROPFIND,
     "PUT": do_PUT,
     "REPORT": do_REPORT,
@@ -40,7 +40,24 @@ def do_DELETE(
         # ETag precondition not verified, do not delete item
         return utils_http.PRECONDITION_FAILED
 
+    collection_digest = context.storage.collection_digest_get(item.collection)
+    digest = context.storage.item_digest(item)
+    removed = None
+    if context.storage.collection_stats_get(item.collection) is not None:
+        removed = context.storage.items_stats([item])
     context.storage.item_delete(item)
+    context.storage.collection_digest_update(item.collection, digest)
+    if removed is not None:
+        context.storage.collection_stats_update(
+            item.collection, context.storage.items_stats([]), removed
+        )
+    context.storage.collection_indexes_update(
+        item.collection, item.href, None, collection_digest
+    )
+    if context.storage.response_cache is not None:
+        context.storage.response_cache.invalidate(
+            context.storage.user, item.collection.slug
+        )
     xml_answer = xml_delete(path)
 
     headers = {"Content-Type": "text/xml; charset=utf-8"}
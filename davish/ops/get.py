@@ -1,7 +1,7 @@
 from http import client
 from urllib.parse import quote
 
-from davish.storage import Collection, Item
+from davish.storage import Collection, Item, format_datetime
 from davish.types import Context, WSGIResponse
 from davish.utils import utils_http, utils_xml
 
@@ -45,23 +45,33 @@ def do_GET(
         content_disposition = _content_disposition_attachement(
             propose_filename(collection)
         )
-        etag = context.storage.collection_etag(collection)
+        # A single call for the etag and the last_modified
+        summary = context.storage.collection_summary(collection)
+        etag = summary.etag
+        last_modified = format_datetime(summary.last_modified)
     elif isinstance(item_or_collection, Item):
         item = item_or_collection
         content_type = utils_xml.OBJECT_MIMETYPES[item.tag.value]
         content_disposition = ""
         etag = context.storage.item_etag(item)
+        last_modified = context.storage.get_last_modified(item)
     else:
         return utils_http.BAD_REQUEST
 
+    response = utils_http.conditional_response(context.env, etag, last_modified)
+    if response is not None:
+        return response
+
     headers = {
-        "Content-Type": content_type,
-        "Last-Modified": context.storage.get_last_modified(item_or_collection),
+        # The content is generated in chunks, so the charset is set here
+        "Content-Type": content_type + "; charset=utf-8",
+        "Last-Modified": last_modified,
         "ETag": etag,
     }
 
     if content_disposition:
         headers["Content-Disposition"] = content_disposition
 
-    answer = context.storage.serialize(item_or_collection)
+    # Serialized lazily, HEAD requests drop the content without consuming it
+    answer = context.storage.serialize_iter(item_or_collection)
     return client.OK, headers, answer
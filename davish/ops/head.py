@@ -7,5 +7,6 @@ def do_HEAD(
     path: str,
 ) -> WSGIResponse:
     """Manage HEAD request."""
-    # Body is dropped in `Application.__call__` for HEAD requests
-    return do_GET(context, path)
+    # The content of GET is generated lazily, dropping it skips serialization
+    status, headers, _ = do_GET(context, path)
+    return status, headers, None
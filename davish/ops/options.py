@@ -3,7 +3,16 @@ from http import client
 from davish.types import Context, WSGIResponse
 from davish.utils import utils_http
 
-ALLOWED_METHODS = ["DELETE", "GET", "HEAD", "OPTIONS", "PROPFIND", "PUT", "REPORT"]
+ALLOWED_METHODS = [
+    "DELETE",
+    "GET",
+    "HEAD",
+    "OPTIONS",
+    "POST",
+    "PROPFIND",
+    "PUT",
+    "REPORT",
+]
 
 
 def do_OPTIONS(
@@ -0,0 +1,198 @@
+import posixpath
+import re
+import socket
+import xml.etree.ElementTree as ET
+from hashlib import sha256
+from http import client
+from typing import Optional
+
+from davish.storage import Collection, Item
+from davish.types import Context, WSGIResponse
+from davish.utils import utils_app, utils_http, utils_path, utils_vobject, utils_xml
+
+# UIDs used as they are in the href of the imported items, the others are
+# hashed
+SAFE_UID = re.compile(r"[A-Za-z0-9][A-Za-z0-9@._+-]{0,127}")
+
+
+def item_href(uid: Optional[str], content: str, extension: str) -> str:
+    """Return the href of an imported item, derived from its UID (or its
+    content when it has none)."""
+    if uid and SAFE_UID.fullmatch(uid):
+        return uid + extension
+    return sha256((uid or content).encode()).hexdigest() + extension
+
+
+def xml_import_response(
+    collection: Collection,
+    href: str,
+    item: Optional[Item],
+    etag: Optional[str],
+    status: int,
+) -> ET.Element:
+    response = ET.Element(utils_xml.make_clark("D:response"))
+    href_element = ET.Element(utils_xml.make_clark("D:href"))
+    uri = utils_path.unstrip_path(posixpath.join(collection.slug, href))
+    href_element.text = utils_xml.make_href(uri)
+    response.append(href_element)
+
+    status_element = ET.Element(utils_xml.make_clark("D:status"))
+    status_element.text = utils_xml.make_response(status)
+    if item is None:
+        response.append(status_element)
+        return response
+
+    propstat = ET.Element(utils_xml.make_clark("D:propstat"))
+    prop = ET.Element(utils_xml.make_clark("D:prop"))
+    getetag = ET.Element(utils_xml.make_clark("D:getetag"))
+    getetag.text = etag
+    prop.append(getetag)
+    propstat.append(prop)
+    propstat.append(status_element)
+    response.append(propstat)
+    return response
+
+
+def do_POST(
+    context: Context,
+    path: str,
+) -> WSGIResponse:
+    """Import a whole iCalendar or vCard file in a calendar or address book,
+    every component (by UID) becomes an item."""
+    try:
+        content = utils_http.read_request_body(context.env)
+    except RuntimeError:
+        return utils_http.BAD_REQUEST
+    except socket.timeout:
+        return utils_http.REQUEST_TIMEOUT
+
+    collection_slug, href = context.storage.split_path(path)
+    collection = context.storage.collection_get(collection_slug)
+    if not collection or href:
+        return utils_http.CONFLICT
+    if collection.is_calendar:
+        tag, extension = "VCALENDAR", ".ics"
+    elif collection.is_address_book:
+        tag, extension = "VCARD", ".vcf"
+    else:
+        return utils_http.CONFLICT
+
+    try:
+        components = utils_vobject.split_components(content)
+    except ValueError:
+        return utils_http.BAD_REQUEST
+    if not components:
+        return utils_http.BAD_REQUEST
+
+    contents: dict[str, str] = {}
+    uids: dict[str, str] = {}
+    refused: list[tuple[str, int]] = []
+    for component_tag, uid, component in components:
+        component_href = item_href(uid, component, extension)
+        if component_tag != tag:
+            # An event can't be imported in an address book, and vice versa
+            refused.append((component_href, client.FORBIDDEN))
+        elif component_href in contents:
+            # Another component of the file has the same UID, only the first
+            # one is imported
+            refused.append((component_href, client.CONFLICT))
+        else:
+            contents[component_href] = component
+            if uid:
+                uids[component_href] = uid
+
+    # An item already stored with one of the UIDs is replaced, whatever its
+    # href, instead of being duplicated
+    if uids:
+        existing = context.storage.items_href_by_uid(uids.values(), collection)
+        renamed = {
+            component_href: existing[uid]
+            for component_href, uid in uids.items()
+            if uid in existing
+        }
+        contents = {
+            renamed.get(component_href, component_href): component
+            for component_href, component in contents.items()
+        }
+
+    # Only keep the collection digest and stats up to date if the storage
+    # persists them, the digests and sizes of the replaced items must be
+    # computed before the upload
+    digest = context.storage.collection_digest_get(collection)
+    stats = context.storage.collection_stats_get(collection)
+    replaced_items: dict[str, Item] = {}
+    if digest is not None or stats is not None:
+        replaced_items = context.storage.items_get_many(contents, collection)
+    replaced: dict[str, int] = {}
+    if digest is not None:
+        for item in replaced_items.values():
+            replaced[item.href] = context.storage.item_digest(item)
+    replaced_sizes: dict[str, int] = {}
+    if stats is not None:
+        replaced_sizes = dict(
+            zip(
+                replaced_items,
+                context.storage.items_size_many(replaced_items.values()),
+            )
+        )
+
+    try:
+        uploaded = context.storage.item_upload_many(contents, collection)
+    except Exception:
+        return utils_http.BAD_REQUEST
+
+    uploaded_items = {
+        uploaded_href: item
+        for uploaded_href, item in uploaded.items()
+        if item is not None
+    }
+    if digest is not None:
+        digest_delta = 0
+        for uploaded_href, item in uploaded_items.items():
+            digest_delta ^= replaced.get(uploaded_href, 0)
+            digest_delta ^= context.storage.item_digest(item)
+        context.storage.collection_digest_update(collection, digest_delta)
+    if stats is not None:
+        removed = [
+            replaced_items[uploaded_href]
+            for uploaded_href in uploaded_items
+            if uploaded_href in replaced_items
+        ]
+        context.storage.collection_stats_update(
+            collection,
+            context.storage.items_stats(uploaded_items.values()),
+            context.storage.items_stats(
+                removed, [replaced_sizes[item.href] for item in removed]
+            ),
+        )
+    context.storage.collection_indexes_update_many(
+        collection, list(uploaded_items.values()), digest
+    )
+    if context.storage.response_cache is not None:
+        context.storage.response_cache.invalidate(context.storage.user, collection.slug)
+
+    etags = dict(
+        zip(
+            uploaded_items,
+            context.storage.items_etag_many(uploaded_items.values()),
+        )
+    )
+    multistatus = ET.Element(utils_xml.make_clark("D:multistatus"))
+    for component_href in contents:
+        item = uploaded_items.get(component_href)
+        if item is None:
+            response = xml_import_response(
+                collection, component_href, None, None, client.BAD_REQUEST
+            )
+        else:
+            response = xml_import_response(
+                collection, component_href, item, etags[component_href], client.OK
+            )
+        multistatus.append(response)
+    for component_href, status in refused:
+        multistatus.append(
+            xml_import_response(collection, component_href, None, None, status)
+        )
+
+    headers = {"Content-Type": "text/xml; charset=utf-8"}
+    return client.MULTI_STATUS, headers, utils_app.xml_response(multistatus)
@@ -1,14 +1,366 @@
 import collections
+import itertools
 import posixpath
 import socket
 import xml.etree.ElementTree as ET
+from dataclasses import dataclass
 from http import client
-from typing import Dict, Iterable, List, Optional, Sequence
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
 
-from davish.storage import Collection, Item
+from davish.ops.report import current_sync_token
+from davish.storage import (
+    SERIALIZE_BATCH_SIZE,
+    Collection,
+    CollectionSummary,
+    Item,
+    format_datetime,
+)
 from davish.types import Context, WSGIResponse
 from davish.utils import utils_app, utils_http, utils_path, utils_xml
 
+D_ALLPROP = utils_xml.make_clark("D:allprop")
+D_PROPNAME = utils_xml.make_clark("D:propname")
+D_PROP = utils_xml.make_clark("D:prop")
+D_PROPSTAT = utils_xml.make_clark("D:propstat")
+D_STATUS = utils_xml.make_clark("D:status")
+D_RESPONSE = utils_xml.make_clark("D:response")
+D_HREF = utils_xml.make_clark("D:href")
+
+
+@dataclass
+class Resource:
+    """The collection or item a D:response is built for."""
+
+    context: Context
+    path: str
+    item: Collection | Item
+    collection: Collection
+    is_collection: bool
+    is_leaf: bool
+    user: str
+    write: bool = False
+    etag: Optional[str] = None
+    serialized: Optional[str] = None
+    size: Optional[int] = None
+    summary: Optional[CollectionSummary] = None
+
+    @property
+    def has_data(self) -> bool:
+        """Whether the resource is an item or a calendar/address book."""
+        return not self.is_collection or self.is_leaf
+
+    @property
+    def is_principal(self) -> bool:
+        return self.is_collection and self.collection.is_principal
+
+    @property
+    def kind(self) -> tuple:
+        """What the properties listed by allprop depend on."""
+        tag = self.collection.tag if self.is_collection else None
+        return (self.is_collection, self.is_leaf, self.is_principal, tag)
+
+    def get_summary(self) -> CollectionSummary:
+        """Return the summary of the collection, the etag, size and
+        last_modified of a collection all come from it."""
+        assert isinstance(self.item, Collection)
+        if self.summary is None:
+            self.summary = self.context.storage.collection_summary(self.item)
+        return self.summary
+
+    def get_etag(self) -> str:
+        if self.etag is None:
+            if isinstance(self.item, Collection):
+                self.etag = self.get_summary().etag
+            else:
+                self.etag = self.context.storage.item_etag(self.item)
+        return self.etag
+
+    def get_serialized(self) -> str:
+        if self.serialized is None:
+            self.serialized = self.context.storage.serialize(self.item)
+        return self.serialized
+
+    def get_size(self) -> int:
+        if self.size is None:
+            if isinstance(self.item, Collection):
+                if self.summary is not None:
+                    self.size = self.summary.size
+                else:
+                    self.size = self.context.storage.collection_size(self.item)
+            else:
+                self.size = self.context.storage.item_size(self.item)
+        return self.size
+
+    def get_last_modified(self) -> str:
+        if isinstance(self.item, Collection):
+            return format_datetime(self.get_summary().last_modified)
+        return self.context.storage.get_last_modified(self.item)
+
+
+# Fill the property element, return False if the resource doesn't have it
+PropertyHandler = Callable[[Resource, ET.Element], bool]
+
+
+@dataclass(frozen=True)
+class Property:
+    handler: PropertyHandler
+    # Whether allprop and propname list the property for a resource, it must
+    # depend only on `Resource.kind`
+    allprop: Optional[Callable[[Resource], bool]] = None
+    # The etags, serializations and sizes of the items are computed in
+    # batches, see `BaseStorage.items_etag_many`,
+    # `BaseStorage.items_serialize_many` and `BaseStorage.items_size_many`
+    needs_etag: bool = False
+    needs_serialization: bool = False
+    needs_size: bool = False
+
+
+# Properties by Clark tag, in the order they are listed by allprop
+PROPERTIES: Dict[str, Property] = {}
+_ALLPROP_TAGS: Dict[tuple, List[str]] = {}
+
+
+def register_property(
+    human_tag: str,
+    allprop: Optional[Callable[[Resource], bool]] = None,
+    needs_etag: bool = False,
+    needs_serialization: bool = False,
+    needs_size: bool = False,
+) -> Callable[[PropertyHandler], PropertyHandler]:
+    """Register the decorated function as the handler of a PROPFIND property,
+    replacing the existing one if any.
+
+    ``allprop`` tells if the property is listed by allprop for a resource.
+
+    """
+
+    def decorator(handler: PropertyHandler) -> PropertyHandler:
+        tag = utils_xml.make_clark(human_tag)
+        PROPERTIES[tag] = Property(
+            handler, allprop, needs_etag, needs_serialization, needs_size
+        )
+        _ALLPROP_TAGS.clear()
+        return handler
+
+    return decorator
+
+
+def allprop_tags(resource: Resource) -> List[str]:
+    """Return the tags of the properties listed by allprop for ``resource``."""
+    kind = resource.kind
+    tags = _ALLPROP_TAGS.get(kind)
+    if tags is None:
+        tags = _ALLPROP_TAGS[kind] = [
+            tag
+            for tag, prop in PROPERTIES.items()
+            if prop.allprop is not None and prop.allprop(resource)
+        ]
+    return tags
+
+
+def _always(resource: Resource) -> bool:
+    return True
+
+
+def _append_href(element: ET.Element, href: str) -> None:
+    child_element = ET.Element(D_HREF)
+    child_element.text = utils_xml.make_href(href)
+    element.append(child_element)
+
+
+@register_property("D:principal-collection-set", allprop=_always)
+def _principal_collection_set(resource: Resource, element: ET.Element) -> bool:
+    _append_href(element, "/")
+    return True
+
+
+@register_property("D:current-user-principal", allprop=_always)
+def _current_user_principal(resource: Resource, element: ET.Element) -> bool:
+    _append_href(element, "/%s/" % resource.user)
+    return True
+
+
+@register_property("D:current-user-privilege-set", allprop=_always)
+def _current_user_privilege_set(resource: Resource, element: ET.Element) -> bool:
+    privileges = ["D:read"]
+    if resource.write:
+        privileges.append("D:all")
+        privileges.append("D:write")
+        privileges.append("D:write-properties")
+        privileges.append("D:write-content")
+    for human_tag in privileges:
+        privilege = ET.Element(utils_xml.make_clark("D:privilege"))
+        privilege.append(ET.Element(utils_xml.make_clark(human_tag)))
+        element.append(privilege)
+    return True
+
+
+@register_property("D:supported-report-set", allprop=_always)
+def _supported_report_set(resource: Resource, element: ET.Element) -> bool:
+    # These 3 reports are not implemented
+    reports = [
+        "D:expand-property",
+        "D:principal-search-property-set",
+        "D:principal-property-search",
+    ]
+    collection = resource.collection
+    if resource.is_collection and resource.is_leaf:
+        reports.append("D:sync-collection")
+        if collection.is_address_book:
+            reports.append("CR:addressbook-multiget")
+            reports.append("CR:addressbook-query")
+        elif collection.is_calendar:
+            reports.append("C:calendar-multiget")
+            reports.append("C:calendar-query")
+    for human_tag in reports:
+        supported_report = ET.Element(utils_xml.make_clark("D:supported-report"))
+        report_element = ET.Element(utils_xml.make_clark("D:report"))
+        report_element.append(ET.Element(utils_xml.make_clark(human_tag)))
+        supported_report.append(report_element)
+        element.append(supported_report)
+    return True
+
+
+@register_property("D:resourcetype", allprop=_always)
+def _resourcetype(resource: Resource, element: ET.Element) -> bool:
+    # resourcetype must be returned empty for non-collection elements
+    if not resource.is_collection:
+        return True
+    collection = resource.collection
+    if collection.is_principal:
+        element.append(ET.Element(utils_xml.make_clark("D:principal")))
+    if resource.is_leaf:
+        if collection.is_address_book:
+            element.append(ET.Element(utils_xml.make_clark("CR:addressbook")))
+        elif collection.is_calendar:
+            element.append(ET.Element(utils_xml.make_clark("C:calendar")))
+    element.append(ET.Element(utils_xml.make_clark("D:collection")))
+    return True
+
+
+@register_property("D:owner", allprop=_always)
+def _owner(resource: Resource, element: ET.Element) -> bool:
+    # return empty elment, if no owner available (rfc3744-5.1)
+    _append_href(element, "/%s/" % resource.user)
+    return True
+
+
+def _is_principal(resource: Resource) -> bool:
+    return resource.is_principal
+
+
+def _principal_href(resource: Resource, element: ET.Element) -> bool:
+    if not resource.is_principal:
+        return False
+    _append_href(element, resource.path)
+    return True
+
+
+for _human_tag in (
+    "C:calendar-user-address-set",
+    "D:principal-URL",
+    "CR:addressbook-home-set",
+    "C:calendar-home-set",
+):
+    register_property(_human_tag, allprop=_is_principal)(_principal_href)
+
+
+def _has_data(resource: Resource) -> bool:
+    return resource.has_data
+
+
+@register_property("D:getetag", allprop=_has_data, needs_etag=True)
+def _getetag(resource: Resource, element: ET.Element) -> bool:
+    if not resource.has_data:
+        return False
+    element.text = resource.get_etag()
+    return True
+
+
+@register_property("D:getlastmodified", allprop=_has_data)
+def _getlastmodified(resource: Resource, element: ET.Element) -> bool:
+    if not resource.has_data:
+        return False
+    element.text = resource.get_last_modified()
+    return True
+
+
+@register_property("D:getcontenttype", allprop=_has_data)
+def _getcontenttype(resource: Resource, element: ET.Element) -> bool:
+    item = resource.item
+    if isinstance(item, Item):
+        element.text = utils_xml.get_content_type(item, "utf-8")
+        return True
+    if not resource.is_leaf or not item.tag:
+        return False
+    element.text = utils_xml.MIMETYPES[item.tag.value]
+    return True
+
+
+@register_property("D:getcontentlength", allprop=_has_data, needs_size=True)
+def _getcontentlength(resource: Resource, element: ET.Element) -> bool:
+    if not resource.has_data:
+        return False
+    try:
+        element.text = str(resource.get_size())
+    except Exception:
+        return False
+    return True
+
+
+def _is_leaf(resource: Resource) -> bool:
+    return resource.is_collection and resource.is_leaf
+
+
+@register_property("D:displayname", allprop=_is_leaf)
+def _displayname(resource: Resource, element: ET.Element) -> bool:
+    if not resource.is_collection:
+        return False
+    displayname = resource.collection.name
+    if not displayname and resource.is_leaf:
+        displayname = resource.collection.slug
+    if displayname is None:
+        return False
+    element.text = displayname
+    return True
+
+
+def _is_calendar(resource: Resource) -> bool:
+    return resource.is_collection and resource.collection.is_calendar
+
+
+@register_property("CS:getctag", allprop=_is_calendar)
+def _getctag(resource: Resource, element: ET.Element) -> bool:
+    if not _is_leaf(resource):
+        return False
+    element.text = resource.get_etag()
+    return True
+
+
+@register_property("C:supported-calendar-component-set", allprop=_is_calendar)
+def _supported_calendar_component_set(
+    resource: Resource,
+    element: ET.Element,
+) -> bool:
+    if not _is_leaf(resource):
+        return False
+    # TODO: add VEVENT and VJOURNAL support
+    # components = ["VTODO", "VEVENT", "VJOURNAL"]
+    components = ["VEVENT"]
+    for component in components:
+        comp = ET.Element(utils_xml.make_clark("C:comp"))
+        comp.set("name", component)
+        element.append(comp)
+    return True
+
+
+@register_property("D:sync-token")
+def _sync_token(resource: Resource, element: ET.Element) -> bool:
+    if not _is_leaf(resource):
+        return False
+    element.text = current_sync_token(resource.context, resource.collection)
+    return True
+
 
 def xml_propfind(
     context: Context,
@@ -16,39 +368,54 @@ def xml_propfind(
     xml_request: Optional[ET.Element],
     items: Iterable[Collection | Item],
     user: str,
-) -> Optional[ET.Element]:
+) -> Iterator[ET.Element]:
     """Read and answer PROPFIND requests.
 
     Read rfc4918-9.1 for info.
 
     The collections parameter is a list of collections that are to be included
-    in the output.
+    in the output, a D:response is generated for each one of them.
 
     """
     # A client may choose not to submit a request body.  An empty PROPFIND
     # request body MUST be treated as if it were an 'allprop' request.
-    top_element = (
-        xml_request[0]
-        if xml_request is not None
-        else ET.Element(utils_xml.make_clark("D:allprop"))
-    )
+    top_element = xml_request[0] if xml_request is not None else ET.Element(D_ALLPROP)
 
     props: List[str] = []
     allprop = False
     propname = False
-    if top_element.tag == utils_xml.make_clark("D:allprop"):
+    if top_element.tag == D_ALLPROP:
         allprop = True
-    elif top_element.tag == utils_xml.make_clark("D:propname"):
+    elif top_element.tag == D_PROPNAME:
         propname = True
-    elif top_element.tag == utils_xml.make_clark("D:prop"):
+    elif top_element.tag == D_PROP:
         props.extend(prop.tag for prop in top_element)
 
-    # Writing answer
-    multistatus = ET.Element(utils_xml.make_clark("D:multistatus"))
+    if allprop:
+        needed = [prop for prop in PROPERTIES.values() if prop.allprop is not None]
+    else:
+        needed = [PROPERTIES[tag] for tag in props if tag in PROPERTIES]
+    with_etag = any(prop.needs_etag for prop in needed)
+    with_data = any(prop.needs_serialization for prop in needed)
+    with_size = any(prop.needs_size for prop in needed)
 
-    for item in items:
-        multistatus.append(
-            xml_propfind_response(
+    items = iter(items)
+    # The etags and serializations of a batch of items are computed at once
+    while batch := list(itertools.islice(items, SERIALIZE_BATCH_SIZE)):
+        leaves = [item for item in batch if isinstance(item, Item)]
+        etags: Iterator[Optional[str]] = itertools.repeat(None)
+        if with_etag:
+            etags = iter(context.storage.items_etag_many(leaves))
+        serialized: Iterator[Optional[str]] = itertools.repeat(None)
+        if with_data:
+            serialized = iter(context.storage.items_serialize_many(leaves))
+        sizes: Iterator[Optional[int]] = itertools.repeat(None)
+        if with_size:
+            sizes = iter(context.storage.items_size_many(leaves))
+
+        for item in batch:
+            is_item = isinstance(item, Item)
+            yield xml_propfind_response(
                 context,
                 path,
                 item,
@@ -57,10 +424,10 @@ def xml_propfind(
                 allprop=allprop,
                 propname=propname,
                 user=user,
+                etag=next(etags) if is_item else None,
+                serialized=next(serialized) if is_item else None,
+                size=next(sizes) if is_item else None,
             )
-        )
-
-    return multistatus
 
 
 def xml_propfind_response(
@@ -72,8 +439,12 @@ def xml_propfind_response(
     propname: bool = False,
     allprop: bool = False,
     user: str = "",
+    etag: Optional[str] = None,
+    serialized: Optional[str] = None,
+    size: Optional[int] = None,
 ) -> ET.Element:
-    """Build and return a PROPFIND response."""
+    """Build and return a PROPFIND response, ``etag``, ``serialized`` and
+    ``size`` are the ones of the item if already known."""
     if propname and allprop or (props and (propname or allprop)):
         raise ValueError("Only use one of props, propname and allprops")
 
@@ -95,200 +466,47 @@ def xml_propfind_response(
     else:
         raise Exception("TODO: should not happen")
 
-    response = ET.Element(utils_xml.make_clark("D:response"))
-    href = ET.Element(utils_xml.make_clark("D:href"))
+    resource = Resource(
+        context=context,
+        path=path,
+        item=item,
+        collection=collection,
+        is_collection=is_collection,
+        is_leaf=is_leaf,
+        user=user,
+        write=write,
+        etag=etag,
+        serialized=serialized,
+        size=size,
+    )
+
+    response = ET.Element(D_RESPONSE)
+    href = ET.Element(D_HREF)
     href.text = utils_xml.make_href(uri)
     response.append(href)
 
     if propname or allprop:
-        props = []
-        # Should list all properties that can be retrieved by the code below
-        props.append(utils_xml.make_clark("D:principal-collection-set"))
-        props.append(utils_xml.make_clark("D:current-user-principal"))
-        props.append(utils_xml.make_clark("D:current-user-privilege-set"))
-        props.append(utils_xml.make_clark("D:supported-report-set"))
-        props.append(utils_xml.make_clark("D:resourcetype"))
-        props.append(utils_xml.make_clark("D:owner"))
-
-        if is_collection and collection.is_principal:
-            props.append(utils_xml.make_clark("C:calendar-user-address-set"))
-            props.append(utils_xml.make_clark("D:principal-URL"))
-            props.append(utils_xml.make_clark("CR:addressbook-home-set"))
-            props.append(utils_xml.make_clark("C:calendar-home-set"))
-
-        if not is_collection or is_leaf:
-            props.append(utils_xml.make_clark("D:getetag"))
-            props.append(utils_xml.make_clark("D:getlastmodified"))
-            props.append(utils_xml.make_clark("D:getcontenttype"))
-            props.append(utils_xml.make_clark("D:getcontentlength"))
-
-        if is_collection:
-            if is_leaf:
-                props.append(utils_xml.make_clark("D:displayname"))
-            if collection.is_calendar:
-                props.append(utils_xml.make_clark("CS:getctag"))
-                props.append(utils_xml.make_clark("C:supported-calendar-component-set"))
+        props = allprop_tags(resource)
 
     responses: Dict[int, List[ET.Element]] = collections.defaultdict(list)
-    if propname:
-        for tag in props:
-            responses[200].append(ET.Element(tag))
-        props = []
     for tag in props:
         element = ET.Element(tag)
-        is404 = False
-        if tag == utils_xml.make_clark("D:getetag"):
-            if not is_collection or is_leaf:
-                if isinstance(item, Collection):
-                    element.text = context.storage.collection_etag(item)
-                else:
-                    element.text = context.storage.item_etag(item)
-            else:
-                is404 = True
-        elif tag == utils_xml.make_clark("D:getlastmodified"):
-            if not is_collection or is_leaf:
-                element.text = context.storage.get_last_modified(item)
-            else:
-                is404 = True
-        elif tag == utils_xml.make_clark("D:principal-collection-set"):
-            child_element = ET.Element(utils_xml.make_clark("D:href"))
-            child_element.text = utils_xml.make_href("/")
-            element.append(child_element)
-        elif (
-            tag
-            in (
-                utils_xml.make_clark("C:calendar-user-address-set"),
-                utils_xml.make_clark("D:principal-URL"),
-                utils_xml.make_clark("CR:addressbook-home-set"),
-                utils_xml.make_clark("C:calendar-home-set"),
-            )
-            and is_collection
-            and collection.is_principal
-        ):
-            child_element = ET.Element(utils_xml.make_clark("D:href"))
-            child_element.text = utils_xml.make_href(path)
-            element.append(child_element)
-        elif tag == utils_xml.make_clark("C:supported-calendar-component-set"):
-            human_tag = utils_xml.make_human_tag(tag)
-            if is_collection and is_leaf:
-                # TODO: add VEVENT and VJOURNAL support
-                # components = ["VTODO", "VEVENT", "VJOURNAL"]
-                components = ["VEVENT"]
-                for component in components:
-                    comp = ET.Element(utils_xml.make_clark("C:comp"))
-                    comp.set("name", component)
-                    element.append(comp)
-            else:
-                is404 = True
-        elif tag == utils_xml.make_clark("D:current-user-principal"):
-            child_element = ET.Element(utils_xml.make_clark("D:href"))
-            child_element.text = utils_xml.make_href("/%s/" % user)
-            element.append(child_element)
-        elif tag == utils_xml.make_clark("D:current-user-privilege-set"):
-            privileges = ["D:read"]
-            if write:
-                privileges.append("D:all")
-                privileges.append("D:write")
-                privileges.append("D:write-properties")
-                privileges.append("D:write-content")
-            for human_tag in privileges:
-                privilege = ET.Element(utils_xml.make_clark("D:privilege"))
-                privilege.append(ET.Element(utils_xml.make_clark(human_tag)))
-                element.append(privilege)
-        elif tag == utils_xml.make_clark("D:supported-report-set"):
-            # These 3 reports are not implemented
-            reports = [
-                "D:expand-property",
-                "D:principal-search-property-set",
-                "D:principal-property-search",
-            ]
-            if is_collection and is_leaf:
-                reports.append("D:sync-collection")
-                if collection.is_address_book:
-                    reports.append("CR:addressbook-multiget")
-                    reports.append("CR:addressbook-query")
-                elif collection.is_calendar:
-                    reports.append("C:calendar-multiget")
-                    reports.append("C:calendar-query")
-            for human_tag in reports:
-                supported_report = ET.Element(
-                    utils_xml.make_clark("D:supported-report")
-                )
-                report_element = ET.Element(utils_xml.make_clark("D:report"))
-                report_element.append(ET.Element(utils_xml.make_clark(human_tag)))
-                supported_report.append(report_element)
-                element.append(supported_report)
-        elif tag == utils_xml.make_clark("D:getcontentlength"):
-            if not is_collection or is_leaf:
-                try:
-                    element.text = str(
-                        len(context.storage.serialize(item).encode("utf-8"))
-                    )
-                except Exception:
-                    is404 = True
-            else:
-                is404 = True
-        elif tag == utils_xml.make_clark("D:owner"):
-            # return empty elment, if no owner available (rfc3744-5.1)
-            child_element = ET.Element(utils_xml.make_clark("D:href"))
-            child_element.text = utils_xml.make_href("/%s/" % user)
-            element.append(child_element)
-        elif is_collection:
-            if tag == utils_xml.make_clark("D:getcontenttype"):
-                if is_leaf and collection.tag:
-                    element.text = utils_xml.MIMETYPES[collection.tag.value]
-                else:
-                    is404 = True
-            elif tag == utils_xml.make_clark("D:resourcetype"):
-                if collection.is_principal:
-                    child_element = ET.Element(utils_xml.make_clark("D:principal"))
-                    element.append(child_element)
-                if is_leaf:
-                    if collection.is_address_book:
-                        child_element = ET.Element(
-                            utils_xml.make_clark("CR:addressbook")
-                        )
-                        element.append(child_element)
-                    elif collection.is_calendar:
-                        child_element = ET.Element(utils_xml.make_clark("C:calendar"))
-                        element.append(child_element)
-                child_element = ET.Element(utils_xml.make_clark("D:collection"))
-                element.append(child_element)
-            elif tag == utils_xml.make_clark("D:displayname"):
-                displayname = collection.name
-                if not displayname and is_leaf:
-                    displayname = collection.slug
-                if displayname is not None:
-                    element.text = displayname
-                else:
-                    is404 = True
-            elif tag == utils_xml.make_clark("CS:getctag"):
-                if is_leaf:
-                    element.text = context.storage.collection_etag(collection)
-                else:
-                    is404 = True
-
-        # Not for collections
-        elif tag == utils_xml.make_clark("D:getcontenttype"):
-            assert not isinstance(item, Collection)
-            element.text = utils_xml.get_content_type(item, "utf-8")
-        elif tag == utils_xml.make_clark("D:resourcetype"):
-            # resourcetype must be returned empty for non-collection elements
-            pass
+        if propname:
+            found = True
         else:
-            is404 = True
-
-        responses[404 if is404 else 200].append(element)
+            prop = PROPERTIES.get(tag)
+            found = prop is not None and prop.handler(resource, element)
+        responses[200 if found else 404].append(element)
 
     for status_code, childs in responses.items():
         if not childs:
             continue
-        propstat = ET.Element(utils_xml.make_clark("D:propstat"))
+        propstat = ET.Element(D_PROPSTAT)
         response.append(propstat)
-        prop = ET.Element(utils_xml.make_clark("D:prop"))
-        prop.extend(childs)
-        propstat.append(prop)
-        status = ET.Element(utils_xml.make_clark("D:status"))
+        prop_element = ET.Element(D_PROP)
+        prop_element.extend(childs)
+        propstat.append(prop_element)
+        status = ET.Element(D_STATUS)
         status.text = utils_xml.make_response(status_code)
         propstat.append(status)
 
@@ -306,22 +524,24 @@ def do_PROPFIND(
     except socket.timeout:
         return utils_http.REQUEST_TIMEOUT
 
-    items = context.storage.discover(path, context.env.get("HTTP_DEPTH", "0"))
-    if not items:
+    items = iter(
+        context.storage.discover_iter(path, context.env.get("HTTP_DEPTH", "0"))
+    )
+    first_item = next(items, None)
+    if first_item is None:
         return utils_http.NOT_FOUND
 
     headers = {
         "DAV": utils_http.DAV_HEADERS,
         "Content-Type": "text/xml; charset=utf-8",
     }
-    xml_answer = xml_propfind(
+    responses = xml_propfind(
         context,
         path,
         xml_content,
-        items,
+        itertools.chain([first_item], items),
         user=context.storage.user,
     )
-    if xml_answer is None:
-        return utils_http.NOT_ALLOWED
+    multistatus = ET.Element(utils_xml.make_clark("D:multistatus"))
 
-    return client.MULTI_STATUS, headers, utils_app.xml_response(xml_answer)
+    return client.MULTI_STATUS, headers, utils_app.xml_stream(multistatus, responses)
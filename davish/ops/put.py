@@ -43,6 +43,17 @@ def do_PUT(
         # Creation asked but item found: item can't be replaced
         return utils_http.PRECONDITION_FAILED
 
+    # Only keep the collection digest up to date if the storage persists it,
+    # the digest of the replaced item must be computed before the upload
+    digest = context.storage.collection_digest_get(collection)
+    digest_delta = None
+    if digest is not None:
+        digest_delta = context.storage.item_digest(maybe_item) if maybe_item else 0
+    # Same for the collection stats and the size of the replaced item
+    removed = None
+    if context.storage.collection_stats_get(collection) is not None:
+        removed = context.storage.items_stats([maybe_item] if maybe_item else [])
+
     try:
         uploaded_item = context.storage.item_upload(
             item_href,
@@ -55,5 +66,17 @@ def do_PUT(
     if not uploaded_item:
         return utils_http.BAD_REQUEST
 
+    if digest_delta is not None:
+        digest_delta ^= context.storage.item_digest(uploaded_item)
+        context.storage.collection_digest_update(collection, digest_delta)
+    if removed is not None:
+        added = context.storage.items_stats([uploaded_item])
+        context.storage.collection_stats_update(collection, added, removed)
+    context.storage.collection_indexes_update(
+        collection, item_href, uploaded_item, digest
+    )
+    if context.storage.response_cache is not None:
+        context.storage.response_cache.invalidate(context.storage.user, collection.slug)
+
     headers = {"ETag": context.storage.item_etag(uploaded_item)}
     return client.CREATED, headers, None
@@ -1,29 +1,53 @@
+import bisect
+import itertools
 import posixpath
 import socket
 import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
 from http import client
 from typing import Iterable, Iterator, Optional, Sequence, Tuple
 from urllib.parse import unquote, urlparse
 
-from davish.storage import Collection, Item
+from davish.filters import AddressbookFilter, ParamFilter, PropFilter, TextMatch
+from davish.index import TIME_RANGE_MAX, TIME_RANGE_MIN, SyncIndex
+from davish.storage import SERIALIZE_BATCH_SIZE, Collection, Item
 from davish.types import Context, WSGIResponse
 from davish.utils import utils_app, utils_http, utils_path, utils_xml
 
+# Reports recognized by `xml_report`, the others are measured as "OTHER" so
+# that clients can't grow the metrics at will
+KNOWN_REPORTS = frozenset(
+    utils_xml.make_clark(human_tag)
+    for human_tag in (
+        "D:principal-search-property-set",
+        "D:principal-property-search",
+        "D:expand-property",
+        "D:sync-collection",
+        "C:calendar-multiget",
+        "C:calendar-query",
+        "CR:addressbook-multiget",
+        "CR:addressbook-query",
+    )
+)
+
 
 def xml_report(
     context: Context,
     path: str,
     xml_request: Optional[ET.Element],
     collection: Collection,
-) -> Tuple[int, ET.Element]:
+) -> Tuple[int, ET.Element, Iterable[ET.Element]]:
     """Read and answer REPORT requests.
 
     Read rfc3253-3.6 for info.
 
+    Returns the status, the root element and the elements to append to it,
+    which are generated while the response is written.
+
     """
     multistatus = ET.Element(utils_xml.make_clark("D:multistatus"))
     if xml_request is None:
-        return client.MULTI_STATUS, multistatus
+        return client.MULTI_STATUS, multistatus, ()
     root = xml_request
     if root.tag in (
         utils_xml.make_clark("D:principal-search-property-set"),
@@ -34,76 +58,169 @@ def xml_report(
         # properties, just return an empty result.
         # InfCloud asks for expand-property reports (even if we don't announce
         # support for them) and stops working if an error code is returned.
-        return client.MULTI_STATUS, multistatus
+        return client.MULTI_STATUS, multistatus, ()
     if (
         root.tag == utils_xml.make_clark("C:calendar-multiget")
         and not collection.is_calendar
         or root.tag == utils_xml.make_clark("CR:addressbook-multiget")
         and not collection.is_address_book
         or root.tag == utils_xml.make_clark("D:sync-collection")
-        and collection.tag not in ("VADDRESSBOOK", "VCALENDAR")
+        and not (collection.is_calendar or collection.is_address_book)
     ):
-        return client.FORBIDDEN, utils_xml.webdav_error("D:supported-report")
+        return client.FORBIDDEN, utils_xml.webdav_error("D:supported-report"), ()
     prop_element = root.find(utils_xml.make_clark("D:prop"))
     props = [prop.tag for prop in prop_element] if prop_element is not None else []
 
+    sync_token: Optional[str] = None
+    truncated = False
     hreferences: Iterable[str]
-    if root.tag in (
-        utils_xml.make_clark("C:calendar-multiget"),
-        utils_xml.make_clark("CR:addressbook-multiget"),
-    ):
-        # Read rfc4791-7.9 for info
-        hreferences = set()
-        for href_element in root.findall(utils_xml.make_clark("D:href")):
-            temp_url_path = urlparse(href_element.text).path
-            assert isinstance(temp_url_path, str)
-            href_path = utils_path.sanitize_path(unquote(temp_url_path))
-            if (href_path + "/").startswith("/"):
-                hreferences.add(href_path)
-
+    retrieved_items: list[Item]
+    if root.tag == utils_xml.make_clark("D:sync-collection"):
+        limit = results_limit(context, root)
+        synced = sync_items(context, collection, root, multistatus, limit)
+        if synced is None:
+            error = utils_xml.webdav_error("D:valid-sync-token")
+            return client.FORBIDDEN, error, ()
+        sync_token, retrieved_items, truncated = synced
+    elif root.tag in (
+        utils_xml.make_clark("C:calendar-query"),
+        utils_xml.make_clark("CR:addressbook-query"),
+    ) and (path.strip("/") == collection.slug):
+        limit = results_limit(context, root)
+        if root.tag == utils_xml.make_clark("C:calendar-query"):
+            retrieved_items = calendar_query_items(context, collection, root)
+        else:
+            retrieved_items = addressbook_query_items(context, collection, root)
+        if limit is not None and len(retrieved_items) > limit:
+            # Answer the first items by href, read rfc6352-8.6.1 for info
+            retrieved_items = sorted(retrieved_items, key=lambda item: item.href)
+            retrieved_items = retrieved_items[:limit]
+            truncated = True
     else:
-        hreferences = (path,)
+        if root.tag in (
+            utils_xml.make_clark("C:calendar-multiget"),
+            utils_xml.make_clark("CR:addressbook-multiget"),
+        ):
+            # Read rfc4791-7.9 for info
+            hreferences = set()
+            for href_element in root.findall(utils_xml.make_clark("D:href")):
+                temp_url_path = urlparse(href_element.text).path
+                assert isinstance(temp_url_path, str)
+                href_path = utils_path.sanitize_path(unquote(temp_url_path))
+                if (href_path + "/").startswith("/"):
+                    hreferences.add(href_path)
+
+        else:
+            hreferences = (path,)
+
+        # Retrieve everything required for finishing the request.
+        retrieved_items = list(
+            retrieve_items(context, collection, hreferences, multistatus)
+        )
+
+    responses = xml_report_responses(
+        context,
+        collection,
+        props,
+        retrieved_items,
+        sync_token,
+        truncated_href=path if truncated else None,
+    )
+    return client.MULTI_STATUS, multistatus, responses
 
-    # Retrieve everything required for finishing the request.
-    retrieved_items = list(
-        retrieve_items(context, collection, hreferences, multistatus)
+
+def xml_report_responses(
+    context: Context,
+    collection: Collection,
+    props: Sequence[str],
+    items: Sequence[Item],
+    sync_token: Optional[str] = None,
+    truncated_href: Optional[str] = None,
+) -> Iterator[ET.Element]:
+    """Generate the D:response of every item, followed by the
+    number-of-matches-within-limits response for ``truncated_href`` and the
+    D:sync-token if given."""
+    with_data = (
+        utils_xml.make_clark("C:calendar-data") in props
+        or utils_xml.make_clark("CR:address-data") in props
     )
+    with_etag = utils_xml.make_clark("D:getetag") in props
 
-    while retrieved_items:
-        item = retrieved_items.pop(0)
-
-        found_props = []
-        not_found_props = []
-
-        for tag in props:
-            element = ET.Element(tag)
-            if tag == utils_xml.make_clark("D:getetag"):
-                element.text = context.storage.item_etag(item)
-                found_props.append(element)
-            elif tag == utils_xml.make_clark("D:getcontenttype"):
-                element.text = utils_xml.get_content_type(item, "utf-8")
-                found_props.append(element)
-            elif tag in (
-                utils_xml.make_clark("C:calendar-data"),
-                utils_xml.make_clark("CR:address-data"),
-            ):
-                element.text = context.storage.item_serialize(item)
-                found_props.append(element)
-            else:
-                not_found_props.append(element)
-
-        assert item.href
-        uri = utils_path.unstrip_path(posixpath.join(collection.slug, item.href))
-        multistatus.append(
-            xml_item_response(
-                uri,
-                found_props=found_props,
-                not_found_props=not_found_props,
-                found_item=True,
+    # Items are serialized in batches to keep the memory usage bounded
+    for start in range(0, len(items), SERIALIZE_BATCH_SIZE):
+        batch = items[start : start + SERIALIZE_BATCH_SIZE]
+        if with_data:
+            serialized = context.storage.items_serialize_many(batch)
+        else:
+            serialized = [""] * len(batch)
+        etags: Sequence[Optional[str]] = [None] * len(batch)
+        if with_etag:
+            etags = context.storage.items_etag_many(batch)
+
+        for item, item_serialized, etag in zip(batch, serialized, etags):
+            yield xml_report_response(
+                context, collection, props, item, item_serialized, etag
             )
-        )
 
-    return client.MULTI_STATUS, multistatus
+    if truncated_href is not None:
+        yield xml_truncated_response(truncated_href)
+
+    if sync_token is not None:
+        sync_token_element = ET.Element(utils_xml.make_clark("D:sync-token"))
+        sync_token_element.text = sync_token
+        yield sync_token_element
+
+
+def xml_report_response(
+    context: Context,
+    collection: Collection,
+    props: Sequence[str],
+    item: Item,
+    item_serialized: str,
+    etag: Optional[str] = None,
+) -> ET.Element:
+    found_props = []
+    not_found_props = []
+
+    for tag in props:
+        element = ET.Element(tag)
+        if tag == utils_xml.make_clark("D:getetag"):
+            element.text = etag or context.storage.item_etag(item)
+            found_props.append(element)
+        elif tag == utils_xml.make_clark("D:getcontenttype"):
+            element.text = utils_xml.get_content_type(item, "utf-8")
+            found_props.append(element)
+        elif tag in (
+            utils_xml.make_clark("C:calendar-data"),
+            utils_xml.make_clark("CR:address-data"),
+        ):
+            element.text = item_serialized
+            found_props.append(element)
+        else:
+            not_found_props.append(element)
+
+    assert item.href
+    uri = utils_path.unstrip_path(posixpath.join(collection.slug, item.href))
+    return xml_item_response(
+        uri,
+        found_props=found_props,
+        not_found_props=not_found_props,
+        found_item=True,
+    )
+
+
+def xml_truncated_response(href: str) -> ET.Element:
+    """Return the response telling that the results of a report have been
+    truncated, read rfc5323-5.17 for info."""
+    response = ET.Element(utils_xml.make_clark("D:response"))
+    href_element = ET.Element(utils_xml.make_clark("D:href"))
+    href_element.text = utils_xml.make_href(href)
+    response.append(href_element)
+    status = ET.Element(utils_xml.make_clark("D:status"))
+    status.text = utils_xml.make_response(client.INSUFFICIENT_STORAGE)
+    response.append(status)
+    response.append(utils_xml.webdav_error("D:number-of-matches-within-limits"))
+    return response
 
 
 def xml_item_response(
@@ -138,6 +255,289 @@ def xml_item_response(
     return response
 
 
+def results_limit(context: Context, root: ET.Element) -> Optional[int]:
+    """Return the maximum number of results of a report, the lowest between
+    the DAV:limit of the request and the storage ``max_results``."""
+    limits = [context.storage.max_results, parse_limit(root)]
+    return min((limit for limit in limits if limit is not None), default=None)
+
+
+def parse_limit(root: ET.Element) -> Optional[int]:
+    """Read the DAV:limit (CR:limit for addressbook-query) of a report, read
+    rfc6578-6.3 and rfc6352-10.6 for info."""
+    for ns_prefix in ("D", "CR"):
+        limit = root.find(utils_xml.make_clark("%s:limit" % ns_prefix))
+        if limit is None:
+            continue
+        nresults = limit.find(utils_xml.make_clark("%s:nresults" % ns_prefix))
+        if nresults is None or not nresults.text:
+            raise ValueError("Missing nresults in limit")
+        value = int(nresults.text.strip())
+        if value < 1:
+            raise ValueError("Invalid nresults: %d" % value)
+        return value
+    return None
+
+
+def parse_time_range(element: ET.Element) -> Tuple[int, int]:
+    """Read the start and end of a C:time-range as timestamps."""
+    bounds = []
+    for attribute, default in (("start", TIME_RANGE_MIN), ("end", TIME_RANGE_MAX)):
+        value = element.get(attribute)
+        if value is None:
+            bounds.append(default)
+            continue
+        dt = datetime.strptime(value, "%Y%m%dT%H%M%SZ")
+        bounds.append(int(dt.replace(tzinfo=timezone.utc).timestamp()))
+    return bounds[0], bounds[1]
+
+
+def calendar_query_items(
+    context: Context,
+    collection: Collection,
+    root: ET.Element,
+) -> list[Item]:
+    """Read the filter of a calendar-query request, read rfc4791-9.7 for info.
+
+    Only comp-filter, is-not-defined and time-range are evaluated, prop-filter
+    and param-filter are ignored so they match every item.
+
+    """
+    filter_element = root.find(utils_xml.make_clark("C:filter"))
+    if filter_element is None:
+        return list(context.storage.collection_items(collection))
+
+    calendar_filter = filter_element.find(utils_xml.make_clark("C:comp-filter"))
+    if calendar_filter is None or calendar_filter.get("name") != "VCALENDAR":
+        return []
+
+    # Component names and whether they must be defined or not
+    components: list[Tuple[str, bool]] = []
+    time_ranges: list[Tuple[int, int]] = []
+
+    time_range = calendar_filter.find(utils_xml.make_clark("C:time-range"))
+    if time_range is not None:
+        time_ranges.append(parse_time_range(time_range))
+
+    for comp_filter in calendar_filter.findall(utils_xml.make_clark("C:comp-filter")):
+        name = comp_filter.get("name", "")
+        if comp_filter.find(utils_xml.make_clark("C:is-not-defined")) is not None:
+            components.append((name, False))
+            continue
+        components.append((name, True))
+        time_range = comp_filter.find(utils_xml.make_clark("C:time-range"))
+        if time_range is not None:
+            time_ranges.append(parse_time_range(time_range))
+
+    items: Optional[list[Item]] = None
+    for start, end in time_ranges:
+        try:
+            in_range = context.storage.collection_items_in_range(collection, start, end)
+        except NotImplementedError:
+            # The storage can't tell the time range of its items
+            continue
+        if items is None:
+            items = in_range
+        else:
+            hrefs = {item.href for item in in_range}
+            items = [item for item in items if item.href in hrefs]
+
+    if items is None:
+        items = list(context.storage.collection_items(collection))
+
+    return [
+        item
+        for item in items
+        if all((item.tag.value == name) == defined for name, defined in components)
+    ]
+
+
+def parse_text_match(element: ET.Element) -> TextMatch:
+    return TextMatch(
+        value=element.text or "",
+        match_type=element.get("match-type", "contains"),
+        collation=element.get("collation", "i;unicode-casemap"),
+        negate=element.get("negate-condition", "no") == "yes",
+    )
+
+
+def parse_addressbook_filter(element: ET.Element) -> AddressbookFilter:
+    """Read the CR:filter of an addressbook-query, read rfc6352-10.5 for info."""
+    prop_filters = []
+    for prop_filter_element in element.findall(utils_xml.make_clark("CR:prop-filter")):
+        param_filters = []
+        for param_filter_element in prop_filter_element.findall(
+            utils_xml.make_clark("CR:param-filter")
+        ):
+            text_match_element = param_filter_element.find(
+                utils_xml.make_clark("CR:text-match")
+            )
+            param_filters.append(
+                ParamFilter(
+                    name=param_filter_element.get("name", ""),
+                    is_not_defined=param_filter_element.find(
+                        utils_xml.make_clark("CR:is-not-defined")
+                    )
+                    is not None,
+                    text_match=(
+                        parse_text_match(text_match_element)
+                        if text_match_element is not None
+                        else None
+                    ),
+                )
+            )
+        prop_filters.append(
+            PropFilter(
+                name=prop_filter_element.get("name", ""),
+                test=prop_filter_element.get("test", "anyof"),
+                is_not_defined=prop_filter_element.find(
+                    utils_xml.make_clark("CR:is-not-defined")
+                )
+                is not None,
+                text_matches=[
+                    parse_text_match(text_match_element)
+                    for text_match_element in prop_filter_element.findall(
+                        utils_xml.make_clark("CR:text-match")
+                    )
+                ],
+                param_filters=param_filters,
+            )
+        )
+    return AddressbookFilter(
+        test=element.get("test", "anyof"),
+        prop_filters=prop_filters,
+    )
+
+
+def addressbook_query_items(
+    context: Context,
+    collection: Collection,
+    root: ET.Element,
+) -> list[Item]:
+    """Read the filter of an addressbook-query request."""
+    filter_element = root.find(utils_xml.make_clark("CR:filter"))
+    if filter_element is None:
+        return list(context.storage.collection_items(collection))
+
+    card_filter = parse_addressbook_filter(filter_element)
+    return context.storage.collection_items_matching(collection, card_filter)
+
+
+def current_sync_token(context: Context, collection: Collection) -> str:
+    """Return the DAV:sync-token of ``collection``."""
+    token = context.storage.collection_sync_token(collection)
+    if token is None:
+        token = context.storage.collection_etag(collection).strip('"')
+    return utils_xml.make_sync_token(token)
+
+
+def sync_items(
+    context: Context,
+    collection: Collection,
+    root: ET.Element,
+    multistatus: ET.Element,
+    limit: Optional[int] = None,
+) -> Optional[Tuple[str, list[Item], bool]]:
+    """Read a sync-collection request, read rfc6578-3.2 for info.
+
+    Returns the new sync token and the items added or modified since the
+    token sent by the client, and adds 404 responses for the deleted ones to
+    ``multistatus``. ``None`` is returned if the token is not valid, or if
+    the storage has no change log and the token isn't remembered by its
+    ``SyncIndex``.
+
+    Changes are answered in href order, at most ``limit`` of them: when some
+    are left out the token returned is a continuation one and the returned
+    flag is True, read rfc6578-3.6 for info.
+
+    """
+    sync_token_element = root.find(utils_xml.make_clark("D:sync-token"))
+    old_sync_token = ""
+    if sync_token_element is not None and sync_token_element.text:
+        old_sync_token = sync_token_element.text.strip()
+
+    # The token to sync from (empty for an initial sync) and, when resuming a
+    # truncated sync, the token to return once done and the last href sent
+    base = ""
+    resume_token: Optional[str] = None
+    after = ""
+    if old_sync_token:
+        continuation = utils_xml.parse_sync_continuation(old_sync_token)
+        if continuation is not None:
+            resume_token, base, after = continuation
+        else:
+            parsed = utils_xml.parse_sync_token(old_sync_token)
+            if not parsed:
+                return None
+            base = parsed
+
+    items: dict[str, Item] = {}
+    changed: set[str] = set()
+    deleted: set[str] = set()
+    token = context.storage.collection_sync_token(collection)
+    if token is None:
+        # Without a change log the collection tag is used as token, and the
+        # changes since a token are found by comparing the items with the
+        # ones seen when it was sent, as long as the indexes remember them
+        token = context.storage.collection_etag(collection).strip('"')
+        if resume_token is not None and resume_token != token:
+            # The collection changed between two pages
+            return None
+        changes = None
+        if context.storage.indexes is not None:
+            with context.storage.indexes.get(
+                SyncIndex, context.storage, collection
+            ) as index:
+                if base and base != token:
+                    changes = index.changes(base)
+                index.remember(token)
+        if not base:
+            items = {i.href: i for i in context.storage.collection_items(collection)}
+        elif base != token:
+            if changes is None:
+                return None
+            changed = set(changes[0])
+            deleted = set(changes[1])
+    elif not base:
+        # Initial sync, the token is read before listing the items so that
+        # nothing changed in between can be lost
+        items = {i.href: i for i in context.storage.collection_items(collection)}
+    else:
+        changes = context.storage.collection_changes(collection, base)
+        if changes is None:
+            return None
+        token = changes.sync_token
+        changed = set(changes.added + changes.modified)
+        deleted = set(changes.deleted) - changed
+
+    if resume_token is not None:
+        token = resume_token
+    hrefs = sorted(itertools.chain(items, changed, deleted))
+    if after:
+        hrefs = hrefs[bisect.bisect_right(hrefs, after) :]
+
+    truncated = limit is not None and len(hrefs) > limit
+    if truncated:
+        hrefs = hrefs[:limit]
+        sync_token = utils_xml.make_sync_continuation(token, base, hrefs[-1])
+    else:
+        sync_token = utils_xml.make_sync_token(token)
+
+    found = {href: items[href] for href in hrefs if href in items}
+    if changed:
+        # Only the changed items of the page are looked up
+        lookup = [href for href in hrefs if href in changed]
+        found.update(context.storage.items_get_many(lookup, collection))
+
+    for href in hrefs:
+        # Items removed after being logged as changed are gone as well
+        if href not in found:
+            uri = utils_path.unstrip_path(posixpath.join(collection.slug, href))
+            multistatus.append(xml_item_response(uri, found_item=False))
+
+    return sync_token, [found[href] for href in hrefs if href in found], truncated
+
+
 def retrieve_items(
     context: Context,
     collection: Collection,
@@ -172,8 +572,7 @@ def retrieve_items(
             # Reference is a collection
             collection_requested = True
 
-    collection_items = context.storage.collection_items(collection)
-    items_hrefs = {i.href: i for i in collection_items}
+    items_hrefs = context.storage.items_get_many(hreference_names, collection)
     for href in hreference_names:
         item = items_hrefs.get(href, None)
         if not item:
@@ -184,7 +583,7 @@ def retrieve_items(
             yield item
 
     if collection_requested:
-        for item in collection_items:
+        for item in context.storage.collection_items(collection):
             yield item
 
 
@@ -199,6 +598,13 @@ def do_REPORT(
     except socket.timeout:
         return utils_http.REQUEST_TIMEOUT
 
+    if context.metrics is not None and xml_content is not None:
+        if xml_content.tag in KNOWN_REPORTS:
+            report = utils_xml.make_human_tag(xml_content.tag)
+        else:
+            report = "OTHER"
+        context.metrics.report = report
+
     item = context.storage.get(path)
     if not item:
         return utils_http.NOT_FOUND
@@ -210,7 +616,7 @@ def do_REPORT(
         collection = item.collection
 
     try:
-        status, xml_answer = xml_report(
+        status, xml_answer, responses = xml_report(
             context,
             path,
             xml_content,
@@ -220,4 +626,6 @@ def do_REPORT(
         return utils_http.BAD_REQUEST
 
     headers = {"Content-Type": "text/xml; charset=utf-8"}
-    return status, headers, utils_app.xml_response(xml_answer)
+    if status != client.MULTI_STATUS:
+        return status, headers, utils_app.xml_response(xml_answer)
+    return status, headers, utils_app.xml_stream(xml_answer, responses)
@@ -0,0 +1,271 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Mapping, Optional
+
+from davish.storage import BaseStorage, Collection, CollectionStats, Item, ItemBatch
+
+if TYPE_CHECKING:
+    from davish.metrics import StorageProbe
+
+
+class RequestStorage(BaseStorage):
+    """The storage seen by a single request, wrapping the storage passed to
+    ``handle_dav_request``.
+
+    With ``memoize`` the lookups (``collection_get``, ``collection_items``,
+    ``item_get``, ``item_serialize`` and their batched variants,
+    ``item_etag`` and the collection digest and stats hooks) are memoized for the
+    request. ``item_upload``, ``item_upload_many`` and ``item_delete`` drop
+    everything memoized for the collection they touch. Only the last
+    ``max_serialized`` serializations are kept, so memory doesn't grow with
+    the size of the collections a streamed response goes through.
+
+    The ``BaseStorage`` methods the storage overrides are delegated to it,
+    the others run on the wrapper so they go through the memo too. Other
+    attributes are read from the storage. With a ``probe`` the calls are
+    measured, see ``StorageProbe``.
+
+    """
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        memoize: bool = True,
+        probe: Optional["StorageProbe"] = None,
+        max_serialized: int = 1000,
+    ) -> None:
+        self.storage = storage
+        self.memoize = memoize
+        self.probe = probe
+        self.max_serialized = max_serialized
+        self.user = storage.user
+        self.etag_cache = storage.etag_cache
+        self.response_cache = storage.response_cache
+        self.indexes = storage.indexes
+        self.executor = storage.executor
+        self.max_parallel = storage.max_parallel
+        self.max_results = storage.max_results
+        self.overridden = _overridden(type(storage))
+        self.collections: dict[str, Optional[Collection]] = {}
+        self.listings: dict[str, list[Item] | ItemBatch] = {}
+        self.items: dict[tuple[str, str], Optional[Item]] = {}
+        self.serialized: OrderedDict[tuple[str, str, Any], str] = OrderedDict()
+        self.etags: dict[tuple[str, str, Any], str] = {}
+        self.digests: dict[str, Optional[int]] = {}
+        self.stats: dict[str, Optional[CollectionStats]] = {}
+        # Items may be serialized in parallel, see `BaseStorage.executor`
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for what the wrapper doesn't define, like the methods
+        # specific to a storage
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def call(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        """Call the ``name`` method of the storage, or its ``BaseStorage``
+        implementation on the wrapper when the storage doesn't override it."""
+        if name in self.overridden:
+            function = getattr(self.storage, name)
+        else:
+            function = getattr(BaseStorage, name).__get__(self)
+        if self.probe is None:
+            return function(*args, **kwargs)
+        return self.probe.call(name, function, *args, **kwargs)
+
+    def invalidate(self, collection: Collection) -> None:
+        """Forget everything memoized about the items of ``collection``."""
+        slug = collection.slug
+        self.listings.pop(slug, None)
+        self.digests.pop(slug, None)
+        self.stats.pop(slug, None)
+        for key in [key for key in self.items if key[0] == slug]:
+            del self.items[key]
+        with self._lock:
+            for key in [key for key in self.serialized if key[0] == slug]:
+                del self.serialized[key]
+        for key in [key for key in self.etags if key[0] == slug]:
+            del self.etags[key]
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        if not self.memoize:
+            return self.call("collection_get", slug)
+        if slug not in self.collections:
+            self.collections[slug] = self.call("collection_get", slug)
+        return self.collections[slug]
+
+    def collection_items(self, collection: Collection) -> list[Item] | ItemBatch:
+        if not self.memoize:
+            return self.call("collection_items", collection)
+        slug = collection.slug
+        if slug not in self.listings:
+            self.listings[slug] = self.call("collection_items", collection)
+        return self.listings[slug]
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        if not self.memoize:
+            return self.call("item_get", href, collection)
+        key = (collection.slug, href)
+        if key not in self.items:
+            self.items[key] = self.call("item_get", href, collection)
+        return self.items[key]
+
+    def item_serialize(self, item: Item) -> str:
+        if not self.memoize:
+            return self.call("item_serialize", item)
+        key = (item.collection.slug, item.href, item.last_modified)
+        with self._lock:
+            serialized = self.serialized.get(key)
+            if serialized is not None:
+                self.serialized.move_to_end(key)
+                return serialized
+        serialized = self.call("item_serialize", item)
+        self._remember_serialized(key, serialized)
+        return serialized
+
+    def _remember_serialized(self, key: tuple[str, str, Any], serialized: str) -> None:
+        with self._lock:
+            self.serialized[key] = serialized
+            while len(self.serialized) > self.max_serialized:
+                self.serialized.popitem(last=False)
+
+    def item_etag(self, item: Item) -> str:
+        if not self.memoize:
+            return self.call("item_etag", item)
+        if item.etag is not None:
+            return item.etag
+        key = (item.collection.slug, item.href, item.last_modified)
+        if key not in self.etags:
+            self.etags[key] = self.call("item_etag", item)
+        return self.etags[key]
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        if not self.memoize:
+            return self.call("items_get_many", hrefs, collection)
+        slug = collection.slug
+        hrefs = list(hrefs)
+        missing = [href for href in hrefs if (slug, href) not in self.items]
+        if missing:
+            found = self.call("items_get_many", missing, collection)
+            for href in missing:
+                self.items[(slug, href)] = found.get(href)
+
+        items = {}
+        for href in hrefs:
+            item = self.items[(slug, href)]
+            if item is not None:
+                items[href] = item
+        return items
+
+    def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        if not self.memoize:
+            return self.call("items_serialize_many", items)
+        items = list(items)
+        keys = [(item.collection.slug, item.href, item.last_modified) for item in items]
+        with self._lock:
+            found = {
+                key: self.serialized[key] for key in keys if key in self.serialized
+            }
+        missing = {key: item for key, item in zip(keys, items) if key not in found}
+        if missing:
+            serialized = self.call("items_serialize_many", list(missing.values()))
+            for key, item_serialized in zip(missing, serialized):
+                found[key] = item_serialized
+                self._remember_serialized(key, item_serialized)
+        return [found[key] for key in keys]
+
+    def collection_digest_get(self, collection: Collection) -> Optional[int]:
+        if not self.memoize:
+            return self.call("collection_digest_get", collection)
+        slug = collection.slug
+        if slug not in self.digests:
+            self.digests[slug] = self.call("collection_digest_get", collection)
+        return self.digests[slug]
+
+    def collection_digest_set(self, collection: Collection, digest: int) -> None:
+        if self.memoize:
+            self.digests[collection.slug] = digest
+        self.call("collection_digest_set", collection, digest)
+
+    def collection_stats_get(self, collection: Collection) -> Optional[CollectionStats]:
+        if not self.memoize:
+            return self.call("collection_stats_get", collection)
+        slug = collection.slug
+        if slug not in self.stats:
+            self.stats[slug] = self.call("collection_stats_get", collection)
+        return self.stats[slug]
+
+    def collection_stats_set(
+        self,
+        collection: Collection,
+        stats: Optional[CollectionStats],
+    ) -> None:
+        if self.memoize:
+            self.stats[collection.slug] = stats
+        self.call("collection_stats_set", collection, stats)
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        try:
+            return self.call("item_upload", href, collection, content)
+        finally:
+            self.invalidate(collection)
+
+    def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        try:
+            return self.call("item_upload_many", contents, collection)
+        finally:
+            self.invalidate(collection)
+
+    def item_delete(self, item: Item) -> None:
+        try:
+            self.call("item_delete", item)
+        finally:
+            self.invalidate(item.collection)
+
+
+@functools.cache
+def _overridden(storage_class: type) -> frozenset[str]:
+    """Names of the ``BaseStorage`` methods that ``storage_class`` overrides."""
+    return frozenset(
+        name
+        for name, function in vars(BaseStorage).items()
+        if inspect.isfunction(function)
+        and not name.startswith("__")
+        and inspect.getattr_static(storage_class, name) is not function
+    )
+
+
+def _delegate(name: str) -> Callable[..., Any]:
+    function = getattr(BaseStorage, name)
+
+    @functools.wraps(function)
+    def method(self: RequestStorage, *args: Any, **kwargs: Any) -> Any:
+        return self.call(name, *args, **kwargs)
+
+    return method
+
+
+# The other ``BaseStorage`` methods go through ``call`` as they are
+for _name, _function in list(vars(BaseStorage).items()):
+    if (
+        inspect.isfunction(_function)
+        and not _name.startswith("_")
+        and _name not in vars(RequestStorage)
+    ):
+        setattr(RequestStorage, _name, _delegate(_name))
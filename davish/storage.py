@@ -1,10 +1,42 @@
 import dataclasses
+import itertools
 import time
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 from hashlib import sha256
-from typing import Iterable, Optional
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+    overload,
+)
+
+from davish.cache import ETagCache, ETagKey, ResponseCache
+from davish.filters import AddressbookFilter
+from davish.index import (
+    IndexCache,
+    PropertyIndex,
+    SummaryIndex,
+    TimeRangeIndex,
+    time_range_overlaps,
+)
+from davish.utils import utils_vobject
+
+# Number of items serialized at once when generating collection data
+SERIALIZE_BATCH_SIZE = 100
+
+T = TypeVar("T")
+
+# A datetime, or an integer number of microseconds since the epoch: cheaper to
+# create and to compare, for storages listing many items
+LastModified = datetime | int
 
 
 class Tag(Enum):
@@ -17,7 +49,7 @@ class ItemTag(Enum):
     VEVENT = "VEVENT"
 
 
-@dataclass
+@dataclass(slots=True)
 class Collection:
     slug: str
     name: str
@@ -36,16 +68,148 @@ class Collection:
         return self.tag == Tag.CALENDAR
 
 
-@dataclass
+@dataclass(slots=True)
 class Item:
     tag: ItemTag
     href: str
     collection: Collection
-    last_modified: datetime
+    last_modified: LastModified
+    # The etag of the item, when the storage got it along with the item
+    etag: Optional[str] = None
+    # The size of the UTF-8 serialization of the item, when the storage got
+    # it along with the item
+    size: Optional[int] = None
+
+
+@dataclass(slots=True)
+class ItemBatch(Sequence[Item]):
+    """Items of a collection as parallel lists, that ``collection_items`` can
+    return instead of a list of ``Item``.
+
+    An ``Item`` is only created when the batch is indexed or iterated, and
+    all of them share the collection and tag of the batch. Listings of the
+    hrefs, last_modified, etags or sizes (``etags`` and ``sizes`` are
+    optional) read the lists directly.
+
+    """
+
+    collection: Collection
+    tag: ItemTag
+    hrefs: list[str] = field(default_factory=list)
+    last_modified: list[LastModified] = field(default_factory=list)
+    etags: Optional[list[str]] = None
+    sizes: Optional[list[int]] = None
+
+    def append(
+        self,
+        href: str,
+        last_modified: LastModified,
+        etag: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        self.hrefs.append(href)
+        self.last_modified.append(last_modified)
+        if self.etags is not None:
+            assert etag is not None
+            self.etags.append(etag)
+        if self.sizes is not None:
+            assert size is not None
+            self.sizes.append(size)
+
+    def __len__(self) -> int:
+        return len(self.hrefs)
+
+    @overload
+    def __getitem__(self, index: int) -> Item: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "ItemBatch": ...
+
+    def __getitem__(self, index: int | slice) -> "Item | ItemBatch":
+        if isinstance(index, slice):
+            return ItemBatch(
+                self.collection,
+                self.tag,
+                self.hrefs[index],
+                self.last_modified[index],
+                self.etags[index] if self.etags is not None else None,
+                self.sizes[index] if self.sizes is not None else None,
+            )
+        return Item(
+            tag=self.tag,
+            href=self.hrefs[index],
+            collection=self.collection,
+            last_modified=self.last_modified[index],
+            etag=self.etags[index] if self.etags is not None else None,
+            size=self.sizes[index] if self.sizes is not None else None,
+        )
+
+    def __iter__(self) -> Iterator[Item]:
+        etags: Iterable[Optional[str]] = self.etags or itertools.repeat(None)
+        sizes: Iterable[Optional[int]] = self.sizes or itertools.repeat(None)
+        for href, last_modified, etag, size in zip(
+            self.hrefs, self.last_modified, etags, sizes
+        ):
+            yield Item(self.tag, href, self.collection, last_modified, etag, size)
+
+
+@dataclass(slots=True)
+class CollectionSummary:
+    """Metadata of a collection, see `BaseStorage.collection_summary`."""
+
+    count: int
+    # The newest last_modified of the items, None for an empty collection
+    last_modified: Optional[LastModified]
+    # The size of the UTF-8 serialization of the collection
+    size: int
+    # The collection etag (the ctag)
+    etag: str
+
+
+@dataclass(slots=True)
+class CollectionStats:
+    """Item count, total size and newest last_modified of a collection, see
+    `BaseStorage.collection_stats_get`."""
+
+    count: int
+    # The sum of the item sizes
+    size: int
+    # None for an empty collection
+    last_modified: Optional[LastModified]
+
+
+@dataclass
+class SyncChanges:
+    """Changes of a collection since a sync token, read rfc6578 for info.
+
+    Every href should appear in only one of the lists, with the net change.
+
+    """
+
+    sync_token: str
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
 
 
 class BaseStorage:
     user: str = "anon"
+    # Set to an ``ETagCache`` instance to share item etags across requests
+    etag_cache: Optional[ETagCache] = None
+    # Set to a ``ResponseCache`` instance to answer repeated PROPFIND and
+    # REPORT requests from stored responses
+    response_cache: Optional[ResponseCache] = None
+    # In-process indexes of the collections answering queries, shared across
+    # requests. Set to None to disable them, or to an ``IndexCache`` of its
+    # own for a storage backed by other data than the others in the process
+    indexes: Optional[IndexCache] = IndexCache()
+    # Set to a ``concurrent.futures.Executor`` to serialize the items and
+    # compute their etags in parallel, at most ``max_parallel`` at a time
+    executor: Optional[Executor] = None
+    max_parallel: int = 4
+    # Maximum number of items answered by a sync-collection or query report,
+    # the others are left to the next page
+    max_results: Optional[int] = None
 
     def collection_list(self) -> list[Collection]:
         raise NotImplementedError
@@ -59,7 +223,9 @@ class BaseStorage:
     def collection_items(
         self,
         collection: Collection,
-    ) -> list[Item]:
+    ) -> list[Item] | ItemBatch:
+        """Return the items of ``collection``, an ``ItemBatch`` saves creating
+        an ``Item`` per item for large collections."""
         raise NotImplementedError
 
     def item_get(
@@ -89,6 +255,273 @@ class BaseStorage:
     ) -> None:
         raise NotImplementedError
 
+    # Batched lookups, override them to fetch many items in a single round
+    # trip to the backend
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        """Return the items of ``collection`` with the given ``hrefs``, in the
+        same order, leaving out the missing ones.
+
+        By default the whole collection is listed.
+
+        """
+        items = self.collection_items(collection)
+        if isinstance(items, ItemBatch):
+            # Only the requested items are created
+            positions = {href: i for i, href in enumerate(items.hrefs)}
+            return {href: items[positions[href]] for href in hrefs if href in positions}
+        by_href = {item.href: item for item in items}
+        return {href: by_href[href] for href in hrefs if href in by_href}
+
+    def items_href_by_uid(
+        self,
+        uids: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, str]:
+        """Return the hrefs of the items of ``collection`` with the given
+        ``uids``, by UID, leaving out the missing ones.
+
+        By default the UIDs are looked up in the in-process inverted index of
+        ``collection_items_matching``. Without ``indexes`` the whole collection is
+        serialized, a batch at a time.
+
+        """
+        if self.indexes is not None:
+            with self.indexes.get(PropertyIndex, self, collection) as index:
+                return index.hrefs_by_uid(uids)
+
+        wanted = set(uids)
+        found: dict[str, str] = {}
+        items = self.collection_items(collection)
+        if not isinstance(items, ItemBatch):
+            items = list(items)
+        for start in range(0, len(items), SERIALIZE_BATCH_SIZE):
+            batch = items[start : start + SERIALIZE_BATCH_SIZE]
+            for item, content in zip(batch, self.items_serialize_many(batch)):
+                for uid in utils_vobject.parse_properties(content).get("UID", []):
+                    if uid.value in wanted:
+                        found.setdefault(uid.value, item.href)
+        return found
+
+    def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        """Upload the ``contents`` of many items of ``collection``, by href,
+        and return the uploaded items (``None`` for the refused ones).
+
+        By default the items are uploaded one at a time, override it to
+        upload them in a single transaction.
+
+        """
+        uploaded: dict[str, Optional[Item]] = {}
+        for href, content in contents.items():
+            try:
+                uploaded[href] = self.item_upload(href, collection, content)
+            except Exception:
+                uploaded[href] = None
+        return uploaded
+
+    def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        return self.map_parallel(self.item_serialize, items)
+
+    def items_etag_many(self, items: Iterable[Item]) -> list[str]:
+        return self.map_parallel(self.item_etag, items)
+
+    def items_size_many(self, items: Iterable[Item]) -> list[int]:
+        return self.map_parallel(self.item_size, items)
+
+    def map_parallel(
+        self,
+        function: Callable[[Item], T],
+        items: Iterable[Item],
+    ) -> list[T]:
+        """Call ``function`` on every item and return the results in the same
+        order, running on ``executor`` when it's set.
+
+        At most ``max_parallel`` calls are in flight, so a single request
+        can't take over a shared executor.
+
+        """
+        if self.executor is None:
+            return [function(item) for item in items]
+
+        results = []
+        pending: deque[Future[T]] = deque()
+        for item in items:
+            if len(pending) >= self.max_parallel:
+                results.append(pending.popleft().result())
+            pending.append(self.executor.submit(function, item))
+        results.extend(future.result() for future in pending)
+        return results
+
+    # Optional change log, used to answer sync-collection reports with only
+    # what changed since the sync token sent by the client
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        """Return the current sync token of ``collection``.
+
+        ``None`` means that the storage doesn't keep a change log, in which
+        case the collection tag is used as sync token.
+
+        """
+        return None
+
+    def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        """Return the hrefs changed in ``collection`` since ``sync_token``.
+
+        ``None`` means that the token is unknown or expired.
+
+        """
+        raise NotImplementedError
+
+    # Optional queries, the default implementations can be backed by
+    # in-process indexes that PUT and DELETE keep up to date
+
+    def collection_items_in_range(
+        self,
+        collection: Collection,
+        start: int,
+        end: int,
+    ) -> list[Item]:
+        """Return the items of ``collection`` overlapping ``start``-``end``.
+
+        Override to answer the query directly, by default an in-process
+        interval index built with ``item_time_range`` is used, unless
+        ``indexes`` is None.
+
+        """
+        if self.indexes is None:
+            return [
+                item
+                for item in self.collection_items(collection)
+                if time_range_overlaps(self.item_time_range(item), start, end)
+            ]
+
+        with self.indexes.get(TimeRangeIndex, self, collection) as index:
+            hrefs = index.overlapping(start, end)
+        return list(self.items_get_many(hrefs, collection).values())
+
+    def collection_items_matching(
+        self,
+        collection: Collection,
+        card_filter: AddressbookFilter,
+    ) -> list[Item]:
+        """Return the items of ``collection`` matching ``card_filter``.
+
+        Override to answer the query directly, by default an in-process
+        inverted index is used when the filter is only on the indexed
+        properties (FN, EMAIL, TEL and UID), unless ``indexes`` is None.
+
+        """
+        names = {prop_filter.name for prop_filter in card_filter.prop_filters}
+        if self.indexes is None or not names <= set(PropertyIndex.PROPERTIES):
+            return [
+                item
+                for item in self.collection_items(collection)
+                if card_filter.match(
+                    utils_vobject.parse_properties(self.item_serialize(item))
+                )
+            ]
+
+        with self.indexes.get(PropertyIndex, self, collection) as index:
+            hrefs = sorted(index.search(card_filter))
+        return list(self.items_get_many(hrefs, collection).values())
+
+    def collection_summary(self, collection: Collection) -> CollectionSummary:
+        """Return the item count, newest last_modified, size and etag of
+        ``collection``.
+
+        With the collection digest and stats persisted (see
+        ``collection_digest_get`` and ``collection_stats_get``) this is a
+        couple of lookups. Otherwise the stats are computed, from the listing
+        and the ``item_size`` of the items or from an in-process index of
+        them, and stored with ``collection_stats_set``. The
+        etag comes from ``collection_etag``, which lists the collection and
+        reads all the etags as well without a persisted digest.
+
+        """
+        stats = self.collection_stats(collection)
+        return CollectionSummary(
+            count=stats.count,
+            last_modified=stats.last_modified,
+            # The items are joined by newlines, see `serialize_iter`
+            size=stats.size + max(stats.count - 1, 0),
+            etag=self.collection_etag(collection),
+        )
+
+    def collection_stats(self, collection: Collection) -> CollectionStats:
+        """Return the persisted stats of ``collection``, or compute and store
+        them, see `collection_summary`."""
+        stats = self.collection_stats_get(collection)
+        if stats is None:
+            if self.indexes is None:
+                items = self.collection_items(collection)
+                if isinstance(items, ItemBatch) and items.sizes is not None:
+                    sizes = items.sizes
+                else:
+                    sizes = self.items_size_many(items)
+                stats = self.items_stats(items, sizes)
+            else:
+                with self.indexes.get(SummaryIndex, self, collection) as index:
+                    stats = CollectionStats(*index.summary())
+            self.collection_stats_set(collection, stats)
+        return stats
+
+    def items_stats(
+        self,
+        items: Iterable[Item],
+        sizes: Optional[Iterable[int]] = None,
+    ) -> CollectionStats:
+        """Return the count, total size and newest last_modified of
+        ``items``, their ``sizes`` are read with ``items_size_many`` when
+        they aren't given."""
+        if isinstance(items, ItemBatch):
+            last_modified = items.last_modified
+        else:
+            items = list(items)
+            last_modified = [item.last_modified for item in items]
+        if sizes is None:
+            sizes = self.items_size_many(items)
+        return CollectionStats(
+            count=len(last_modified),
+            size=sum(sizes),
+            last_modified=max(last_modified, default=None),
+        )
+
+    def collection_indexes_update(
+        self,
+        collection: Collection,
+        href: str,
+        item: Optional[Item],
+        digest: Optional[int],
+    ) -> None:
+        """Update the in-process indexes after ``href`` has been uploaded
+        (``item``) or deleted (``None``), ``digest`` is the collection digest
+        before the change."""
+        if self.indexes is not None:
+            self.indexes.item_changed(self, collection, href, item, digest)
+
+    def collection_indexes_update_many(
+        self,
+        collection: Collection,
+        items: list[Item],
+        digest: Optional[int],
+    ) -> None:
+        """Update the in-process indexes after ``items`` have been uploaded,
+        ``digest`` is the collection digest before the upload."""
+        if self.indexes is not None:
+            self.indexes.items_changed(self, collection, items, (), digest)
+
     # Implemented methods, can be overrided if needed
 
     def user_get(self) -> str:
@@ -128,10 +561,8 @@ class BaseStorage:
 
         else:
             collection = self.collection_get(path)
-            if collection:
-                sub_collections = self.collection_items(collection)
-            else:
-                sub_collections = []
+            # Items are listed below, collections have no sub collections
+            sub_collections = []
 
         if not collection:
             item = self.item_get_from_path(path)
@@ -156,32 +587,173 @@ class BaseStorage:
         if isinstance(item, Item):
             last_modified = item.last_modified
         else:
-            collection = item
-            items_last_modified = [
-                i.last_modified for i in self.collection_items(collection)
-            ]
-            last_modified = max(items_last_modified or [datetime.now()])
+            last_modified = self.collection_summary(item).last_modified
 
         return format_datetime(last_modified)
 
     def collection_etag(self, collection: Collection) -> str:
+        digest = self.collection_digest_get(collection)
+        if digest is None:
+            digest = 0
+            items = self.collection_items(collection)
+            if isinstance(items, ItemBatch) and items.etags is not None:
+                # The etags are read from the batch without creating items
+                for href, etag in zip(items.hrefs, items.etags):
+                    digest ^= _href_digest(href, etag)
+            else:
+                for item, etag in zip(items, self.items_etag_many(items)):
+                    digest ^= self.item_digest(item, etag)
+            self.collection_digest_set(collection, digest)
+
         etag = sha256()
-        for item in self.collection_items(collection):
-            etag.update((item.href + "/" + self.item_etag(item)).encode())
+        etag.update(digest.to_bytes(32, "big"))
         etag.update(str(dataclasses.asdict(collection)).encode())
         return '"%s"' % etag.hexdigest()
 
+    def item_digest(self, item: Item, etag: Optional[str] = None) -> int:
+        """Digest of an item, XOR-ed with the others into the collection one.
+
+        XOR makes the collection digest independent from the items order and
+        lets it be updated in O(1) when a single item is added or removed.
+
+        """
+        return _href_digest(item.href, etag or self.item_etag(item))
+
+    # Optional hooks to persist the collection digest, when they are
+    # implemented `collection_etag` (and so CS:getctag) is a single lookup.
+
+    def collection_digest_get(self, collection: Collection) -> Optional[int]:
+        return None
+
+    def collection_digest_set(self, collection: Collection, digest: int) -> None:
+        pass
+
+    def collection_digest_update(self, collection: Collection, delta: int) -> None:
+        """Combine ``delta`` into the stored digest of ``collection``.
+
+        Called by PUT and DELETE with the digests of the removed and added
+        items, override it to make the read-modify-write atomic.
+
+        """
+        digest = self.collection_digest_get(collection)
+        if digest is not None:
+            self.collection_digest_set(collection, digest ^ delta)
+
+    # Optional hooks to persist the stats of a collection alongside its
+    # digest, when they are implemented `collection_summary` (and so the
+    # collection Last-Modified and D:getcontentlength) doesn't list it.
+
+    def collection_stats_get(self, collection: Collection) -> Optional[CollectionStats]:
+        return None
+
+    def collection_stats_set(
+        self,
+        collection: Collection,
+        stats: Optional[CollectionStats],
+    ) -> None:
+        """Store the ``stats`` of ``collection``, ``None`` drops them."""
+
+    def collection_stats_update(
+        self,
+        collection: Collection,
+        added: CollectionStats,
+        removed: CollectionStats,
+    ) -> None:
+        """Combine the stats of the ``added`` and ``removed`` items into the
+        stored stats of ``collection``.
+
+        Called by PUT, DELETE and POST, a replaced item is both removed and
+        added. When the newest item is removed the next newest last_modified
+        is unknown, so the stats are dropped and computed again by the next
+        ``collection_summary``. Override it to make the read-modify-write
+        atomic.
+
+        """
+        stats = self.collection_stats_get(collection)
+        if stats is None:
+            return
+        newest = max(
+            (lm for lm in (stats.last_modified, added.last_modified) if lm is not None),
+            default=None,
+        )
+        if removed.last_modified is not None and (
+            newest is None or removed.last_modified >= newest
+        ):
+            self.collection_stats_set(collection, None)
+            return
+        self.collection_stats_set(
+            collection,
+            CollectionStats(
+                count=stats.count + added.count - removed.count,
+                size=stats.size + added.size - removed.size,
+                last_modified=newest,
+            ),
+        )
+
     def item_etag(self, item: Item) -> str:
+        if item.etag is not None:
+            return item.etag
+        if self.etag_cache is None:
+            return self.item_compute_etag(item)
+
+        key = self._etag_key(item)
+        etag = self.etag_cache.get(key)
+        if etag is None:
+            etag = self.item_compute_etag(item)
+            self.etag_cache.set(key, etag)
+        return etag
+
+    def _etag_key(self, item: Item) -> ETagKey:
+        # Slugs are only unique per user, and the cache is shared by all
+        return (self.user, item.collection.slug, item.href, item.last_modified)
+
+    def item_compute_etag(self, item: Item) -> str:
+        version = self.item_version(item)
         etag = sha256()
-        etag.update(self.item_serialize(item).encode())
+        if version is not None:
+            etag.update(version.encode())
+        else:
+            etag.update(self.item_serialize(item).encode())
         return '"%s"' % etag.hexdigest()
 
+    # Optional hook for cheap etags: return a value that changes every time
+    # the item changes (like a revision or ``item.last_modified.isoformat()``)
+    # and etags are derived from it instead of the serialization.
+
+    def item_version(self, item: Item) -> Optional[str]:
+        return None
+
+    # Optional hooks for D:getcontentlength, override them to answer from
+    # stored metadata instead of serializing the items
+
+    def item_size(self, item: Item) -> int:
+        """Return the size of the UTF-8 serialization of ``item``."""
+        if item.size is not None:
+            return item.size
+        return len(self.item_serialize(item).encode("utf-8"))
+
+    def collection_size(self, collection: Collection) -> int:
+        """Return the size of the UTF-8 serialization of ``collection``, its
+        items joined by newlines (see `serialize_iter`)."""
+        stats = self.collection_stats(collection)
+        return stats.size + max(stats.count - 1, 0)
+
     def serialize(self, item: Item | Collection) -> str:
+        return "".join(self.serialize_iter(item))
+
+    def serialize_iter(self, item: Item | Collection) -> Iterator[str]:
+        """Serialize ``item`` in chunks, a collection is serialized a batch of
+        items at a time while the chunks are consumed."""
         if isinstance(item, Item):
-            return self.item_serialize(item)
-        return "\n".join(
-            [self.item_serialize(item) for item in self.collection_items(item)]
-        )
+            yield self.item_serialize(item)
+            return
+        items = self.collection_items(item)
+        if not isinstance(items, ItemBatch):
+            items = list(items)
+        for start in range(0, len(items), SERIALIZE_BATCH_SIZE):
+            batch = items[start : start + SERIALIZE_BATCH_SIZE]
+            chunk = "\n".join(self.items_serialize_many(batch))
+            yield "\n" + chunk if start else chunk
 
     def item_get_from_path(self, path: str) -> Optional[Item]:
         collection_slug, item_href = self.split_path(path)
@@ -211,6 +783,13 @@ class BaseStorage:
         return collection_path, item_href
 
 
-def format_datetime(dt: Optional[datetime] = None) -> str:
-    dt = dt or datetime.now()
-    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(dt.timestamp()))
+def _href_digest(href: str, etag: str) -> int:
+    digest = sha256((href + "/" + etag).encode())
+    return int.from_bytes(digest.digest(), "big")
+
+
+def format_datetime(dt: Optional[LastModified] = None) -> str:
+    if dt is None:
+        dt = datetime.now()
+    timestamp = dt / 10**6 if isinstance(dt, int) else dt.timestamp()
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(timestamp))
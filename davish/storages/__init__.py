@@ -0,0 +1,2 @@
+from .filesystem import FileSystemStorage
+from .sqlite import SQLiteStorage
@@ -0,0 +1,223 @@
+import contextlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+from davish.index import component_time_range
+from davish.storage import BaseStorage, Collection, Item, ItemBatch, ItemTag, Tag
+from davish.utils import utils_path
+
+# Properties of a collection, stored in its directory
+PROPS_FILENAME = ".collection.json"
+
+# Files at least this big are read through a memory map, smaller ones are
+# cheaper to read at once
+MMAP_THRESHOLD = 64 * 1024
+
+
+class FileSystemStorage(BaseStorage):
+    """Storage of .ics/.vcf files in ``root``, one directory per user and
+    collection: ``root/<user>/<collection slug>/<href>``.
+
+    Listings come from ``os.scandir`` and etags, last_modified and sizes
+    from the file stat (inode, mtime and size), so listing a collection and
+    its etags or sizes reads no file. Uploads are written to a temporary
+    file and renamed over the item.
+
+    """
+
+    # Flush uploads to disk before renaming them
+    fsync: bool = True
+
+    def __init__(self, root: str, user: str = "anon") -> None:
+        self.root = root
+        self.user = user
+
+    def _path(self, *components: str) -> str:
+        for component in components:
+            if not utils_path.is_safe_path_component(component):
+                raise ValueError("Unsafe path component: %r" % component)
+        return os.path.join(self.root, self.user, *components)
+
+    # Collections are created and deleted by the application
+
+    def collection_create(self, collection: Collection) -> None:
+        path = self._path(collection.slug)
+        os.makedirs(path)
+        props = {
+            "name": collection.name,
+            "tag": collection.tag.value if collection.tag else None,
+        }
+        self._write(os.path.join(path, PROPS_FILENAME), json.dumps(props).encode())
+
+    def collection_delete(self, collection: Collection) -> None:
+        shutil.rmtree(self._path(collection.slug))
+
+    def collection_list(self) -> list[Collection]:
+        try:
+            entries = list(os.scandir(os.path.join(self.root, self.user)))
+        except FileNotFoundError:
+            return []
+        collections = []
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            collection = self._collection(entry.name, entry.path)
+            if collection is not None:
+                collections.append(collection)
+        return collections
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        try:
+            path = self._path(slug)
+        except ValueError:
+            return None
+        return self._collection(slug, path)
+
+    def _collection(self, slug: str, path: str) -> Optional[Collection]:
+        try:
+            with open(os.path.join(path, PROPS_FILENAME), "rb") as f:
+                props = json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        tag = props.get("tag")
+        return Collection(
+            slug=slug,
+            name=props.get("name", slug),
+            tag=Tag(tag) if tag else None,
+        )
+
+    def collection_items(self, collection: Collection) -> ItemBatch:
+        items = ItemBatch(collection, _item_tag(collection), etags=[], sizes=[])
+        try:
+            entries = list(os.scandir(self._path(collection.slug)))
+        except (FileNotFoundError, ValueError):
+            # The principal and the root have no items
+            return items
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            items.append(entry.name, _last_modified(stat), _etag(stat), stat.st_size)
+        return items
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        if href.startswith("."):
+            return None
+        try:
+            stat = os.stat(self._path(collection.slug, href))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            return None
+        return self._item(collection, href, stat)
+
+    def _item(self, collection: Collection, href: str, stat: os.stat_result) -> Item:
+        return Item(
+            tag=_item_tag(collection),
+            href=href,
+            collection=collection,
+            last_modified=_last_modified(stat),
+            etag=_etag(stat),
+            size=stat.st_size,
+        )
+
+    def item_serialize(self, item: Item) -> str:
+        with open(self._path(item.collection.slug, item.href), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_THRESHOLD:
+                return f.read().decode("utf-8")
+            # Decoded straight from the mapped pages, without a bytes copy
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, "utf-8")
+
+    def item_time_range(self, item: Item) -> tuple[int, int]:
+        return component_time_range(self.item_serialize(item))
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        if href.startswith("."):
+            return None
+        try:
+            path = self._path(collection.slug, href)
+        except ValueError:
+            return None
+        try:
+            previous_mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            previous_mtime_ns = None
+
+        stat = self._write(path, content.encode("utf-8"), previous_mtime_ns)
+        return self._item(collection, href, stat)
+
+    def _write(
+        self,
+        path: str,
+        content: bytes,
+        previous_mtime_ns: Optional[int] = None,
+    ) -> os.stat_result:
+        directory, filename = os.path.split(path)
+        fd, temporary = tempfile.mkstemp(prefix=".%s." % filename, dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            stat = os.stat(temporary)
+            if previous_mtime_ns is not None and stat.st_mtime_ns // 1000 <= (
+                previous_mtime_ns // 1000
+            ):
+                # A changed item must get a new last_modified, it keys caches
+                mtime_ns = (previous_mtime_ns // 1000 + 1) * 1000
+                os.utime(temporary, ns=(stat.st_atime_ns, mtime_ns))
+                stat = os.stat(temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temporary)
+            raise
+        return stat
+
+    def item_delete(self, item: Item) -> None:
+        os.unlink(self._path(item.collection.slug, item.href))
+
+    # Batched lookups
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        items = {}
+        for href in hrefs:
+            item = self.item_get(href, collection)
+            if item is not None:
+                items[href] = item
+        return items
+
+    # Etags come from the stat of the files
+
+    def item_compute_etag(self, item: Item) -> str:
+        return _etag(os.stat(self._path(item.collection.slug, item.href)))
+
+
+def _item_tag(collection: Collection) -> ItemTag:
+    return ItemTag.VEVENT if collection.is_calendar else ItemTag.VCARD
+
+
+def _last_modified(stat: os.stat_result) -> int:
+    # Microseconds since the epoch, see `davish.storage.LastModified`
+    return stat.st_mtime_ns // 1000
+
+
+def _etag(stat: os.stat_result) -> str:
+    return '"%x-%x-%x"' % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
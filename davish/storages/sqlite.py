@@ -0,0 +1,577 @@
+import contextlib
+import dataclasses
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Iterable, Iterator, Mapping, Optional
+
+from davish.index import component_time_range
+from davish.storage import (
+    BaseStorage,
+    Collection,
+    CollectionSummary,
+    Item,
+    ItemBatch,
+    ItemTag,
+    SyncChanges,
+    Tag,
+)
+from davish.utils import utils_vobject
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    user TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tag TEXT,
+    revision INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, slug)
+);
+
+CREATE TABLE IF NOT EXISTS items (
+    user TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    href TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    uid TEXT,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_modified TEXT NOT NULL,
+    dtstart INTEGER,
+    dtend INTEGER,
+    revision INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (user, collection, href),
+    FOREIGN KEY (user, collection) REFERENCES collections (user, slug)
+        ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS items_uid ON items (user, collection, uid);
+CREATE INDEX IF NOT EXISTS items_last_modified
+    ON items (user, collection, last_modified);
+CREATE INDEX IF NOT EXISTS items_time_range
+    ON items (user, collection, dtstart, dtend);
+CREATE INDEX IF NOT EXISTS items_revision ON items (user, collection, revision);
+
+CREATE TABLE IF NOT EXISTS tombstones (
+    user TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    href TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    PRIMARY KEY (user, collection, href),
+    FOREIGN KEY (user, collection) REFERENCES collections (user, slug)
+        ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS tombstones_revision
+    ON tombstones (user, collection, revision);
+"""
+
+# Columns listed for an ``Item``, the content is only read when serializing
+ITEM_COLUMNS = "href, tag, last_modified, etag, size"
+
+# Host parameters per query, below the limit of older SQLite versions
+MAX_VARIABLES = 500
+
+_local = threading.local()
+# The connections opened to every database, by path, and how many times they
+# have been closed: a thread reopens its connection when it's behind
+_connections: dict[str, list[sqlite3.Connection]] = {}
+_generations: dict[str, int] = {}
+_connections_lock = threading.Lock()
+
+
+class SQLiteStorage(BaseStorage):
+    """Storage backed by an SQLite database (in WAL mode) at ``path``.
+
+    The etag, size, last_modified, UID and time range of the items are
+    stored in indexed columns, so etags, ctags, time-range queries and sync
+    tokens are answered without reading (or serializing) the items. The
+    ctag and the sync token are derived from a revision of the collection,
+    bumped by every change.
+
+    Connections are opened once per thread and database, and closed by
+    ``close``. Every thread has its own connection, so in-memory databases
+    are refused.
+
+    """
+
+    def __init__(self, path: str, user: str = "anon", timeout: float = 5.0) -> None:
+        if path in ("", ":memory:"):
+            raise ValueError("SQLiteStorage needs a database file, not %r" % path)
+        self.path = path
+        self.user = user
+        self.timeout = timeout
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connections: dict[str, tuple[int, sqlite3.Connection]] = (
+            _local.__dict__.setdefault("connections", {})
+        )
+        generation = _generations.get(self.path, 0)
+        entry = connections.get(self.path)
+        if entry is None or entry[0] != generation:
+            connections[self.path] = entry = (generation, self._connect())
+        return entry[1]
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are handled explicitly, see `_transaction`. Connections
+        # are only used by their thread, but closed by any
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        # On every connection, the file may have been replaced since
+        connection.executescript(SCHEMA)
+        with _connections_lock:
+            _connections.setdefault(self.path, []).append(connection)
+        return connection
+
+    def close(self) -> None:
+        """Close the connections of every thread to the database, the next
+        call of a thread opens a new one.
+
+        Call it once no request uses the database, like at shutdown or after
+        replacing the database file.
+
+        """
+        with _connections_lock:
+            connections = _connections.pop(self.path, [])
+            _generations[self.path] = _generations.get(self.path, 0) + 1
+        _local.__dict__.get("connections", {}).pop(self.path, None)
+        for connection in connections:
+            connection.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # Collections are created and deleted by the application
+
+    def collection_create(self, collection: Collection) -> None:
+        tag = collection.tag.value if collection.tag else None
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO collections (user, slug, name, tag) VALUES (?, ?, ?, ?)",
+                (self.user, collection.slug, collection.name, tag),
+            )
+
+    def collection_delete(self, collection: Collection) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM collections WHERE user = ? AND slug = ?",
+                (self.user, collection.slug),
+            )
+
+    def collection_list(self) -> list[Collection]:
+        rows = self.connection.execute(
+            "SELECT slug, name, tag FROM collections WHERE user = ? ORDER BY slug",
+            (self.user,),
+        )
+        return [_collection(*row) for row in rows]
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        row = self.connection.execute(
+            "SELECT slug, name, tag FROM collections WHERE user = ? AND slug = ?",
+            (self.user, slug),
+        ).fetchone()
+        return _collection(*row) if row else None
+
+    def collection_items(self, collection: Collection) -> ItemBatch:
+        rows = self.connection.execute(
+            "SELECT href, last_modified, etag, size FROM items"
+            " WHERE user = ? AND collection = ? ORDER BY href",
+            (self.user, collection.slug),
+        )
+        tag = ItemTag.VEVENT if collection.is_calendar else ItemTag.VCARD
+        items = ItemBatch(collection, tag, etags=[], sizes=[])
+        for href, last_modified, etag, size in rows:
+            items.append(href, datetime.fromisoformat(last_modified), etag, size)
+        return items
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        row = self.connection.execute(
+            "SELECT %s FROM items WHERE user = ? AND collection = ? AND href = ?"
+            % ITEM_COLUMNS,
+            (self.user, collection.slug, href),
+        ).fetchone()
+        return self._item(collection, *row) if row else None
+
+    def item_serialize(self, item: Item) -> str:
+        row = self.connection.execute(
+            "SELECT content FROM items WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, item.collection.slug, item.href),
+        ).fetchone()
+        if row is None:
+            raise KeyError(item.href)
+        return row[0]
+
+    def item_time_range(self, item: Item) -> tuple[int, int]:
+        row = self.connection.execute(
+            "SELECT dtstart, dtend FROM items"
+            " WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, item.collection.slug, item.href),
+        ).fetchone()
+        if row is None:
+            raise KeyError(item.href)
+        return row[0], row[1]
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        row = self._item_row(collection, content)
+        with self._transaction() as connection:
+            revision = self._bump_revision(connection, collection)
+            return self._upload(connection, collection, revision, href, *row)
+
+    def item_upload_many(
+        self,
+        contents: Mapping[str, str],
+        collection: Collection,
+    ) -> dict[str, Optional[Item]]:
+        # Parsed before the transaction, to hold the write lock briefly, the
+        # invalid items are refused alone
+        rows = {}
+        for href, content in contents.items():
+            try:
+                rows[href] = self._item_row(collection, content)
+            except ValueError:
+                rows[href] = None
+        uploaded: dict[str, Optional[Item]] = dict.fromkeys(contents)
+        if not any(rows.values()):
+            return uploaded
+        # The valid items are uploaded (or rolled back) together
+        with self._transaction() as connection:
+            # A single revision for the whole upload
+            revision = self._bump_revision(connection, collection)
+            for href, row in rows.items():
+                if row is not None:
+                    uploaded[href] = self._upload(
+                        connection, collection, revision, href, *row
+                    )
+        return uploaded
+
+    def _item_row(
+        self,
+        collection: Collection,
+        content: str,
+    ) -> tuple[ItemTag, Optional[str], Optional[int], Optional[int], str]:
+        """Return the tag, UID, time range and content of an item, raise
+        ``ValueError`` if it isn't a calendar or a vCard, like its
+        collection."""
+        lines = utils_vobject.unfold(content)
+        first = next((line for line in lines if line.strip()), "")
+        expected = "VCALENDAR" if collection.is_calendar else "VCARD"
+        if first.strip().upper() != "BEGIN:%s" % expected:
+            raise ValueError("Not a %s" % expected)
+        if collection.is_calendar:
+            tag = ItemTag.VEVENT
+            dtstart, dtend = component_time_range(content)
+        else:
+            tag = ItemTag.VCARD
+            dtstart = dtend = None
+        uids = utils_vobject.parse_properties(content).get("UID")
+        uid = uids[0].value if uids else None
+        return tag, uid, dtstart, dtend, content
+
+    def _upload(
+        self,
+        connection: sqlite3.Connection,
+        collection: Collection,
+        revision: int,
+        href: str,
+        tag: ItemTag,
+        uid: Optional[str],
+        dtstart: Optional[int],
+        dtend: Optional[int],
+        content: str,
+    ) -> Item:
+        encoded = content.encode("utf-8")
+        etag = '"%s"' % sha256(encoded).hexdigest()
+        last_modified = datetime.now()
+        row = connection.execute(
+            "SELECT last_modified FROM items"
+            " WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, collection.slug, href),
+        ).fetchone()
+        if row is not None:
+            # A changed item must get a new last_modified, it keys caches
+            previous = datetime.fromisoformat(row[0])
+            if last_modified <= previous:
+                last_modified = previous + timedelta(microseconds=1)
+        connection.execute(
+            "INSERT INTO items (user, collection, href, tag, uid, etag, size,"
+            " last_modified, dtstart, dtend, revision, content)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (user, collection, href) DO UPDATE SET"
+            " tag = excluded.tag, uid = excluded.uid, etag = excluded.etag,"
+            " size = excluded.size, last_modified = excluded.last_modified,"
+            " dtstart = excluded.dtstart, dtend = excluded.dtend,"
+            " revision = excluded.revision, content = excluded.content",
+            (
+                self.user,
+                collection.slug,
+                href,
+                tag.value,
+                uid,
+                etag,
+                len(encoded),
+                last_modified.isoformat(timespec="microseconds"),
+                dtstart,
+                dtend,
+                revision,
+                content,
+            ),
+        )
+        connection.execute(
+            "DELETE FROM tombstones WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, collection.slug, href),
+        )
+        return self._item(
+            collection, href, tag.value, last_modified, etag, len(encoded)
+        )
+
+    def item_delete(self, item: Item) -> None:
+        with self._transaction() as connection:
+            revision = self._bump_revision(connection, item.collection)
+            connection.execute(
+                "DELETE FROM items WHERE user = ? AND collection = ? AND href = ?",
+                (self.user, item.collection.slug, item.href),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO tombstones (user, collection, href, revision)"
+                " VALUES (?, ?, ?, ?)",
+                (self.user, item.collection.slug, item.href, revision),
+            )
+
+    def _bump_revision(
+        self,
+        connection: sqlite3.Connection,
+        collection: Collection,
+    ) -> int:
+        connection.execute(
+            "UPDATE collections SET revision = revision + 1"
+            " WHERE user = ? AND slug = ?",
+            (self.user, collection.slug),
+        )
+        revision = self._revision(connection, collection)
+        if revision is None:
+            raise KeyError(collection.slug)
+        return revision
+
+    def _revision(
+        self,
+        connection: sqlite3.Connection,
+        collection: Collection,
+    ) -> Optional[int]:
+        row = connection.execute(
+            "SELECT revision FROM collections WHERE user = ? AND slug = ?",
+            (self.user, collection.slug),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _item(
+        self,
+        collection: Collection,
+        href: str,
+        tag: str,
+        last_modified: str | datetime,
+        etag: str,
+        size: int,
+    ) -> Item:
+        if isinstance(last_modified, str):
+            last_modified = datetime.fromisoformat(last_modified)
+        return Item(
+            tag=ItemTag(tag),
+            href=href,
+            collection=collection,
+            last_modified=last_modified,
+            etag=etag,
+            size=size,
+        )
+
+    # Batched lookups
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        hrefs = list(hrefs)
+        found = {}
+        for start in range(0, len(hrefs), MAX_VARIABLES):
+            batch = hrefs[start : start + MAX_VARIABLES]
+            rows = self.connection.execute(
+                "SELECT %s FROM items"
+                " WHERE user = ? AND collection = ? AND href IN (%s)"
+                % (ITEM_COLUMNS, ", ".join("?" * len(batch))),
+                (self.user, collection.slug, *batch),
+            )
+            for row in rows:
+                found[row[0]] = self._item(collection, *row)
+        return {href: found[href] for href in hrefs if href in found}
+
+    def items_href_by_uid(
+        self,
+        uids: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, str]:
+        uids = list(uids)
+        found: dict[str, str] = {}
+        for start in range(0, len(uids), MAX_VARIABLES):
+            batch = uids[start : start + MAX_VARIABLES]
+            rows = self.connection.execute(
+                "SELECT uid, href FROM items"
+                " WHERE user = ? AND collection = ? AND uid IN (%s) ORDER BY href"
+                % ", ".join("?" * len(batch)),
+                (self.user, collection.slug, *batch),
+            )
+            for uid, href in rows:
+                found.setdefault(uid, href)
+        return found
+
+    def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        items = list(items)
+        contents: dict[tuple[str, str], str] = {}
+        by_collection: dict[str, list[str]] = {}
+        for item in items:
+            by_collection.setdefault(item.collection.slug, []).append(item.href)
+        for slug, hrefs in by_collection.items():
+            for start in range(0, len(hrefs), MAX_VARIABLES):
+                batch = hrefs[start : start + MAX_VARIABLES]
+                rows = self.connection.execute(
+                    "SELECT href, content FROM items WHERE user = ? AND collection = ?"
+                    " AND href IN (%s)" % ", ".join("?" * len(batch)),
+                    (self.user, slug, *batch),
+                )
+                for href, content in rows:
+                    contents[(slug, href)] = content
+        return [contents[(item.collection.slug, item.href)] for item in items]
+
+    # Sizes are stored, D:getcontentlength reads no content
+
+    def item_size(self, item: Item) -> int:
+        if item.size is not None:
+            return item.size
+        row = self.connection.execute(
+            "SELECT size FROM items WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, item.collection.slug, item.href),
+        ).fetchone()
+        if row is None:
+            raise KeyError(item.href)
+        return row[0]
+
+    # Etags are stored, ctags and sync tokens come from the revision
+
+    def item_compute_etag(self, item: Item) -> str:
+        row = self.connection.execute(
+            "SELECT etag FROM items WHERE user = ? AND collection = ? AND href = ?",
+            (self.user, item.collection.slug, item.href),
+        ).fetchone()
+        if row is None:
+            raise KeyError(item.href)
+        return row[0]
+
+    def collection_etag(self, collection: Collection) -> str:
+        revision = self._revision(self.connection, collection)
+        if revision is None:
+            # The principal and the root aren't stored
+            return super().collection_etag(collection)
+        etag = sha256()
+        etag.update(str(revision).encode())
+        etag.update(str(dataclasses.asdict(collection)).encode())
+        return '"%s"' % etag.hexdigest()
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        revision = self._revision(self.connection, collection)
+        return str(revision) if revision is not None else None
+
+    def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        if not sync_token.isdigit():
+            return None
+        since = int(sync_token)
+        connection = self.connection
+        # Read everything from the same snapshot
+        connection.execute("BEGIN")
+        try:
+            revision = self._revision(connection, collection)
+            if revision is None or since > revision:
+                return None
+            modified = connection.execute(
+                "SELECT href FROM items"
+                " WHERE user = ? AND collection = ? AND revision > ?"
+                " ORDER BY href",
+                (self.user, collection.slug, since),
+            )
+            deleted = connection.execute(
+                "SELECT href FROM tombstones"
+                " WHERE user = ? AND collection = ? AND revision > ?"
+                " ORDER BY href",
+                (self.user, collection.slug, since),
+            )
+            return SyncChanges(
+                sync_token=str(revision),
+                modified=[href for href, in modified],
+                deleted=[href for href, in deleted],
+            )
+        finally:
+            connection.execute("COMMIT")
+
+    def collection_summary(self, collection: Collection) -> CollectionSummary:
+        count, last_modified, size = self._collection_totals(collection)
+        return CollectionSummary(
+            count=count,
+            last_modified=datetime.fromisoformat(last_modified) if count else None,
+            # The items are joined by newlines, see `BaseStorage.serialize_iter`
+            size=int(size) + max(count - 1, 0),
+            etag=self.collection_etag(collection),
+        )
+
+    def collection_size(self, collection: Collection) -> int:
+        count, _, size = self._collection_totals(collection)
+        return int(size) + max(count - 1, 0)
+
+    def _collection_totals(self, collection: Collection) -> tuple[int, str, float]:
+        return self.connection.execute(
+            "SELECT COUNT(*), MAX(last_modified), TOTAL(size) FROM items"
+            " WHERE user = ? AND collection = ?",
+            (self.user, collection.slug),
+        ).fetchone()
+
+    def collection_items_in_range(
+        self,
+        collection: Collection,
+        start: int,
+        end: int,
+    ) -> list[Item]:
+        # Read rfc4791-9.9 for info, see `time_range_overlaps`
+        rows = self.connection.execute(
+            "SELECT %s FROM items"
+            " WHERE user = ? AND collection = ? AND dtstart < ? AND ("
+            "(dtstart = dtend AND dtstart >= ?) OR (dtstart < dtend AND dtend > ?))"
+            " ORDER BY href" % ITEM_COLUMNS,
+            (self.user, collection.slug, end, start, start),
+        )
+        return [self._item(collection, *row) for row in rows]
+
+
+def _collection(slug: str, name: str, tag: Optional[str]) -> Collection:
+    return Collection(slug=slug, name=name, tag=Tag(tag) if tag else None)
@@ -1,10 +1,13 @@
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Any, Callable, Mapping, Union
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Mapping, Optional, Union
 
 if TYPE_CHECKING:
+    from davish.metrics import RequestMetrics
     from davish.storage import BaseStorage
 
-WSGIResponse = tuple[int, dict[str, str], Union[None, str, bytes]]
+# Iterables are streamed as they are consumed
+WSGIContent = Union[None, str, bytes, Iterable[str], Iterable[bytes]]
+WSGIResponse = tuple[int, dict[str, str], WSGIContent]
 WSGIEnviron = Mapping[str, Any]
 WSGIStartResponse = Callable[[str, list[tuple[str, str]]], Any]
 
@@ -13,3 +16,5 @@ WSGIStartResponse = Callable[[str, list[tuple[str, str]]], Any]
 class Context:
     env: WSGIEnviron
     storage: "BaseStorage"
+    # Set when the request is measured, see ``Metrics``
+    metrics: Optional["RequestMetrics"] = None
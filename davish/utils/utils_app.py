@@ -1,26 +1,109 @@
+import codecs
 import io
+import itertools
 import xml.etree.ElementTree as ET
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 from davish import types
-from davish.utils import utils_http
+from davish.utils import utils_http, utils_xml
 
+# Size of the chunks yielded by `xml_stream`
+XML_STREAM_CHUNK_SIZE = 64 * 1024
 
-def read_xml_request_body(environ: types.WSGIEnviron) -> Optional[ET.Element]:
-    content = utils_http.decode_request(
-        environ,
-        utils_http.read_raw_request_body(environ),
-    )
-    if not content:
-        return None
+# Limits of the XML request bodies, bigger ones are refused while read
+MAX_XML_SIZE = 16 * 1024 * 1024
+MAX_XML_ELEMENTS = 100_000
+MAX_XML_DEPTH = 32
+
+
+def read_xml_request_body(
+    environ: types.WSGIEnviron,
+    max_size: Optional[int] = None,
+    max_elements: Optional[int] = None,
+    max_depth: Optional[int] = None,
+) -> Optional[ET.Element]:
+    """Parse the XML request body while it's read, in chunks.
+
+    Raise ``RuntimeError`` if the body isn't valid XML, or goes over
+    ``max_size`` bytes, ``max_elements`` elements or ``max_depth`` levels of
+    nesting (``MAX_XML_SIZE``, ``MAX_XML_ELEMENTS`` and ``MAX_XML_DEPTH`` by
+    default).
+
+    """
+    max_size = MAX_XML_SIZE if max_size is None else max_size
+    max_elements = MAX_XML_ELEMENTS if max_elements is None else max_elements
+    max_depth = MAX_XML_DEPTH if max_depth is None else max_depth
+
+    # Without a charset in the request the one of the XML declaration (or
+    # UTF-8) is used by the parser
+    decoder = None
+    content_type = environ.get("CONTENT_TYPE")
+    if content_type and "charset=" in content_type:
+        charset = content_type.split("charset=")[1].split(";")[0].strip()
+        try:
+            decoder = codecs.getincrementaldecoder(charset)()
+        except LookupError as e:
+            raise RuntimeError("Unknown charset: %r" % charset) from e
+
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root: Optional[ET.Element] = None
+    size = elements = depth = 0
     try:
-        xml_content = ET.fromstring(content)
-    except ET.ParseError as e:
+        for chunk in utils_http.iter_request_body(environ):
+            size += len(chunk)
+            if size > max_size:
+                raise RuntimeError("XML request body too large")
+            parser.feed(decoder.decode(chunk) if decoder is not None else chunk)
+            for event, element in parser.read_events():
+                if event == "end":
+                    depth -= 1
+                    continue
+                elements += 1
+                depth += 1
+                if elements > max_elements:
+                    raise RuntimeError("Too many elements in XML request body")
+                if depth > max_depth:
+                    raise RuntimeError("XML request body nested too deeply")
+                if root is None:
+                    root = element
+        if not size:
+            return None
+        if decoder is not None:
+            parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+    except (ET.ParseError, UnicodeDecodeError) as e:
         raise RuntimeError("Failed to parse XML: %s" % e) from e
-    return xml_content
+    return root
 
 
 def xml_response(xml_content: ET.Element) -> bytes:
     f = io.BytesIO()
     ET.ElementTree(xml_content).write(f, encoding="utf-8", xml_declaration=True)
     return f.getvalue()
+
+
+def xml_stream(
+    root: ET.Element,
+    elements: Iterable[ET.Element] = (),
+) -> Iterator[bytes]:
+    """Serialize ``root`` with its children followed by ``elements``,
+    without building the whole document in memory."""
+    tag = root.tag
+    if tag.startswith("{%s}" % utils_xml.NAMESPACES["D"]):
+        tag = tag.split("}", maxsplit=1)[1]
+    else:
+        raise ValueError("Only DAV: root elements can be streamed: %r" % tag)
+
+    buffer = ["<?xml version='1.0' encoding='utf-8'?>\n"]
+    buffer.append("<%s %s>" % (tag, utils_xml.namespace_declarations()))
+    size = 0
+    for element in itertools.chain(root, elements):
+        serialized = utils_xml.serialize_element(element)
+        buffer.append(serialized)
+        size += len(serialized)
+        if size >= XML_STREAM_CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    buffer.append("</%s>" % tag)
+    yield "".join(buffer).encode("utf-8")
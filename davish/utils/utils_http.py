@@ -1,5 +1,9 @@
 import contextlib
+import zlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http import client
+from typing import Iterator, Optional
 
 from davish import types
 
@@ -52,6 +56,72 @@ DIRECTORY_LISTING: types.WSGIResponse = (
 # TODO: maybe this header should reflect what the library really does
 DAV_HEADERS: str = "1, 2, 3, calendar-access, addressbook, extended-mkcol"
 
+# Supported content codings by order of preference, with their zlib wbits
+CONTENT_CODINGS: dict[str, int] = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+# Request bodies that decode to more than this are refused
+MAX_DECODED_BODY_SIZE: int = 64 * 1024 * 1024
+
+
+def conditional_response(
+    environ: types.WSGIEnviron,
+    etag: str,
+    last_modified: str,
+) -> Optional[types.WSGIResponse]:
+    """Evaluate the conditional headers of a GET or HEAD request against the
+    ``etag`` and ``last_modified`` date of the resource, read rfc7232-6 for
+    info.
+
+    Return the 412 or 304 response to send, or None if the request is to be
+    answered normally.
+
+    """
+    modified = parse_http_date(last_modified)
+
+    if_match = environ.get("HTTP_IF_MATCH")
+    if if_match is not None:
+        etags = parse_etags(if_match)
+        if "*" not in etags and etag not in etags:
+            return PRECONDITION_FAILED
+    else:
+        since = parse_http_date(environ.get("HTTP_IF_UNMODIFIED_SINCE", ""))
+        if since and modified and modified > since:
+            return PRECONDITION_FAILED
+
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        # Weak comparison
+        etags = [etag.removeprefix("W/") for etag in parse_etags(if_none_match)]
+        not_modified = "*" in etags or etag.removeprefix("W/") in etags
+    else:
+        since = parse_http_date(environ.get("HTTP_IF_MODIFIED_SINCE", ""))
+        not_modified = bool(since and modified and modified <= since)
+
+    if not_modified:
+        return (
+            client.NOT_MODIFIED,
+            {"ETag": etag, "Last-Modified": last_modified},
+            None,
+        )
+    return None
+
+
+def parse_etags(value: str) -> list[str]:
+    """Split the entity tags of an If-Match or If-None-Match header."""
+    return [etag.strip() for etag in value.split(",") if etag.strip()]
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
 
 def decode_request(environ: types.WSGIEnviron, text: bytes) -> str:
     """Try to magically decode ``text`` according to given ``environ``."""
@@ -84,13 +154,92 @@ def decode_request(environ: types.WSGIEnviron, text: bytes) -> str:
 
 
 def read_raw_request_body(environ: types.WSGIEnviron) -> bytes:
+    return b"".join(iter_request_body(environ))
+
+
+def iter_request_body(
+    environ: types.WSGIEnviron,
+    chunk_size: int = 64 * 1024,
+) -> Iterator[bytes]:
+    """Read the request body in chunks of ``chunk_size`` bytes, undoing its
+    Content-Encoding as they are read."""
     content_length = int(environ.get("CONTENT_LENGTH") or 0)
     if not content_length:
-        return b""
-    content = environ["wsgi.input"].read(content_length)
-    if len(content) < content_length:
-        raise RuntimeError("Request body too short: %d" % len(content))
-    return content
+        return
+    decompressor = _request_decompressor(environ)
+    decoded_size = 0
+    remaining = content_length
+    while remaining:
+        chunk = environ["wsgi.input"].read(min(chunk_size, remaining))
+        if not chunk:
+            raise RuntimeError(
+                "Request body too short: %d" % (content_length - remaining)
+            )
+        remaining -= len(chunk)
+        if decompressor is None:
+            yield chunk
+            continue
+        # Decoded chunks are bounded too, however well the body compresses
+        while chunk:
+            try:
+                decoded = decompressor.decompress(chunk, chunk_size)
+            except zlib.error as e:
+                raise RuntimeError("Failed to decode request body: %s" % e) from e
+            chunk = decompressor.unconsumed_tail
+            decoded_size += len(decoded)
+            if decoded_size > MAX_DECODED_BODY_SIZE:
+                raise RuntimeError("Decoded request body too large")
+            if decoded:
+                yield decoded
+    if decompressor is not None and not decompressor.eof:
+        raise RuntimeError("Truncated request body")
+
+
+def _request_decompressor(
+    environ: types.WSGIEnviron,
+) -> "Optional[zlib._Decompress]":
+    """Return the decompressor undoing the Content-Encoding of the request
+    body, if it has one."""
+    coding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+    if coding in ("", "identity"):
+        return None
+    if coding == "x-gzip":
+        coding = "gzip"
+    if coding not in CONTENT_CODINGS:
+        raise RuntimeError("Unsupported content coding: %r" % coding)
+    return zlib.decompressobj(CONTENT_CODINGS[coding])
+
+
+def negotiate_content_coding(environ: types.WSGIEnviron) -> Optional[str]:
+    """Choose the content coding of the response from the Accept-Encoding
+    header, read rfc9110-12.5.3 for info."""
+    qvalues: dict[str, float] = {}
+    for accepted in environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, *params = accepted.split(";")
+        coding = coding.strip().lower()
+        if coding == "x-gzip":
+            coding = "gzip"
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if coding:
+            qvalues[coding] = qvalue
+
+    best_coding, best_qvalue = None, 0.0
+    for coding in CONTENT_CODINGS:
+        qvalue = qvalues.get(coding, qvalues.get("*", 0.0))
+        if qvalue > best_qvalue:
+            best_coding, best_qvalue = coding, qvalue
+    return best_coding
+
+
+def compressobj(coding: str, level: int) -> "zlib._Compress":
+    return zlib.compressobj(level, zlib.DEFLATED, CONTENT_CODINGS[coding])
 
 
 def read_request_body(environ: types.WSGIEnviron) -> str:
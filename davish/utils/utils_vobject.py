@@ -0,0 +1,182 @@
+from typing import Iterator, NamedTuple, Optional
+
+
+class Property(NamedTuple):
+    value: str
+    params: dict[str, list[str]]
+
+
+def unfold(text: str) -> Iterator[str]:
+    """Iterate over the unfolded content lines of ``text``, read rfc6350-3.2
+    for info."""
+    line = ""
+    for physical_line in text.splitlines():
+        if physical_line[:1] in (" ", "\t"):
+            line += physical_line[1:]
+            continue
+        if line:
+            yield line
+        line = physical_line
+    if line:
+        yield line
+
+
+def unescape(value: str) -> str:
+    """Unescape a TEXT value, read rfc6350-3.4 for info."""
+    if "\\" not in value:
+        return value
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append("\n" if char in "nN" else char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            chars.append(char)
+    return "".join(chars)
+
+
+def split_line(line: str) -> tuple[str, dict[str, list[str]], str]:
+    """Split a content line in its name (without group), parameters and raw
+    value."""
+    # Find the first colon that isn't inside a quoted parameter value
+    quoted = False
+    for position, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            break
+    else:
+        raise ValueError("Invalid content line: %r" % line)
+
+    head, value = line[:position], line[position + 1 :]
+    name, *raw_params = head.split(";")
+    name = name.rsplit(".", maxsplit=1)[-1].upper()
+
+    params: dict[str, list[str]] = {}
+    for raw_param in raw_params:
+        param_name, _, param_value = raw_param.partition("=")
+        values = params.setdefault(param_name.upper(), [])
+        values.extend(v.strip('"') for v in param_value.split(",") if v)
+    return name, params, value
+
+
+def parse_properties(text: str) -> dict[str, list[Property]]:
+    """Parse the properties of a single vCard (or iCalendar component)."""
+    properties: dict[str, list[Property]] = {}
+    for line in unfold(text):
+        try:
+            name, params, value = split_line(line)
+        except ValueError:
+            continue
+        if name in ("BEGIN", "END"):
+            continue
+        properties.setdefault(name, []).append(Property(unescape(value), params))
+    return properties
+
+
+# Components of a calendar that are items, the others (like VTIMEZONE) are
+# copied in every item that needs them
+ITEM_COMPONENTS = ("VEVENT", "VTODO", "VJOURNAL")
+
+
+def split_components(text: str) -> list[tuple[str, Optional[str], str]]:
+    """Split a multi-component iCalendar or vCard file into its items.
+
+    Return ``(tag, uid, text)`` tuples in order, with the ``VCALENDAR`` or
+    ``VCARD`` tag of the item. The components of a calendar sharing a UID
+    (like the overrides of a recurring event) make up a single item, along
+    with the properties of their calendar and the time zones they refer to.
+    Every component without a UID is an item of its own.
+
+    """
+    header: list[str] = []
+    timezones: dict[str, list[str]] = {}
+    # Keyed on the UID, or on the position of the components without one
+    components: dict[str | int, tuple[list[str], list[str]]] = {}
+    cards: list[tuple[str, Optional[str], str]] = []
+
+    block: list[str] = []
+    names: list[str] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        upper = line.upper()
+        if upper.startswith("BEGIN:"):
+            names.append(upper[6:].strip())
+            if len(names) == 1 and names[0] == "VCALENDAR":
+                # Every calendar of the file has its own properties
+                header = []
+                continue
+            block.append(line)
+            continue
+        if upper.startswith("END:") and names:
+            name = names.pop()
+            if not names and name == "VCALENDAR":
+                continue
+            block.append(line)
+            if names not in ([], ["VCALENDAR"]):
+                # End of a nested component, like a VALARM
+                continue
+            uid = _block_uid(block)
+            if name == "VCARD":
+                cards.append(("VCARD", uid, "\r\n".join(block) + "\r\n"))
+            elif name == "VTIMEZONE":
+                timezones[uid or ""] = block
+            elif name in ITEM_COMPONENTS:
+                key = uid if uid is not None else len(components)
+                components.setdefault(key, (header, []))[1].extend(block)
+            block = []
+            continue
+        if names == ["VCALENDAR"]:
+            header.append(line)
+        elif names:
+            block.append(line)
+    if names:
+        raise ValueError("Unterminated component: %s" % names[-1])
+
+    items = cards
+    for key, (properties, lines) in components.items():
+        tzids = _block_tzids(lines)
+        calendar = ["BEGIN:VCALENDAR", *properties]
+        for tzid, timezone in timezones.items():
+            if tzid in tzids:
+                calendar.extend(timezone)
+        calendar.extend(lines)
+        calendar.append("END:VCALENDAR")
+        uid = key if isinstance(key, str) else None
+        items.append(("VCALENDAR", uid, "\r\n".join(calendar) + "\r\n"))
+    return items
+
+
+def _block_tzids(lines: list[str]) -> set[str]:
+    """Return the time zones a component refers to in TZID parameters."""
+    tzids: set[str] = set()
+    for line in unfold("\r\n".join(lines)):
+        try:
+            _, params, _ = split_line(line)
+        except ValueError:
+            continue
+        tzids.update(tzid.strip() for tzid in params.get("TZID", ()))
+    return tzids
+
+
+def _block_uid(lines: list[str]) -> Optional[str]:
+    """Return the UID (or the TZID of a time zone) of a component."""
+    depth = 0
+    for line in unfold("\r\n".join(lines)):
+        upper = line.upper()
+        if upper.startswith("BEGIN:"):
+            depth += 1
+        elif upper.startswith("END:"):
+            depth -= 1
+        elif depth == 1:
+            try:
+                name, _, value = split_line(line)
+            except ValueError:
+                continue
+            if name in ("UID", "TZID"):
+                return unescape(value).strip()
+    return None
@@ -1,7 +1,8 @@
 import xml.etree.ElementTree as ET
 from http import client
-from typing import TYPE_CHECKING, Mapping
-from urllib.parse import quote
+from typing import TYPE_CHECKING, Callable, Mapping, Optional
+from urllib.parse import parse_qs, quote, urlencode
+from xml.sax.saxutils import escape, quoteattr
 
 from davish.utils import utils_path
 
@@ -17,6 +18,7 @@ OBJECT_MIMETYPES: Mapping[str, str] = {
     "VCARD": "text/vcard",
     "VLIST": "text/x-vlist",
     "VCALENDAR": "text/calendar",
+    "VEVENT": "text/calendar",
 }
 
 NAMESPACES: Mapping[str, str] = {
@@ -30,6 +32,8 @@ NAMESPACES: Mapping[str, str] = {
 
 NAMESPACES_REV: Mapping[str, str] = {v: k for k, v in NAMESPACES.items()}
 
+SYNC_TOKEN_PREFIX = "http://davish/ns/sync/"
+
 for short, url in NAMESPACES.items():
     ET.register_namespace("" if short == "D" else short, url)
 
@@ -77,6 +81,76 @@ def make_human_tag(clark_tag: str) -> str:
     return clark_tag
 
 
+def namespace_declarations() -> str:
+    """Return the declarations of ``NAMESPACES``, DAV: being the default."""
+    declarations = []
+    for short, url in NAMESPACES.items():
+        name = "xmlns" if short == "D" else "xmlns:%s" % short
+        declarations.append("%s=%s" % (name, quoteattr(url)))
+    return " ".join(declarations)
+
+
+def serialize_element(element: ET.Element) -> str:
+    """Serialize ``element`` using the prefixes of ``NAMESPACES``.
+
+    The declarations of ``NAMESPACES`` are expected on an ancestor, see
+    ``namespace_declarations``. Unknown namespaces are declared on the first
+    element using them.
+
+    """
+    parts: list[str] = []
+    _serialize_element(element, parts.append, {})
+    return "".join(parts)
+
+
+def _serialize_element(
+    element: ET.Element,
+    write: Callable[[str], object],
+    scope: dict[str, str],
+) -> None:
+    declarations: list[tuple[str, str]] = []
+    scope = dict(scope)
+
+    def qualify(clark_tag: str, is_attribute: bool = False) -> str:
+        if not clark_tag.startswith("{"):
+            return clark_tag
+        ns, tag = clark_tag[len("{") :].split("}", maxsplit=1)
+        if ns == NAMESPACES["D"]:
+            if not is_attribute:
+                # DAV: is the default namespace, which doesn't apply to
+                # attributes
+                return tag
+            prefix = scope.get(ns)
+        else:
+            prefix = scope.get(ns) or NAMESPACES_REV.get(ns)
+        if prefix is None:
+            prefix = scope[ns] = "ns%d" % len(scope)
+            declarations.append((prefix, ns))
+        return "%s:%s" % (prefix, tag)
+
+    tag = qualify(element.tag)
+    attributes = [(qualify(key, True), value) for key, value in element.items()]
+
+    write("<" + tag)
+    for prefix, ns in declarations:
+        write(" xmlns:%s=%s" % (prefix, quoteattr(ns)))
+    for key, value in attributes:
+        write(" %s=%s" % (key, quoteattr(value)))
+
+    if element.text or len(element):
+        write(">")
+        if element.text:
+            write(escape(element.text))
+        for child in element:
+            _serialize_element(child, write, scope)
+        write("</%s>" % tag)
+    else:
+        write(" />")
+
+    if element.tail:
+        write(escape(element.tail))
+
+
 def make_response(code: int) -> str:
     """Return full W3C names from HTTP status codes."""
     return "HTTP/1.1 %i %s" % (code, client.responses[code])
@@ -88,6 +162,42 @@ def make_href(href: str) -> str:
     return quote(href)
 
 
+def make_sync_token(token: str) -> str:
+    """Return the URI used as DAV:sync-token for the storage ``token``."""
+    return SYNC_TOKEN_PREFIX + token
+
+
+def parse_sync_token(sync_token: str) -> Optional[str]:
+    """Return the storage token of a DAV:sync-token, ``None`` if foreign."""
+    if not sync_token.startswith(SYNC_TOKEN_PREFIX):
+        return None
+    return sync_token[len(SYNC_TOKEN_PREFIX) :]
+
+
+def make_sync_continuation(token: str, base: str, after: str) -> str:
+    """Return the DAV:sync-token of a truncated sync-collection response.
+
+    The sync from the storage token ``base`` (empty for an initial sync) is
+    resumed after the item ``after``, and ``token`` is returned once done.
+
+    """
+    query = urlencode({"token": token, "base": base, "after": after})
+    return SYNC_TOKEN_PREFIX + "?" + query
+
+
+def parse_sync_continuation(sync_token: str) -> Optional[tuple[str, str, str]]:
+    """Return the token, base and after of a continuation DAV:sync-token,
+    ``None`` if it isn't one."""
+    token = parse_sync_token(sync_token)
+    if token is None or not token.startswith("?"):
+        return None
+    query = parse_qs(token[1:], keep_blank_values=True)
+    try:
+        return query["token"][0], query["base"][0], query["after"][0]
+    except (KeyError, IndexError):
+        return None
+
+
 def webdav_error(human_tag: str) -> ET.Element:
     """Generate XML error message."""
     root = ET.Element(make_clark("D:error"))
@@ -101,5 +211,5 @@ def get_content_type(item: "Item", encoding: str) -> str:
     tag = item.tag
     content_type = "%s;charset=%s" % (mimetype, encoding)
     if tag:
-        content_type += ";component=%s" % tag
+        content_type += ";component=%s" % tag.value
     return content_type
@@ -0,0 +1,13 @@
+import pytest
+
+from davish.storage import BaseStorage
+
+
+@pytest.fixture(autouse=True)
+def indexes():
+    # Every test has its own data, the default indexes are keyed on the user
+    # and the collection slug only
+    assert BaseStorage.indexes is not None
+    BaseStorage.indexes.clear()
+    yield BaseStorage.indexes
+    BaseStorage.indexes.clear()
@@ -0,0 +1,303 @@
+import dataclasses
+import io
+import itertools
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Optional
+from xml.etree import ElementTree as ET
+
+from davish import handle_dav_request
+from davish.index import component_time_range
+from davish.storage import (
+    BaseStorage,
+    Collection,
+    CollectionStats,
+    Item,
+    ItemTag,
+    SyncChanges,
+    Tag,
+)
+
+EPOCH = datetime(2024, 1, 1)
+
+CALENDAR = Collection(slug="calendar", name="Calendar", tag=Tag.CALENDAR)
+CONTACTS = Collection(slug="contacts", name="Contacts", tag=Tag.ADDRESS_BOOK)
+
+PROPFIND_ETAG = (
+    b'<D:propfind xmlns:D="DAV:">' b"<D:prop><D:getetag/></D:prop>" b"</D:propfind>"
+)
+
+
+def event(
+    uid: str,
+    start: str = "20240101T100000Z",
+    end: Optional[str] = "20240101T110000Z",
+    *lines: str,
+) -> str:
+    """Return a VCALENDAR with a single VEVENT."""
+    body = ["UID:%s" % uid, "DTSTART:%s" % start]
+    if end is not None:
+        body.append("DTEND:%s" % end)
+    body.extend(lines)
+    return "\r\n".join(
+        ["BEGIN:VCALENDAR", "VERSION:2.0", "BEGIN:VEVENT"]
+        + body
+        + ["END:VEVENT", "END:VCALENDAR", ""]
+    )
+
+
+def calendar(*uids: str) -> str:
+    """Return a VCALENDAR with a VEVENT for every UID, as imported by POST."""
+    body = []
+    for uid in uids:
+        body += ["BEGIN:VEVENT", "UID:%s" % uid, "DTSTART:20240101T100000Z"]
+        body += ["END:VEVENT"]
+    return "\r\n".join(
+        ["BEGIN:VCALENDAR", "VERSION:2.0"] + body + ["END:VCALENDAR", ""]
+    )
+
+
+def vcard(uid: str, fn: str, *lines: str) -> str:
+    """Return a vCard 3.0."""
+    body = ["UID:%s" % uid, "FN:%s" % fn, *lines]
+    return "\r\n".join(["BEGIN:VCARD", "VERSION:3.0"] + body + ["END:VCARD", ""])
+
+
+class MemoryStorage(BaseStorage):
+    """Storage of a user in dicts, with only the required methods and a
+    change log.
+
+    ``calls`` counts the calls of the backend methods, ``contents`` maps the
+    collection slugs to the contents of their items by href.
+
+    """
+
+    def __init__(
+        self,
+        user: str = "user",
+        collections: tuple[Collection, ...] = (CALENDAR, CONTACTS),
+    ) -> None:
+        self.user = user
+        self.collections = {collection.slug: collection for collection in collections}
+        self.items: dict[str, dict[str, Item]] = {slug: {} for slug in self.collections}
+        self.contents: dict[str, dict[str, str]] = {
+            slug: {} for slug in self.collections
+        }
+        self.changes: dict[str, list[str]] = {slug: [] for slug in self.collections}
+        self.calls: Counter[str] = Counter()
+        self._clock = itertools.count(1)
+
+    def collection_list(self) -> list[Collection]:
+        self.calls["collection_list"] += 1
+        return list(self.collections.values())
+
+    def collection_get(self, slug: str) -> Optional[Collection]:
+        self.calls["collection_get"] += 1
+        return self.collections.get(slug)
+
+    def collection_items(self, collection: Collection) -> list[Item]:
+        self.calls["collection_items"] += 1
+        return list(self.items.get(collection.slug, {}).values())
+
+    def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        self.calls["item_get"] += 1
+        return self.items.get(collection.slug, {}).get(href)
+
+    def item_serialize(self, item: Item) -> str:
+        self.calls["item_serialize"] += 1
+        return self.contents[item.collection.slug][item.href]
+
+    def item_time_range(self, item: Item) -> tuple[int, int]:
+        self.calls["item_time_range"] += 1
+        return component_time_range(self.item_serialize(item))
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        self.calls["item_upload"] += 1
+        tag = ItemTag.VEVENT if collection.is_calendar else ItemTag.VCARD
+        item = Item(
+            tag=tag,
+            href=href,
+            collection=collection,
+            last_modified=EPOCH + timedelta(seconds=next(self._clock)),
+        )
+        self.items[collection.slug][href] = item
+        self.contents[collection.slug][href] = content
+        self.changes[collection.slug].append(href)
+        return item
+
+    def item_delete(self, item: Item) -> None:
+        self.calls["item_delete"] += 1
+        del self.items[item.collection.slug][item.href]
+        del self.contents[item.collection.slug][item.href]
+        self.changes[item.collection.slug].append(item.href)
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        if collection.slug not in self.changes:
+            return None
+        return str(len(self.changes[collection.slug]))
+
+    def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        changes = self.changes.get(collection.slug, [])
+        if not sync_token.isdigit() or int(sync_token) > len(changes):
+            return None
+        result = SyncChanges(sync_token=str(len(changes)))
+        for href in dict.fromkeys(changes[int(sync_token) :]):
+            if href in self.items[collection.slug]:
+                result.modified.append(href)
+            else:
+                result.deleted.append(href)
+        return result
+
+
+class LookupStorage(MemoryStorage):
+    """Storage looking up items by href without listing the collection."""
+
+    def items_get_many(
+        self,
+        hrefs: Iterable[str],
+        collection: Collection,
+    ) -> dict[str, Item]:
+        self.calls["items_get_many"] += 1
+        items = self.items[collection.slug]
+        return {href: items[href] for href in hrefs if href in items}
+
+
+class VersionedStorage(MemoryStorage):
+    """``MemoryStorage`` with etags derived from the last_modified of the
+    items, and their sizes stored."""
+
+    def item_version(self, item: Item) -> Optional[str]:
+        return item.last_modified.isoformat()
+
+    def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        item = super().item_upload(href, collection, content)
+        assert item is not None
+        item = dataclasses.replace(item, size=len(content.encode()))
+        self.items[collection.slug][href] = item
+        return item
+
+
+class PersistedStorage(MemoryStorage):
+    """``MemoryStorage`` persisting the collection digests and stats."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.digests: dict[str, int] = {}
+        self.stats: dict[str, CollectionStats] = {}
+
+    def collection_digest_get(self, collection: Collection) -> Optional[int]:
+        return self.digests.get(collection.slug)
+
+    def collection_digest_set(self, collection: Collection, digest: int) -> None:
+        self.digests[collection.slug] = digest
+
+    def collection_stats_get(self, collection: Collection) -> Optional[CollectionStats]:
+        return self.stats.get(collection.slug)
+
+    def collection_stats_set(
+        self,
+        collection: Collection,
+        stats: Optional[CollectionStats],
+    ) -> None:
+        if stats is None:
+            self.stats.pop(collection.slug, None)
+        else:
+            self.stats[collection.slug] = stats
+
+
+def fill(
+    storage: BaseStorage, collection: Collection, contents: dict[str, str]
+) -> None:
+    for href, content in contents.items():
+        storage.item_upload(href, collection, content)
+
+
+@dataclass
+class Response:
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    def xml(self) -> ET.Element:
+        return ET.fromstring(self.body)
+
+    def hrefs(self) -> list[str]:
+        """The hrefs of the multistatus responses, in order."""
+        return [element.text or "" for element in self.xml().iter("{DAV:}href")]
+
+    def statuses(self) -> dict[str, str]:
+        """The status of every multistatus response without a propstat."""
+        statuses = {}
+        for response in self.xml().iter("{DAV:}response"):
+            href = response.findtext("{DAV:}href") or ""
+            status = response.findtext("{DAV:}status")
+            if status is not None:
+                statuses[href] = status
+        return statuses
+
+    def props(self, tag: str) -> dict[str, str]:
+        """The text of the ``tag`` property found for every href."""
+        found = {}
+        for response in self.xml().iter("{DAV:}response"):
+            href = response.findtext("{DAV:}href") or ""
+            for propstat in response.iter("{DAV:}propstat"):
+                if "200" not in (propstat.findtext("{DAV:}status") or ""):
+                    continue
+                element = propstat.find("{DAV:}prop/" + tag)
+                if element is not None:
+                    found[href] = element.text or ""
+        return found
+
+
+def request(
+    storage: BaseStorage,
+    method: str,
+    path: str,
+    body: bytes | str = b"",
+    headers: Optional[dict[str, str]] = None,
+    **options: Any,
+) -> Response:
+    """Run a request through ``handle_dav_request``, with the ``options``
+    it accepts, and read its whole content."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    environ = make_environ(method, path, body, headers)
+    status, response_headers, content = handle_dav_request(environ, storage, **options)
+    if not isinstance(content, bytes):
+        content = b"".join(content)
+    return Response(int(status), dict(response_headers), content)
+
+
+def make_environ(
+    method: str,
+    path: str,
+    body: bytes = b"",
+    headers: Optional[dict[str, str]] = None,
+) -> dict[str, Any]:
+    environ: dict[str, Any] = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    for name, value in (headers or {}).items():
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        environ[key] = value
+    return environ
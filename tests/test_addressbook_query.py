@@ -0,0 +1,100 @@
+from tests.helpers import CONTACTS, LookupStorage, fill, request, vcard
+
+CARDS = {
+    "ada.vcf": vcard("ada", "Ada Lovelace", "EMAIL;TYPE=WORK:ada@example.com"),
+    "bob.vcf": vcard("bob", "Bob Martin", "TEL:+33 1 23 45 67 89"),
+    "carl.vcf": vcard("carl", "Carl Sagan", "EMAIL:carl@example.org"),
+}
+
+
+def query(filters: str, test: str = "anyof") -> bytes:
+    return (
+        '<C:addressbook-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:carddav">'
+        '<D:prop><D:getetag/></D:prop><C:filter test="%s">%s</C:filter>'
+        "</C:addressbook-query>" % (test, filters)
+    ).encode()
+
+
+def text_match(name: str, text: str, match_type: str = "contains", **extra) -> str:
+    attributes = "".join(' %s="%s"' % item for item in extra.items())
+    return (
+        '<C:prop-filter name="%s"><C:text-match match-type="%s"%s>%s'
+        "</C:text-match></C:prop-filter>" % (name, match_type, attributes, text)
+    )
+
+
+def filled_storage() -> LookupStorage:
+    storage = LookupStorage()
+    fill(storage, CONTACTS, CARDS)
+    storage.calls.clear()
+    return storage
+
+
+def report(storage: LookupStorage, body: bytes) -> list[str]:
+    response = request(storage, "REPORT", "/contacts/", body)
+    assert response.status == 207
+    return sorted(href.rsplit("/", 1)[1] for href in response.hrefs())
+
+
+def test_match_types():
+    storage = filled_storage()
+    assert report(storage, query(text_match("FN", "ada lovelace", "equals"))) == [
+        "ada.vcf"
+    ]
+    assert report(storage, query(text_match("FN", "mart"))) == ["bob.vcf"]
+    assert report(storage, query(text_match("EMAIL", "carl@", "starts-with"))) == [
+        "carl.vcf"
+    ]
+    assert report(storage, query(text_match("TEL", "89", "ends-with"))) == ["bob.vcf"]
+    negated = text_match("FN", "a", "starts-with", **{"negate-condition": "yes"})
+    assert report(storage, query(negated)) == ["bob.vcf", "carl.vcf"]
+
+
+def test_anyof_and_allof():
+    storage = filled_storage()
+    filters = text_match("EMAIL", "example") + text_match("FN", "carl")
+    assert report(storage, query(filters)) == ["ada.vcf", "carl.vcf"]
+    assert report(storage, query(filters, "allof")) == ["carl.vcf"]
+
+
+def test_other_properties_are_matched_by_parsing_the_cards():
+    storage = filled_storage()
+    param_filter = (
+        '<C:prop-filter name="EMAIL"><C:param-filter name="TYPE">'
+        '<C:text-match match-type="equals">WORK</C:text-match>'
+        "</C:param-filter></C:prop-filter>"
+    )
+    assert report(storage, query(param_filter)) == ["ada.vcf"]
+    assert report(storage, query('<C:prop-filter name="NOTE"/>')) == []
+    assert storage.calls["item_serialize"] == len(CARDS) * 2
+
+
+def test_the_index_is_built_once():
+    storage = filled_storage()
+    body = query(text_match("EMAIL", "example"))
+    report(storage, body)
+    assert storage.calls["item_serialize"] == len(CARDS)
+
+    storage.calls.clear()
+    assert report(storage, body) == ["ada.vcf", "carl.vcf"]
+    # Only the matching cards, for their etags
+    assert storage.calls["item_serialize"] == 2
+    assert storage.calls["collection_items"] == 0
+
+
+def test_puts_and_deletes_update_the_index():
+    storage = filled_storage()
+    body = query(text_match("EMAIL", "example"))
+    report(storage, body)
+    request(
+        storage, "PUT", "/contacts/dan.vcf", vcard("dan", "Dan", "EMAIL:d@example.net")
+    )
+    request(storage, "DELETE", "/contacts/ada.vcf")
+    assert report(storage, body) == ["carl.vcf", "dan.vcf"]
+
+
+def test_without_indexes_every_card_is_parsed():
+    storage = filled_storage()
+    storage.indexes = None
+    assert report(storage, query(text_match("FN", "mart"))) == ["bob.vcf"]
+    assert storage.calls["item_serialize"] == len(CARDS)
@@ -0,0 +1,176 @@
+import asyncio
+import concurrent.futures
+import itertools
+from typing import Optional
+
+from davish import AsyncBaseStorage, SyncToAsyncStorage, handle_dav_request_async
+from davish.storage import Collection, Item, SyncChanges
+
+from tests.helpers import (
+    CALENDAR,
+    PROPFIND_ETAG,
+    MemoryStorage,
+    event,
+    fill,
+    make_environ,
+    request,
+)
+
+
+class AsyncMemoryStorage(AsyncBaseStorage):
+    """Native async storage over a ``MemoryStorage``."""
+
+    def __init__(self, storage: MemoryStorage) -> None:
+        self.storage = storage
+        self.user = storage.user
+
+    async def collection_list(self) -> list[Collection]:
+        await asyncio.sleep(0)
+        return self.storage.collection_list()
+
+    async def collection_get(self, slug: str) -> Optional[Collection]:
+        await asyncio.sleep(0)
+        return self.storage.collection_get(slug)
+
+    async def collection_items(self, collection: Collection) -> list[Item]:
+        await asyncio.sleep(0)
+        return self.storage.collection_items(collection)
+
+    async def item_get(self, href: str, collection: Collection) -> Optional[Item]:
+        await asyncio.sleep(0)
+        return self.storage.item_get(href, collection)
+
+    async def item_serialize(self, item: Item) -> str:
+        await asyncio.sleep(0)
+        return self.storage.item_serialize(item)
+
+    async def item_upload(
+        self,
+        href: str,
+        collection: Collection,
+        content: str,
+    ) -> Optional[Item]:
+        await asyncio.sleep(0)
+        return self.storage.item_upload(href, collection, content)
+
+    async def item_delete(self, item: Item) -> None:
+        await asyncio.sleep(0)
+        self.storage.item_delete(item)
+
+    async def collection_changes(
+        self,
+        collection: Collection,
+        sync_token: str,
+    ) -> Optional[SyncChanges]:
+        return self.storage.collection_changes(collection, sync_token)
+
+
+def run_async(storage, method, path, body=b"", headers=None, **options):
+    async def run():
+        environ = make_environ(method, path, body, headers)
+        status, _, content = await handle_dav_request_async(environ, storage, **options)
+        if not isinstance(content, bytes):
+            content = b"".join([chunk async for chunk in content])
+        return int(status), content
+
+    return asyncio.run(run())
+
+
+def filled_storage() -> MemoryStorage:
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(20)})
+    return storage
+
+
+def test_propfind_matches_the_sync_response():
+    storage = filled_storage()
+    expected = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    for async_storage in (SyncToAsyncStorage(storage), AsyncMemoryStorage(storage)):
+        status, body = run_async(
+            async_storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"}
+        )
+        assert status == 207
+        assert body == expected.body
+
+
+def test_streamed_content_is_an_async_iterator():
+    storage = filled_storage()
+    expected = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    status, body = run_async(
+        AsyncMemoryStorage(storage),
+        "PROPFIND",
+        "/calendar/",
+        PROPFIND_ETAG,
+        {"Depth": "1"},
+        stream=True,
+    )
+    assert status == 207
+    assert body == expected.body
+
+
+def test_serializations_are_fetched_only_for_etags():
+    storage = filled_storage()
+    displayname = (
+        b'<D:propfind xmlns:D="DAV:"><D:prop><D:displayname/></D:prop></D:propfind>'
+    )
+    run_async(
+        AsyncMemoryStorage(storage),
+        "PROPFIND",
+        "/calendar/",
+        displayname,
+        {"Depth": "1"},
+    )
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_put_and_delete():
+    storage = MemoryStorage()
+    async_storage = AsyncMemoryStorage(storage)
+    status, _ = run_async(async_storage, "PUT", "/calendar/a.ics", event("a").encode())
+    assert status == 201
+    assert "a.ics" in storage.contents["calendar"]
+    status, _ = run_async(async_storage, "DELETE", "/calendar/a.ics")
+    assert status == 200
+    assert "a.ics" not in storage.contents["calendar"]
+
+
+def concurrent_puts(count: int, default_workers: Optional[int] = None) -> set[int]:
+    storage = SyncToAsyncStorage(MemoryStorage())
+    hrefs = itertools.count()
+
+    async def put() -> int:
+        href = next(hrefs)
+        body = event("e%d" % href).encode()
+        environ = make_environ("PUT", "/calendar/%d.ics" % href, body)
+        status, _, _ = await handle_dav_request_async(environ, storage)
+        return int(status)
+
+    async def run() -> set[int]:
+        if default_workers is not None:
+            executor = concurrent.futures.ThreadPoolExecutor(default_workers)
+            asyncio.get_running_loop().set_default_executor(executor)
+        statuses = asyncio.gather(*(put() for _ in range(count)))
+        return set(await asyncio.wait_for(statuses, timeout=30))
+
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_dont_starve_the_storage_calls():
+    # The requests wait in worker threads for the storage calls, which need
+    # workers of their own
+    assert concurrent_puts(100) == {201}
+    assert concurrent_puts(8, default_workers=4) == {201}
+
+
+def test_requests_run_on_the_given_executor():
+    storage = filled_storage()
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        status, _ = run_async(
+            SyncToAsyncStorage(storage),
+            "PROPFIND",
+            "/calendar/",
+            PROPFIND_ETAG,
+            {"Depth": "1"},
+            executor=executor,
+        )
+    assert status == 207
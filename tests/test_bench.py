@@ -0,0 +1,51 @@
+import pytest
+
+from davish.bench.runner import format_results, load, percentile, run, save
+from davish.bench.scenarios import SCENARIOS
+from davish.bench.storage import BACKENDS, Dataset
+
+DATASET = Dataset(users=1, collections=2, items=5)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_every_scenario_runs(backend):
+    results = run(SCENARIOS, DATASET, runs=1, backend=backend)
+    assert results["backend"] == backend
+    assert [scenario["name"] for scenario in results["scenarios"]] == list(SCENARIOS)
+    for scenario in results["scenarios"]:
+        assert scenario["requests"] > 0
+        assert scenario["peak_memory"] > 0
+        assert all(status < "400" for status in scenario["statuses"])
+        assert scenario["storage_calls"]
+
+
+def test_results_are_saved_and_compared(tmp_path):
+    options = {"stream": True, "memoize": True}
+    results = run(["multiget"], DATASET, runs=2, options=options)
+    assert results["options"] == options
+    assert results["dataset"]["items"] == 5
+
+    path = str(tmp_path / "results.json")
+    save(results, path)
+    baseline = load(path)
+    assert baseline["scenarios"] == results["scenarios"]
+
+    table = format_results(results, baseline)
+    assert table.splitlines()[1].startswith("multiget")
+    assert "vs baseline" in table and "+0.0%" in table
+    assert "vs baseline" not in format_results(results)
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([3.0, 1.0, 2.0], 1.0) == 3.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_datasets_are_reproducible():
+    first, second = DATASET.build(), DATASET.build()
+    assert first.items == second.items
+    assert DATASET.user_names() == ["user0"]
+    assert len(first.collections["user0"]) == 2
@@ -0,0 +1,125 @@
+from typing import Optional
+
+from davish.storage import Collection
+
+from tests.helpers import (
+    CALENDAR,
+    LookupStorage,
+    MemoryStorage,
+    event,
+    fill,
+    request,
+)
+
+MONTHS = ["202401", "202402", "202403", "202404", "202405", "202406"]
+
+
+def query(start: str, end: str, component: str = "VEVENT") -> bytes:
+    return (
+        '<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+        "<D:prop><D:getetag/></D:prop><C:filter>"
+        '<C:comp-filter name="VCALENDAR"><C:comp-filter name="%s">'
+        '<C:time-range start="%s" end="%s"/>'
+        "</C:comp-filter></C:comp-filter></C:filter></C:calendar-query>"
+        % (component, start, end)
+    ).encode()
+
+
+class UnloggedStorage(LookupStorage):
+    """Storage without a change log."""
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return None
+
+
+def filled_storage(storage: Optional[MemoryStorage] = None) -> MemoryStorage:
+    storage = storage or LookupStorage()
+    fill(
+        storage,
+        CALENDAR,
+        {
+            "%s.ics" % month: event(month, month + "15T100000Z", month + "15T110000Z")
+            for month in MONTHS
+        },
+    )
+    storage.calls.clear()
+    return storage
+
+
+def report(storage: MemoryStorage, start: str, end: str) -> list[str]:
+    response = request(storage, "REPORT", "/calendar/", query(start, end))
+    assert response.status == 207
+    return sorted(response.hrefs())
+
+
+def test_time_range():
+    storage = filled_storage()
+    hrefs = report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert hrefs == ["/calendar/202402.ics", "/calendar/202403.ics"]
+    # The range end is excluded
+    hrefs = report(storage, "20240101T000000Z", "20240215T100000Z")
+    assert hrefs == ["/calendar/202401.ics"]
+
+
+def test_other_components_dont_match():
+    storage = filled_storage()
+    body = query("20240101T000000Z", "20250101T000000Z", "VTODO")
+    assert request(storage, "REPORT", "/calendar/", body).hrefs() == []
+
+
+def test_the_index_is_validated_without_listing():
+    storage = filled_storage()
+    report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert storage.calls["item_time_range"] == len(MONTHS)
+
+    storage.calls.clear()
+    report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_time_range"] == 0
+
+
+def test_puts_and_deletes_update_the_index():
+    storage = filled_storage()
+    report(storage, "20240201T000000Z", "20240401T000000Z")
+    moved = event("202405", "20240310T100000Z", "20240310T110000Z")
+    request(storage, "PUT", "/calendar/202405.ics", moved)
+    request(storage, "DELETE", "/calendar/202402.ics")
+
+    storage.calls.clear()
+    hrefs = report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert hrefs == ["/calendar/202403.ics", "/calendar/202405.ics"]
+    assert storage.calls["collection_items"] == 0
+
+
+def test_changes_made_elsewhere_are_read_from_the_change_log():
+    storage = filled_storage()
+    report(storage, "20240201T000000Z", "20240401T000000Z")
+    # Not through a request, the index only sees the new sync token
+    storage.item_upload("new.ics", CALENDAR, event("new", "20240320T100000Z"))
+
+    storage.calls.clear()
+    hrefs = report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert "/calendar/new.ics" in hrefs
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_time_range"] == 1
+
+
+def test_without_change_log_the_index_is_refreshed_from_a_listing():
+    storage = filled_storage(UnloggedStorage())
+    report(storage, "20240201T000000Z", "20240401T000000Z")
+    storage.item_upload("new.ics", CALENDAR, event("new", "20240320T100000Z"))
+
+    storage.calls.clear()
+    hrefs = report(storage, "20240201T000000Z", "20240401T000000Z")
+    assert "/calendar/new.ics" in hrefs
+    assert storage.calls["collection_items"] == 1
+    assert storage.calls["item_time_range"] == 1
+
+
+def test_without_indexes_every_item_is_checked():
+    start, end = "20240101T000000Z", "20240301T000000Z"
+    indexed = report(filled_storage(), start, end)
+    storage = filled_storage()
+    storage.indexes = None
+    assert report(storage, start, end) == indexed
+    assert storage.calls["item_time_range"] == len(MONTHS)
@@ -0,0 +1,121 @@
+import gzip
+import zlib
+
+import pytest
+
+from davish.utils import utils_http
+
+from tests.helpers import (
+    CALENDAR,
+    PROPFIND_ETAG,
+    MemoryStorage,
+    event,
+    fill,
+    request,
+)
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"%02d.ics" % i: event("e%d" % i) for i in range(50)})
+    return storage
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, coding",
+    [
+        ("gzip", "gzip"),
+        ("x-gzip", "gzip"),
+        ("deflate", "deflate"),
+        ("gzip;q=0.5, deflate", "deflate"),
+        ("*", "gzip"),
+        ("gzip;q=0, *;q=0.1", "deflate"),
+        ("br", None),
+        ("", None),
+    ],
+)
+def test_negotiation(accept_encoding, coding):
+    environ = {"HTTP_ACCEPT_ENCODING": accept_encoding}
+    assert utils_http.negotiate_content_coding(environ) == coding
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_responses_are_compressed(storage, stream):
+    expected = request(storage, "GET", "/calendar/").body
+    for coding, decompress in (
+        ("gzip", gzip.decompress),
+        ("deflate", zlib.decompress),
+    ):
+        response = request(
+            storage,
+            "GET",
+            "/calendar/",
+            headers={"Accept-Encoding": coding},
+            compress=True,
+            stream=stream,
+        )
+        assert response.headers["Content-Encoding"] == coding
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert len(response.body) < len(expected)
+        assert decompress(response.body) == expected
+
+
+def test_small_responses_are_sent_as_they_are(storage):
+    headers = {"Accept-Encoding": "gzip", "Depth": "1"}
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, headers, compress=True
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    response = request(
+        storage,
+        "PROPFIND",
+        "/calendar/",
+        PROPFIND_ETAG,
+        headers,
+        compress=True,
+        compress_min_size=1 << 20,
+    )
+    assert "Content-Encoding" not in response.headers
+    assert response.xml().tag == "{DAV:}multistatus"
+
+    response = request(storage, "GET", "/calendar/", headers=headers)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compressed_request_bodies_are_decoded(storage):
+    body = gzip.compress(event("new").encode())
+    response = request(
+        storage, "PUT", "/calendar/new.ics", body, {"Content-Encoding": "gzip"}
+    )
+    assert response.status == 201
+    assert storage.contents["calendar"]["new.ics"] == event("new")
+
+    body = gzip.compress(PROPFIND_ETAG)
+    response = request(
+        storage,
+        "PROPFIND",
+        "/calendar/",
+        body,
+        {"Content-Encoding": "gzip", "Depth": "1"},
+    )
+    assert response.status == 207
+    assert len(response.props("{DAV:}getetag")) == 52
+
+
+def test_invalid_compressed_bodies_are_refused(storage, monkeypatch):
+    headers = {"Content-Encoding": "gzip"}
+    response = request(storage, "PUT", "/calendar/new.ics", b"garbage", headers)
+    assert response.status == 400
+    truncated = gzip.compress(event("new").encode())[:-10]
+    response = request(storage, "PUT", "/calendar/new.ics", truncated, headers)
+    assert response.status == 400
+
+    monkeypatch.setattr(utils_http, "MAX_DECODED_BODY_SIZE", 1024)
+    bomb = gzip.compress(
+        event("new", "20240101T100000Z", None, "X:" + "x" * 4096).encode()
+    )
+    response = request(storage, "PUT", "/calendar/new.ics", bomb, headers)
+    assert response.status == 400
+    assert "new.ics" not in storage.contents["calendar"]
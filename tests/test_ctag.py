@@ -0,0 +1,65 @@
+from tests.helpers import (
+    CALENDAR,
+    MemoryStorage,
+    PersistedStorage,
+    calendar,
+    event,
+    fill,
+    request,
+)
+
+PROPFIND_CTAG = (
+    b'<D:propfind xmlns:D="DAV:" xmlns:CS="http://calendarserver.org/ns/">'
+    b"<D:prop><CS:getctag/></D:prop></D:propfind>"
+)
+
+
+def ctag(storage: MemoryStorage) -> str:
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_CTAG, {"Depth": "0"})
+    return response.props("{http://calendarserver.org/ns/}getctag")["/calendar/"]
+
+
+def fresh_ctag(storage: MemoryStorage) -> str:
+    """The ctag of a storage with the same items, computed from scratch."""
+    copy = MemoryStorage()
+    fill(copy, CALENDAR, storage.contents["calendar"])
+    return ctag(copy)
+
+
+def test_the_digest_doesnt_depend_on_the_order():
+    first, second = MemoryStorage(), MemoryStorage()
+    fill(first, CALENDAR, {"a.ics": event("a"), "b.ics": event("b")})
+    fill(second, CALENDAR, {"b.ics": event("b"), "a.ics": event("a")})
+    assert ctag(first) == ctag(second)
+    assert first.collection_etag(CALENDAR) == ctag(first)
+
+
+def test_the_ctag_changes_with_the_items():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"a.ics": event("a")})
+    before = ctag(storage)
+    storage.item_upload("a.ics", CALENDAR, event("a", "20240105T100000Z"))
+    assert ctag(storage) != before
+
+
+def test_persisted_digests_are_updated_by_put_delete_and_post():
+    storage = PersistedStorage()
+    fill(storage, CALENDAR, {"a.ics": event("a"), "b.ics": event("b")})
+    ctag(storage)
+    assert "calendar" in storage.digests
+
+    request(storage, "PUT", "/calendar/c.ics", event("c"))
+    request(storage, "PUT", "/calendar/a.ics", event("a", "20240105T100000Z"))
+    request(storage, "DELETE", "/calendar/b.ics")
+    request(storage, "POST", "/calendar/", calendar("d", "e"))
+    storage.calls.clear()
+
+    assert ctag(storage) == fresh_ctag(storage)
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_digests_arent_set_without_a_prior_value():
+    storage = PersistedStorage()
+    request(storage, "PUT", "/calendar/a.ics", event("a"))
+    assert storage.digests == {}
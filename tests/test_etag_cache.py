@@ -0,0 +1,77 @@
+from davish import ETagCache
+
+from tests.helpers import CALENDAR, PROPFIND_ETAG, MemoryStorage, event, fill, request
+
+
+def cached_storage(user: str = "user") -> MemoryStorage:
+    storage = MemoryStorage(user)
+    storage.etag_cache = ETagCache()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    return storage
+
+
+def propfind(storage: MemoryStorage) -> dict[str, str]:
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    return response.props("{DAV:}getetag")
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ETagCache(maxsize=2)
+    cache.set(("user", "calendar", "a.ics", 1), '"a"')
+    cache.set(("user", "calendar", "b.ics", 1), '"b"')
+    assert cache.get(("user", "calendar", "a.ics", 1)) == '"a"'
+    cache.set(("user", "calendar", "c.ics", 1), '"c"')
+
+    assert len(cache) == 2
+    assert cache.get(("user", "calendar", "b.ics", 1)) is None
+    assert cache.get(("user", "calendar", "c.ics", 1)) == '"c"'
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache.clear()
+    assert len(cache) == 0 and (cache.hits, cache.misses) == (0, 0)
+
+
+def test_etags_are_served_across_requests():
+    storage = cached_storage()
+    etags = propfind(storage)
+    assert len(etags) == 6
+    storage.calls.clear()
+
+    assert propfind(storage) == etags
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_changed_items_get_a_new_etag():
+    storage = cached_storage()
+    etags = propfind(storage)
+    storage.item_upload("1.ics", CALENDAR, event("e1", "20240105T100000Z"))
+
+    changed = propfind(storage)
+    assert changed["/calendar/1.ics"] != etags["/calendar/1.ics"]
+    assert changed["/calendar/2.ics"] == etags["/calendar/2.ics"]
+
+
+def test_users_dont_share_entries():
+    alice = cached_storage("alice")
+    bob = cached_storage("bob")
+    bob.etag_cache = alice.etag_cache
+    bob.contents["calendar"]["1.ics"] = event("bob")
+    assert propfind(alice)["/calendar/1.ics"] != propfind(bob)["/calendar/1.ics"]
+
+
+def test_if_match_uses_the_cache():
+    storage = cached_storage()
+    etag = propfind(storage)["/calendar/1.ics"]
+    storage.calls.clear()
+
+    body = event("e1", "20240105T100000Z").encode()
+    response = request(storage, "PUT", "/calendar/1.ics", body, {"If-Match": '"x"'})
+    assert response.status == 412
+    assert storage.calls["item_serialize"] == 0
+    response = request(storage, "PUT", "/calendar/1.ics", body, {"If-Match": etag})
+    assert response.status in (200, 201, 204)
+    # Only the uploaded item is serialized, for the ETag of the response
+    assert storage.calls["item_serialize"] == 1
+    response = request(storage, "DELETE", "/calendar/1.ics", b"", {"If-Match": etag})
+    assert response.status == 412
+    assert storage.calls["item_serialize"] == 1
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from davish import FileSystemStorage
+from davish.storage import Item
+from davish.storages import filesystem
+
+from tests.helpers import CALENDAR, CONTACTS, PROPFIND_ETAG, event, request, vcard
+
+PROPFIND_LENGTH = (
+    b'<D:propfind xmlns:D="DAV:"><D:prop><D:getetag/><D:getcontentlength/>'
+    b"<D:getlastmodified/></D:prop></D:propfind>"
+)
+
+
+class CountingStorage(FileSystemStorage):
+    """``FileSystemStorage`` counting the files it reads."""
+
+    reads = 0
+
+    def item_serialize(self, item: Item) -> str:
+        self.reads += 1
+        return super().item_serialize(item)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = CountingStorage(str(tmp_path), user="alice")
+    storage.fsync = False
+    storage.collection_create(CALENDAR)
+    storage.collection_create(CONTACTS)
+    return storage
+
+
+def test_collections(storage, tmp_path):
+    assert storage.collection_list() == [CALENDAR, CONTACTS]
+    assert storage.collection_get("calendar") == CALENDAR
+    assert storage.collection_get("missing") is None
+    assert storage.collection_get("..") is None
+    assert FileSystemStorage(str(tmp_path), user="bob").collection_list() == []
+
+    storage.collection_delete(CONTACTS)
+    assert storage.collection_list() == [CALENDAR]
+
+
+def test_upload_get_and_delete(storage, tmp_path):
+    item = storage.item_upload("a.ics", CALENDAR, event("a"))
+    assert item.size == len(event("a").encode()) and item.etag
+    assert storage.item_get("a.ics", CALENDAR) == item
+    assert storage.item_serialize(item) == event("a")
+    assert list(storage.collection_items(CALENDAR).hrefs) == ["a.ics"]
+    # No temporary file is left behind
+    assert sorted(os.listdir(tmp_path / "alice" / "calendar")) == [
+        ".collection.json",
+        "a.ics",
+    ]
+
+    storage.item_delete(item)
+    assert storage.item_get("a.ics", CALENDAR) is None
+    assert list(storage.collection_items(CALENDAR).hrefs) == []
+
+
+def test_unsafe_and_hidden_hrefs_are_refused(storage):
+    assert storage.item_upload("../a.ics", CALENDAR, event("a")) is None
+    assert storage.item_upload(".collection.json", CALENDAR, "{}") is None
+    assert storage.item_get(".collection.json", CALENDAR) is None
+    assert storage.item_get("../calendar", CALENDAR) is None
+
+
+def test_replaced_items_get_a_new_etag_and_last_modified(storage):
+    first = storage.item_upload("a.ics", CALENDAR, event("a"))
+    # Same size, written right away
+    second = storage.item_upload("a.ics", CALENDAR, event("b"))
+    assert second.last_modified > first.last_modified
+    assert second.etag != first.etag
+
+
+def test_propfind_reads_no_file(storage):
+    for i in range(20):
+        storage.item_upload("%d.ics" % i, CALENDAR, event("e%d" % i))
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_LENGTH, {"Depth": "1"}
+    )
+    assert response.status == 207
+    assert len(response.props("{DAV:}getetag")) == 21
+    lengths = response.props("{DAV:}getcontentlength")
+    assert lengths["/calendar/3.ics"] == str(len(event("e3").encode()))
+    assert storage.reads == 0
+
+
+def test_big_files_are_mapped(storage, monkeypatch):
+    monkeypatch.setattr(filesystem, "MMAP_THRESHOLD", 16)
+    content = event("a", "20240101T100000Z", None, "DESCRIPTION:café")
+    item = storage.item_upload("a.ics", CALENDAR, content)
+    assert storage.item_serialize(item) == content
+
+
+def test_http_round_trip(storage):
+    assert request(storage, "PUT", "/contacts/a.vcf", vcard("a", "Ada")).status == 201
+    response = request(storage, "GET", "/contacts/a.vcf")
+    assert response.body == vcard("a", "Ada").encode()
+    etag = response.headers["ETag"]
+    response = request(storage, "PROPFIND", "/contacts/", PROPFIND_ETAG, {"Depth": "1"})
+    assert response.props("{DAV:}getetag")["/contacts/a.vcf"] == etag
+    assert request(storage, "DELETE", "/contacts/a.vcf").status == 200
+    assert storage.item_get("a.vcf", CONTACTS) is None
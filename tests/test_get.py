@@ -0,0 +1,119 @@
+from davish import handle_dav_request
+
+from tests.helpers import (
+    CALENDAR,
+    CONTACTS,
+    VersionedStorage,
+    event,
+    fill,
+    make_environ,
+    request,
+    vcard,
+)
+
+# Enough items for a few chunks of exported content
+COUNT = 300
+
+
+def filled() -> VersionedStorage:
+    storage = VersionedStorage()
+    description = "DESCRIPTION:" + "x" * 500
+    fill(
+        storage,
+        CALENDAR,
+        {
+            "%03d.ics" % i: event("e%d" % i, "20240101T100000Z", None, description)
+            for i in range(COUNT)
+        },
+    )
+    storage.calls.clear()
+    return storage
+
+
+def test_collection_exports_are_streamed():
+    storage = filled()
+    expected = request(storage, "GET", "/calendar/")
+    storage.calls.clear()
+    environ = make_environ("GET", "/calendar/")
+    status, headers, content = handle_dav_request(environ, storage, stream=True)
+    assert status == 200
+    assert headers["Content-Type"] == "text/calendar; charset=utf-8"
+    assert not isinstance(content, bytes)
+
+    first = next(content)
+    assert storage.calls["item_serialize"] < COUNT
+    body = first + b"".join(content)
+    assert body == expected.body
+    assert body.count(b"BEGIN:VEVENT") == COUNT
+
+
+def test_address_books_are_exported_as_vcards():
+    storage = VersionedStorage()
+    fill(storage, CONTACTS, {"a.vcf": vcard("a", "Ada"), "b.vcf": vcard("b", "Bob")})
+    response = request(storage, "GET", "/contacts/")
+    assert response.status == 200
+    assert response.headers["Content-Type"] == "text/vcard; charset=utf-8"
+    assert response.body.count(b"BEGIN:VCARD") == 2
+    assert "contacts.vcf" in response.headers["Content-Disposition"]
+
+
+def test_head_doesnt_serialize():
+    storage = filled()
+    for path in ("/calendar/", "/calendar/001.ics"):
+        response = request(storage, "HEAD", path)
+        assert response.status == 200 and response.body == b""
+        assert response.headers["ETag"]
+    assert storage.calls["item_serialize"] == 0
+
+
+def conditional(storage, path, headers, method="GET"):
+    return request(storage, method, path, b"", headers)
+
+
+def test_unchanged_items_are_not_modified():
+    storage = filled()
+    response = request(storage, "GET", "/calendar/001.ics")
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    storage.calls.clear()
+
+    for headers in (
+        {"If-None-Match": etag},
+        {"If-None-Match": '"other", W/%s' % etag},
+        {"If-None-Match": "*"},
+        {"If-Modified-Since": last_modified},
+    ):
+        for method in ("GET", "HEAD"):
+            response = conditional(storage, "/calendar/001.ics", headers, method)
+            assert response.status == 304 and response.body == b""
+            assert response.headers["ETag"] == etag
+    assert storage.calls["item_serialize"] == 0
+
+    response = conditional(storage, "/calendar/001.ics", {"If-None-Match": '"x"'})
+    assert response.status == 200 and b"UID:e1" in response.body
+    response = conditional(
+        storage,
+        "/calendar/001.ics",
+        {"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+    )
+    assert response.status == 200
+
+
+def test_failed_preconditions():
+    storage = filled()
+    etag = request(storage, "HEAD", "/calendar/").headers["ETag"]
+    assert conditional(storage, "/calendar/", {"If-Match": etag}).status == 200
+    assert conditional(storage, "/calendar/", {"If-Match": '"x"'}).status == 412
+    response = conditional(
+        storage,
+        "/calendar/001.ics",
+        {"If-Unmodified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+    )
+    assert response.status == 412
+
+
+def test_changed_collections_are_sent_again():
+    storage = filled()
+    etag = request(storage, "HEAD", "/calendar/").headers["ETag"]
+    assert conditional(storage, "/calendar/", {"If-None-Match": etag}).status == 304
+    request(storage, "PUT", "/calendar/new.ics", event("new"))
+    assert conditional(storage, "/calendar/", {"If-None-Match": etag}).status == 200
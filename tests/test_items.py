@@ -0,0 +1,126 @@
+import pytest
+
+from davish import storage as storage_module
+from davish.storage import Collection, Item, ItemBatch, ItemTag, format_datetime
+
+from tests.helpers import CALENDAR, PROPFIND_ETAG, MemoryStorage, event, fill, request
+
+# 2024-01-01T00:00:00Z in microseconds since the epoch
+TIMESTAMP = 1704067200 * 10**6
+
+PROPFIND_ALL = (
+    b'<D:propfind xmlns:D="DAV:"><D:prop><D:getetag/><D:getcontentlength/>'
+    b"<D:getlastmodified/></D:prop></D:propfind>"
+)
+
+
+class BatchStorage(MemoryStorage):
+    """``MemoryStorage`` listing its collections as an ``ItemBatch`` with
+    integer timestamps, etags and sizes."""
+
+    def collection_items(self, collection: Collection) -> ItemBatch:
+        self.calls["collection_items"] += 1
+        items = ItemBatch(collection, ItemTag.VEVENT, etags=[], sizes=[])
+        for i, (href, content) in enumerate(self.contents[collection.slug].items()):
+            items.append(href, TIMESTAMP + i, '"%s"' % href, len(content.encode()))
+        return items
+
+
+@pytest.fixture
+def storage():
+    storage = BatchStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(10)})
+    storage.calls.clear()
+    return storage
+
+
+@pytest.fixture
+def created(monkeypatch):
+    """Count the ``Item`` created by the batches."""
+    created = []
+
+    class CountingItem(Item):
+        __slots__ = ()
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.href)
+
+    monkeypatch.setattr(storage_module, "Item", CountingItem)
+    return created
+
+
+def test_items_and_collections_are_slotted():
+    item = Item(ItemTag.VEVENT, "a.ics", CALENDAR, TIMESTAMP)
+    assert not hasattr(item, "__dict__")
+    assert not hasattr(CALENDAR, "__dict__")
+    with pytest.raises(AttributeError):
+        item.color = "red"
+
+
+def test_batches_share_their_collection(storage):
+    items = storage.collection_items(CALENDAR)
+    assert len(items) == 10
+    first = items[0]
+    assert first == Item(
+        ItemTag.VEVENT, "0.ics", CALENDAR, TIMESTAMP, '"0.ics"', first.size
+    )
+    assert all(item.collection is items.collection for item in items)
+
+    sliced = items[2:4]
+    assert isinstance(sliced, ItemBatch)
+    assert [item.href for item in sliced] == ["2.ics", "3.ics"]
+    assert sliced.etags == ['"2.ics"', '"3.ics"']
+
+    items = ItemBatch(CALENDAR, ItemTag.VEVENT)
+    items.append("a.ics", TIMESTAMP)
+    assert list(items) == [Item(ItemTag.VEVENT, "a.ics", CALENDAR, TIMESTAMP)]
+
+
+def test_integer_timestamps_are_formatted():
+    assert format_datetime(TIMESTAMP) == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert format_datetime(TIMESTAMP + 999_999) == format_datetime(TIMESTAMP)
+
+
+def test_lookups_only_create_the_requested_items(storage, created):
+    found = storage.items_get_many(["3.ics", "missing.ics", "1.ics"], CALENDAR)
+    assert list(found) == ["3.ics", "1.ics"]
+    assert created == ["3.ics", "1.ics"]
+
+
+def test_collection_metadata_creates_no_item(storage, created):
+    storage.indexes = None
+    summary = storage.collection_summary(CALENDAR)
+    assert summary.count == 10
+    assert summary.last_modified == TIMESTAMP + 9
+    assert created == []
+    assert storage.calls["item_serialize"] == 0
+    # The items are joined by newlines
+    assert summary.size == len(storage.serialize(CALENDAR).encode())
+
+
+def test_propfind_reads_the_batch(storage):
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_ALL, {"Depth": "1"})
+    assert response.status == 207
+    assert response.props("{DAV:}getetag")["/calendar/4.ics"] == '"4.ics"'
+    lengths = response.props("{DAV:}getcontentlength")
+    assert lengths["/calendar/4.ics"] == str(len(event("e4").encode()))
+    modified = response.props("{DAV:}getlastmodified")
+    assert modified["/calendar/4.ics"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert storage.calls["item_serialize"] == 0
+
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    assert len(response.props("{DAV:}getetag")) == 11
+
+
+def test_index_refreshes_only_create_the_changed_items(storage, created):
+    storage.collection_summary(CALENDAR)
+    assert len(created) == 10
+    created.clear()
+
+    storage.item_upload("new.ics", CALENDAR, event("new"))
+    storage.item_upload("0.ics", CALENDAR, event("e0", "20240102T100000Z"))
+    summary = storage.collection_summary(CALENDAR)
+    assert summary.count == 11
+    # The items in the change log since the last refresh
+    assert created == ["new.ics", "0.ics"]
@@ -0,0 +1,110 @@
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from tests.helpers import (
+    CALENDAR,
+    CONTACTS,
+    LookupStorage,
+    event,
+    fill,
+    request,
+    vcard,
+)
+
+CALENDAR_QUERY = (
+    '<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    "<D:prop><D:getetag/></D:prop>"
+    '<C:filter><C:comp-filter name="VCALENDAR"/></C:filter>%s</C:calendar-query>'
+)
+ADDRESSBOOK_QUERY = (
+    '<CR:addressbook-query xmlns:D="DAV:" xmlns:CR="urn:ietf:params:xml:ns:carddav">'
+    "<D:prop><D:getetag/></D:prop><CR:filter/>%s</CR:addressbook-query>"
+)
+SYNC = (
+    '<D:sync-collection xmlns:D="DAV:"><D:sync-token>%s</D:sync-token>'
+    "<D:sync-level>1</D:sync-level>"
+    "<D:prop><D:getetag/></D:prop></D:sync-collection>"
+)
+TRUNCATED = "HTTP/1.1 507 Insufficient Storage"
+
+
+def limit(nresults: Optional[int], prefix: str = "D") -> str:
+    if nresults is None:
+        return ""
+    return "<{0}:limit><{0}:nresults>{1}</{0}:nresults></{0}:limit>".format(
+        prefix, nresults
+    )
+
+
+def filled() -> LookupStorage:
+    storage = LookupStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    fill(storage, CONTACTS, {"%d.vcf" % i: vcard("c%d" % i, "C") for i in range(5)})
+    return storage
+
+
+def items(response) -> list[str]:
+    return sorted(response.props("{DAV:}getetag"))
+
+
+def test_queries_are_truncated_to_the_first_hrefs():
+    storage = filled()
+    response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % limit(2))
+    assert response.status == 207
+    assert items(response) == ["/calendar/0.ics", "/calendar/1.ics"]
+    assert response.statuses() == {"/calendar/": TRUNCATED}
+    element = response.xml().find(".//{DAV:}number-of-matches-within-limits")
+    assert element is not None
+
+    body = ADDRESSBOOK_QUERY % limit(3, "CR")
+    response = request(storage, "REPORT", "/contacts/", body)
+    assert items(response) == ["/contacts/0.vcf", "/contacts/1.vcf", "/contacts/2.vcf"]
+    assert response.statuses() == {"/contacts/": TRUNCATED}
+
+
+def test_results_within_the_limit_arent_truncated():
+    storage = filled()
+    response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % limit(5))
+    assert len(items(response)) == 5
+    assert response.statuses() == {}
+
+
+def test_the_storage_maximum_applies():
+    storage = filled()
+    storage.max_results = 2
+    response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % "")
+    assert len(items(response)) == 2
+    response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % limit(1))
+    assert len(items(response)) == 1
+    response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % limit(4))
+    assert len(items(response)) == 2
+
+
+def test_sync_is_paged():
+    storage = filled()
+    storage.max_results = 2
+    hrefs: list[str] = []
+    token = ""
+    for _ in range(5):
+        response = request(storage, "REPORT", "/calendar/", SYNC % escape(token))
+        hrefs += items(response)
+        token = response.xml().findtext("{DAV:}sync-token")
+        if not response.statuses():
+            break
+        assert response.statuses() == {"/calendar/": TRUNCATED}
+    assert hrefs == ["/calendar/%d.ics" % i for i in range(5)]
+
+    storage.max_results = None
+    response = request(storage, "REPORT", "/calendar/", SYNC % "")
+    assert response.xml().findtext("{DAV:}sync-token") == token
+
+
+def test_invalid_limits_are_bad_requests():
+    storage = filled()
+    for invalid in (
+        "<D:limit/>",
+        limit(0),
+        "<D:limit><D:nresults>x</D:nresults></D:limit>",
+    ):
+        response = request(storage, "REPORT", "/calendar/", CALENDAR_QUERY % invalid)
+        assert response.status == 400
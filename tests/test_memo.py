@@ -0,0 +1,121 @@
+import threading
+from typing import Optional
+
+from davish import Metrics, RequestMetrics
+from davish.request import RequestStorage
+from davish.storage import Item
+
+from tests.helpers import CALENDAR, PROPFIND_ETAG, MemoryStorage, event, fill, request
+
+
+def filled_storage(storage: Optional[MemoryStorage] = None) -> MemoryStorage:
+    storage = storage or MemoryStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    storage.calls.clear()
+    return storage
+
+
+def test_lookups_are_made_once_per_request():
+    storage = filled_storage()
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    assert response.status == 207
+    assert storage.calls["collection_items"] == 1
+    assert storage.calls["item_serialize"] == 5
+
+    storage.calls.clear()
+    request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    # Nothing is kept across requests
+    assert storage.calls["collection_items"] == 1
+
+
+def test_memoize_can_be_disabled():
+    storage = filled_storage()
+    memoized = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    calls = storage.calls.copy()
+    storage.calls.clear()
+    response = request(
+        storage,
+        "PROPFIND",
+        "/calendar/",
+        PROPFIND_ETAG,
+        {"Depth": "1"},
+        memoize=False,
+    )
+    assert response.body == memoized.body
+    assert storage.calls["collection_items"] > calls["collection_items"]
+
+
+def test_uploads_and_deletions_invalidate_the_collection():
+    storage = filled_storage()
+    wrapper = RequestStorage(storage)
+    assert len(wrapper.collection_items(CALENDAR)) == 5
+    wrapper.item_upload("new.ics", CALENDAR, event("new"))
+    assert len(wrapper.collection_items(CALENDAR)) == 6
+    wrapper.item_delete(wrapper.item_get("new.ics", CALENDAR))
+    assert wrapper.item_get("new.ics", CALENDAR) is None
+    assert storage.calls["collection_items"] == 2
+
+
+def test_the_storage_is_left_untouched():
+    storage = filled_storage()
+    attributes = dict(vars(storage))
+    expected = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    errors = []
+
+    def propfind() -> None:
+        for _ in range(10):
+            response = request(
+                storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"}
+            )
+            if response.body != expected.body:
+                errors.append(response)
+
+    threads = [threading.Thread(target=propfind) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert vars(storage).keys() == attributes.keys()
+
+
+class VersionedStorage(MemoryStorage):
+    """Storage overriding optional hooks and with a method of its own."""
+
+    def item_version(self, item: Item) -> Optional[str]:
+        self.calls["item_version"] += 1
+        return item.last_modified.isoformat()
+
+    def collection_create(self, slug: str) -> str:
+        return "created " + slug
+
+
+def test_overridden_methods_are_called_on_the_storage():
+    storage = filled_storage(VersionedStorage())
+    wrapper = RequestStorage(storage)
+    etags = [wrapper.item_etag(item) for item in wrapper.collection_items(CALENDAR)]
+    assert len(set(etags)) == 5
+    assert storage.calls["item_version"] == 5
+    # The default etags are computed from the serialization
+    assert storage.calls["item_serialize"] == 0
+    assert wrapper.collection_create("other") == "created other"
+    assert wrapper.user == storage.user
+
+
+def test_metrics_count_the_calls_reaching_the_storage():
+    storage = filled_storage()
+    recorded: list[RequestMetrics] = []
+    metrics = Metrics(hook=recorded.append)
+    request(
+        storage,
+        "PROPFIND",
+        "/calendar/",
+        PROPFIND_ETAG,
+        {"Depth": "1"},
+        metrics=metrics,
+    )
+    calls = recorded[0].storage_calls
+    assert calls["collection_items"] == storage.calls["collection_items"] == 1
+    assert calls["item_serialize"] == storage.calls["item_serialize"] == 5
+    # Serialized by the default ``items_serialize_many``, counted once
+    assert recorded[0].serialized_bytes == 5 * len(event("e0").encode())
@@ -0,0 +1,110 @@
+import pytest
+
+from davish import Metrics, handle_dav_request
+
+from tests.helpers import (
+    CALENDAR,
+    PROPFIND_ETAG,
+    MemoryStorage,
+    event,
+    fill,
+    make_environ,
+    request,
+)
+
+CALENDAR_QUERY = (
+    b'<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    b"<D:prop><D:getetag/><C:calendar-data/></D:prop>"
+    b'<C:filter><C:comp-filter name="VCALENDAR"/></C:filter></C:calendar-query>'
+)
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    storage.calls.clear()
+    return storage
+
+
+def test_requests_and_storage_calls_are_recorded(storage):
+    recorded = []
+    metrics = Metrics(hook=recorded.append)
+    response = request(
+        storage,
+        "PROPFIND",
+        "/calendar/",
+        PROPFIND_ETAG,
+        {"Depth": "1"},
+        metrics=metrics,
+    )
+
+    (measured,) = recorded
+    assert (measured.method, measured.report, measured.status) == (
+        "PROPFIND",
+        None,
+        207,
+    )
+    assert measured.response_bytes == len(response.body)
+    assert measured.duration > 0
+    # The calls reaching the storage, after the request memo
+    for name in ("collection_get", "collection_items", "item_serialize"):
+        assert measured.storage_calls[name] == storage.calls[name]
+    assert measured.serialized_bytes == sum(
+        len(content.encode()) for content in storage.contents["calendar"].values()
+    )
+
+
+def test_reports_are_grouped_by_type(storage):
+    recorded = []
+    metrics = Metrics(hook=recorded.append)
+    request(storage, "REPORT", "/calendar/", CALENDAR_QUERY, metrics=metrics)
+    request(
+        storage, "REPORT", "/calendar/", b'<D:unknown xmlns:D="DAV:"/>', metrics=metrics
+    )
+    request(storage, "BREW", "/calendar/", metrics=metrics)
+    assert [(m.method, m.report) for m in recorded] == [
+        ("REPORT", "C:calendar-query"),
+        ("REPORT", "OTHER"),
+        ("OTHER", None),
+    ]
+
+
+def test_streamed_requests_are_recorded_once_consumed(storage):
+    recorded = []
+    metrics = Metrics(hook=recorded.append)
+    environ = make_environ("REPORT", "/calendar/", CALENDAR_QUERY)
+    _, _, content = handle_dav_request(environ, storage, stream=True, metrics=metrics)
+    assert recorded == []
+    body = b"".join(content)
+    assert recorded[0].response_bytes == len(body)
+    assert recorded[0].storage_calls["item_serialize"] == 5
+
+
+def test_prometheus_snapshot(storage):
+    metrics = Metrics()
+    for _ in range(2):
+        request(storage, "REPORT", "/calendar/", CALENDAR_QUERY, metrics=metrics)
+    text = metrics.prometheus()
+    labels = 'method="REPORT",report="C:calendar-query"'
+    assert "# TYPE davish_requests_total counter" in text
+    assert 'davish_requests_total{%s,status="207"} 2' % labels in text
+    assert "davish_request_duration_seconds_count{%s} 2" % labels in text
+    assert 'davish_request_duration_seconds_bucket{%s,le="+Inf"} 2' % labels in text
+    assert 'davish_storage_calls_total{%s,call="item_serialize"} 10' % labels in text
+
+    metrics.clear()
+    assert "davish_requests_total{" not in metrics.prometheus()
+
+
+def test_errors_are_recorded(storage):
+    recorded = []
+    metrics = Metrics(hook=recorded.append)
+
+    def fail(collection):
+        raise OSError("unavailable")
+
+    storage.collection_items = fail
+    with pytest.raises(OSError):
+        request(storage, "GET", "/calendar/", metrics=metrics)
+    assert recorded[0].status == 500
@@ -0,0 +1,54 @@
+from typing import Iterable
+
+from davish.storage import Item
+
+from tests.helpers import CALENDAR, LookupStorage, MemoryStorage, event, fill, request
+
+MULTIGET = (
+    '<C:calendar-multiget xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    "<D:prop><D:getetag/><C:calendar-data/></D:prop>%s</C:calendar-multiget>"
+)
+
+
+class BatchStorage(LookupStorage):
+    """Storage serializing the items of a batch at once."""
+
+    def items_serialize_many(self, items: Iterable[Item]) -> list[str]:
+        self.calls["items_serialize_many"] += 1
+        return [self.contents[item.collection.slug][item.href] for item in items]
+
+
+def filled(storage: MemoryStorage) -> MemoryStorage:
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(100)})
+    storage.calls.clear()
+    return storage
+
+
+def multiget(storage: MemoryStorage, *hrefs: str):
+    body = MULTIGET % "".join("<D:href>/calendar/%s</D:href>" % h for h in hrefs)
+    return request(storage, "REPORT", "/calendar/", body)
+
+
+def test_only_the_requested_items_are_fetched():
+    storage = filled(BatchStorage())
+    response = multiget(storage, "1.ics", "missing.ics", "2.ics")
+    assert response.status == 207
+    data = response.props("{urn:ietf:params:xml:ns:caldav}calendar-data")
+    assert set(data) == {"/calendar/1.ics", "/calendar/2.ics"}
+    assert "UID:e1" in data["/calendar/1.ics"]
+    assert response.statuses() == {"/calendar/missing.ics": "HTTP/1.1 404 Not Found"}
+
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["items_get_many"] == 1
+    assert storage.calls["items_serialize_many"] == 1
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_the_defaults_answer_the_same():
+    hrefs = ("5.ics", "missing.ics", "50.ics", "7.ics")
+    expected = multiget(filled(BatchStorage()), *hrefs)
+    storage = filled(MemoryStorage())
+    assert multiget(storage, *hrefs).body == expected.body
+    # The collection is listed once, only the requested items are serialized
+    assert storage.calls["collection_items"] == 1
+    assert storage.calls["item_serialize"] == 3
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from davish.storage import Item
+
+from tests.helpers import CALENDAR, PROPFIND_ETAG, MemoryStorage, event, fill, request
+
+CALENDAR_QUERY = (
+    b'<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    b"<D:prop><D:getetag/><C:calendar-data/></D:prop>"
+    b'<C:filter><C:comp-filter name="VCALENDAR"/></C:filter></C:calendar-query>'
+)
+
+
+class SlowStorage(MemoryStorage):
+    """Storage taking a while to serialize, recording the threads it runs on
+    and the highest number of serializations at once."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.threads: set[str] = set()
+        self.running = 0
+        self.max_running = 0
+        self._running_lock = threading.Lock()
+
+    def item_serialize(self, item: Item) -> str:
+        with self._running_lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.threads.add(threading.current_thread().name)
+        time.sleep(0.002)
+        try:
+            return super().item_serialize(item)
+        finally:
+            with self._running_lock:
+                self.running -= 1
+
+
+def filled() -> SlowStorage:
+    storage = SlowStorage()
+    fill(storage, CALENDAR, {"%02d.ics" % i: event("e%d" % i) for i in range(40)})
+    return storage
+
+
+def test_results_keep_the_order_and_parallelism_is_capped():
+    storage = filled()
+    items = storage.collection_items(CALENDAR)
+    with ThreadPoolExecutor(16, thread_name_prefix="pool") as executor:
+        storage.executor = executor
+        storage.max_parallel = 4
+        serialized = storage.items_serialize_many(items)
+    assert serialized == [storage.contents["calendar"][item.href] for item in items]
+    assert 1 < storage.max_running <= 4
+    assert all(name.startswith("pool") for name in storage.threads)
+
+
+def test_responses_are_the_same_in_parallel():
+    storage = filled()
+    expected = [
+        request(storage, "REPORT", "/calendar/", CALENDAR_QUERY, {"Depth": "1"}),
+        request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"}),
+    ]
+    assert storage.max_running == 1
+
+    with ThreadPoolExecutor(8) as executor:
+        storage.executor = executor
+        storage.max_parallel = 8
+        for response, method, body in zip(
+            expected, ("REPORT", "PROPFIND"), (CALENDAR_QUERY, PROPFIND_ETAG)
+        ):
+            parallel = request(storage, method, "/calendar/", body, {"Depth": "1"})
+            assert parallel.body == response.body
+    assert storage.max_running > 1
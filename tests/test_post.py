@@ -0,0 +1,114 @@
+from davish.utils import utils_vobject
+
+from tests.helpers import (
+    CALENDAR,
+    CONTACTS,
+    LookupStorage,
+    PersistedStorage,
+    calendar,
+    event,
+    fill,
+    request,
+    vcard,
+)
+
+TIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:%s",
+    "BEGIN:STANDARD",
+    "DTSTART:19700101T000000",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0100",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+class PersistedLookupStorage(PersistedStorage, LookupStorage):
+    pass
+
+
+def timezone(tzid):
+    return [line.replace("%s", tzid) for line in TIMEZONE]
+
+
+def test_components_become_items():
+    storage = PersistedStorage()
+    response = request(storage, "POST", "/calendar/", calendar("a", "b"))
+    assert response.status == 207
+    assert set(response.props("{DAV:}getetag")) == {
+        "/calendar/a.ics",
+        "/calendar/b.ics",
+    }
+    assert set(storage.contents["calendar"]) == {"a.ics", "b.ics"}
+
+
+def test_existing_uids_are_replaced_under_their_href():
+    storage = PersistedStorage()
+    fill(storage, CALENDAR, {"legacy.ics": event("a")})
+    response = request(storage, "POST", "/calendar/", calendar("a"))
+    assert list(response.props("{DAV:}getetag")) == ["/calendar/legacy.ics"]
+    assert set(storage.contents["calendar"]) == {"legacy.ics"}
+
+
+def test_uids_are_looked_up_in_the_index():
+    storage = PersistedLookupStorage()
+    fill(storage, CONTACTS, {"%d.vcf" % i: vcard("c%d" % i, "C") for i in range(20)})
+    request(storage, "POST", "/contacts/", vcard("c1", "One"))
+    storage.calls.clear()
+
+    response = request(storage, "POST", "/contacts/", vcard("c2", "Two"))
+    assert list(response.props("{DAV:}getetag")) == ["/contacts/2.vcf"]
+    # Only the uploaded item is read, to index it and for its etag
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_serialize"] <= 2
+
+
+def test_uids_are_compared_exactly():
+    storage = PersistedStorage()
+    fill(storage, CONTACTS, {"legacy.vcf": vcard("Abc", "A")})
+    assert storage.items_href_by_uid(["Abc", "abc"], CONTACTS) == {"Abc": "legacy.vcf"}
+
+
+def test_uids_are_found_without_indexes():
+    storage = PersistedStorage()
+    storage.indexes = None
+    fill(storage, CONTACTS, {"legacy.vcf": vcard("a", "A")})
+    assert storage.items_href_by_uid(["a", "b"], CONTACTS) == {"a": "legacy.vcf"}
+
+
+def test_duplicate_uids_are_refused():
+    storage = PersistedStorage()
+    body = vcard("a", "First") + vcard("a", "Second") + vcard("b", "Other")
+    response = request(storage, "POST", "/contacts/", body)
+    assert response.status == 207
+    assert response.statuses() == {"/contacts/a.vcf": "HTTP/1.1 409 Conflict"}
+    assert set(response.props("{DAV:}getetag")) == {
+        "/contacts/a.vcf",
+        "/contacts/b.vcf",
+    }
+    assert "FN:First" in storage.contents["contacts"]["a.vcf"]
+
+
+def test_wrong_components_are_forbidden():
+    storage = PersistedStorage()
+    response = request(storage, "POST", "/contacts/", calendar("a"))
+    assert response.statuses() == {"/contacts/a.vcf": "HTTP/1.1 403 Forbidden"}
+    assert storage.contents["contacts"] == {}
+
+
+def test_only_the_time_zones_used_are_kept():
+    text = "\r\n".join(
+        ["BEGIN:VCALENDAR", "VERSION:2.0"]
+        + timezone("Europe/Rome")
+        + timezone("Europe/Rome2")
+        + ["BEGIN:VEVENT", "UID:a", 'DTSTART;TZID="Europe/Rome2":20240101T100000']
+        + ["END:VEVENT"]
+        + ["BEGIN:VEVENT", "UID:b", "DTSTART;TZID=Europe/Rome:20240101T100000"]
+        + ["END:VEVENT", "END:VCALENDAR", ""]
+    )
+    items = {uid: item for _, uid, item in utils_vobject.split_components(text)}
+    assert "TZID:Europe/Rome2" in items["a"]
+    assert "TZID:Europe/Rome\r\n" not in items["a"]
+    assert "TZID:Europe/Rome\r\n" in items["b"]
+    assert "TZID:Europe/Rome2" not in items["b"]
@@ -0,0 +1,103 @@
+import pytest
+
+from davish import register_property
+from davish.ops import propfind
+
+from tests.helpers import CALENDAR, MemoryStorage, event, fill, request
+
+COLOR = "{http://apple.com/ns/ical/}calendar-color"
+
+PROPFIND_COLOR = (
+    b'<D:propfind xmlns:D="DAV:" xmlns:ICAL="http://apple.com/ns/ical/">'
+    b"<D:prop><ICAL:calendar-color/><D:displayname/></D:prop></D:propfind>"
+)
+ALLPROP = b'<D:propfind xmlns:D="DAV:"><D:allprop/></D:propfind>'
+PROPNAME = b'<D:propfind xmlns:D="DAV:"><D:propname/></D:propfind>'
+
+
+@pytest.fixture
+def registry():
+    properties = dict(propfind.PROPERTIES)
+    yield
+    propfind.PROPERTIES.clear()
+    propfind.PROPERTIES.update(properties)
+    propfind._ALLPROP_TAGS.clear()
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"a.ics": event("a")})
+    return storage
+
+
+def register_color(**options):
+    @register_property("ICAL:calendar-color", **options)
+    def calendar_color(resource, element):
+        if not resource.is_leaf:
+            return False
+        element.text = "#ff0000ff"
+        return True
+
+    return calendar_color
+
+
+def test_custom_properties_are_answered(registry, storage):
+    register_color(allprop=lambda resource: resource.is_leaf)
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_COLOR, {"Depth": "1"}
+    )
+    assert response.props(COLOR) == {"/calendar/": "#ff0000ff"}
+    assert "/calendar/" in response.props("{DAV:}displayname")
+
+    for body in (ALLPROP, PROPNAME):
+        response = request(storage, "PROPFIND", "/calendar/", body, {"Depth": "0"})
+        assert "/calendar/" in response.props(COLOR)
+        response = request(storage, "PROPFIND", "/calendar/a.ics", body)
+        assert response.props(COLOR) == {}
+
+
+def test_unknown_properties_are_not_found(storage):
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_COLOR, {"Depth": "0"}
+    )
+    assert response.props(COLOR) == {}
+    statuses = [
+        propstat.findtext("{DAV:}status")
+        for propstat in response.xml().iter("{DAV:}propstat")
+        if propstat.find("{DAV:}prop/" + COLOR) is not None
+    ]
+    assert statuses == ["HTTP/1.1 404 Not Found"]
+
+
+def test_default_handlers_can_be_replaced(registry, storage):
+    @register_property("D:displayname", allprop=lambda resource: True)
+    def displayname(resource, element):
+        element.text = "collection" if resource.is_collection else "item"
+        return True
+
+    body = b'<D:propfind xmlns:D="DAV:"><D:prop><D:displayname/></D:prop></D:propfind>'
+    response = request(storage, "PROPFIND", "/calendar/", body, {"Depth": "1"})
+    assert response.props("{DAV:}displayname") == {
+        "/calendar/": "collection",
+        "/calendar/a.ics": "item",
+    }
+
+
+def test_batched_values_are_computed_once(registry, storage):
+    @register_property("ICAL:calendar-color", needs_etag=True, needs_size=True)
+    def color(resource, element):
+        element.text = "%s %d" % (resource.get_etag(), resource.get_size())
+        return True
+
+    fill(storage, CALENDAR, {"b.ics": event("b")})
+    storage.calls.clear()
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_COLOR, {"Depth": "1"}
+    )
+    colors = response.props(COLOR)
+    assert len(colors) == 3
+    size = len(event("a").encode())
+    assert colors["/calendar/a.ics"].endswith(" %d" % size)
+    # One serialization per item, memoized for its etag and size
+    assert storage.calls["item_serialize"] == 2
@@ -0,0 +1,96 @@
+from davish import ResponseCache
+from davish.storage import Collection, Tag
+
+from tests.helpers import (
+    CALENDAR,
+    PROPFIND_ETAG,
+    MemoryStorage,
+    calendar,
+    event,
+    fill,
+    request,
+)
+
+
+def cached_storage(user: str = "user", cache=None) -> MemoryStorage:
+    storage = MemoryStorage(user)
+    storage.response_cache = cache if cache is not None else ResponseCache()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    storage.calls.clear()
+    return storage
+
+
+def propfind(storage: MemoryStorage, path: str = "/calendar/", depth: str = "1"):
+    response = request(storage, "PROPFIND", path, PROPFIND_ETAG, {"Depth": depth})
+    assert response.status == 207
+    return response
+
+
+def test_repeated_requests_are_answered_from_the_cache():
+    storage = cached_storage()
+    first = propfind(storage)
+    storage.calls.clear()
+    assert propfind(storage).body == first.body
+    assert storage.response_cache.hits == 1
+    # Validated with the sync token, without listing the collection
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_changes_invalidate_the_entries():
+    storage = cached_storage()
+    propfind(storage)
+    request(storage, "PUT", "/calendar/new.ics", event("new"))
+    assert "/calendar/new.ics" in propfind(storage).hrefs()
+
+    request(storage, "DELETE", "/calendar/new.ics")
+    assert "/calendar/new.ics" not in propfind(storage).hrefs()
+
+    request(
+        storage,
+        "POST",
+        "/calendar/",
+        calendar("posted"),
+        {"Content-Type": "text/calendar"},
+    )
+    assert len(propfind(storage).hrefs()) == 7
+    assert storage.response_cache.hits == 0
+
+
+def test_changes_made_elsewhere_are_seen():
+    storage = cached_storage()
+    propfind(storage)
+    storage.item_upload("new.ics", CALENDAR, event("new"))
+    assert "/calendar/new.ics" in propfind(storage).hrefs()
+
+
+def test_changes_only_invalidate_the_entries_of_the_user():
+    cache = ResponseCache()
+    alice, bob = cached_storage("alice", cache), cached_storage("bob", cache)
+    propfind(alice)
+    propfind(bob)
+    request(alice, "PUT", "/calendar/new.ics", event("new"))
+    assert len(cache) == 1
+    propfind(bob)
+    assert cache.hits == 1
+
+
+def test_principal_responses_change_with_the_collections():
+    storage = cached_storage()
+    for depth in ("0", "1"):
+        propfind(storage, "/user/", depth)
+        propfind(storage, "/", depth)
+    assert storage.response_cache.hits == 0
+
+    created = Collection(slug="other", name="Other", tag=Tag.CALENDAR)
+    storage.collections[created.slug] = created
+    storage.items[created.slug] = {}
+    for depth in ("0", "1"):
+        propfind(storage, "/user/", depth)
+        propfind(storage, "/", depth)
+    assert storage.response_cache.hits == 0
+
+    for depth in ("0", "1"):
+        propfind(storage, "/user/", depth)
+        propfind(storage, "/", depth)
+    assert storage.response_cache.hits == 4
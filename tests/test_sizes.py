@@ -0,0 +1,99 @@
+import dataclasses
+
+import pytest
+
+from davish import SQLiteStorage
+from davish.storage import Collection, Item
+
+from tests.helpers import (
+    CALENDAR,
+    MemoryStorage,
+    VersionedStorage,
+    event,
+    fill,
+    request,
+)
+
+PROPFIND_LENGTH = (
+    b'<D:propfind xmlns:D="DAV:"><D:prop><D:getcontentlength/></D:prop>'
+    b"</D:propfind>"
+)
+CONTENTS = {"%d.ics" % i: event("e%d" % i) for i in range(5)}
+
+
+class HookStorage(MemoryStorage):
+    """``MemoryStorage`` answering the sizes from its own metadata."""
+
+    def item_size(self, item: Item) -> int:
+        self.calls["item_size"] += 1
+        return 1000
+
+    def collection_size(self, collection: Collection) -> int:
+        self.calls["collection_size"] += 1
+        return 5000
+
+
+def lengths(storage, depth: str = "1") -> dict[str, str]:
+    response = request(
+        storage, "PROPFIND", "/calendar/", PROPFIND_LENGTH, {"Depth": depth}
+    )
+    assert response.status == 207
+    return response.props("{DAV:}getcontentlength")
+
+
+def collection_size() -> str:
+    return str(len("\n".join(CONTENTS.values()).encode()))
+
+
+@pytest.mark.parametrize("storage_class", [VersionedStorage, MemoryStorage])
+def test_sizes_are_read_from_the_items(storage_class):
+    storage = storage_class()
+    fill(storage, CALENDAR, CONTENTS)
+    storage.calls.clear()
+    found = lengths(storage)
+    assert found["/calendar/2.ics"] == str(len(event("e2").encode()))
+    assert found["/calendar/"] == collection_size()
+    if storage_class is VersionedStorage:
+        # Item.size is set, nothing is serialized
+        assert storage.calls["item_serialize"] == 0
+    else:
+        # The fallback, each item serialized for its size
+        assert storage.calls["item_serialize"] >= len(CONTENTS)
+
+
+def test_the_size_hooks_are_used():
+    storage = HookStorage()
+    fill(storage, CALENDAR, CONTENTS)
+    storage.calls.clear()
+    found = lengths(storage)
+    assert found["/calendar/"] == "5000"
+    assert found["/calendar/0.ics"] == "1000"
+    assert storage.calls["collection_size"] == 1
+    assert storage.calls["item_serialize"] == 0
+
+    item = storage.item_get("0.ics", CALENDAR)
+    assert storage.item_size(dataclasses.replace(item, size=3)) == 1000
+    assert VersionedStorage().item_size(dataclasses.replace(item, size=3)) == 3
+
+
+def test_collection_size_matches_the_export():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, CONTENTS)
+    assert storage.collection_size(CALENDAR) == len(
+        storage.serialize(CALENDAR).encode()
+    )
+    assert lengths(storage, "0") == {"/calendar/": collection_size()}
+
+    empty = Collection(slug="empty", name="Empty", tag=CALENDAR.tag)
+    storage = MemoryStorage(collections=(empty,))
+    assert storage.collection_size(empty) == 0
+
+
+def test_sqlite_stores_the_sizes(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "davish.sqlite"), user="alice")
+    storage.collection_create(CALENDAR)
+    fill(storage, CALENDAR, CONTENTS)
+    item = storage.item_get("3.ics", CALENDAR)
+    assert item.size == len(event("e3").encode())
+    assert storage.collection_size(CALENDAR) == int(collection_size())
+    assert storage.collection_summary(CALENDAR).size == int(collection_size())
@@ -0,0 +1,156 @@
+import os
+import threading
+
+import pytest
+
+from davish import SQLiteStorage
+from davish.index import TIME_RANGE_MAX, TIME_RANGE_MIN
+
+from tests.helpers import CALENDAR, CONTACTS, PROPFIND_ETAG, event, request, vcard
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "dav.sqlite")
+    yield path
+    SQLiteStorage(path).close()
+
+
+@pytest.fixture
+def storage(path):
+    storage = SQLiteStorage(path, user="alice")
+    storage.collection_create(CALENDAR)
+    storage.collection_create(CONTACTS)
+    return storage
+
+
+def test_upload_get_and_delete(storage):
+    item = storage.item_upload("a.ics", CALENDAR, event("a"))
+    assert item.etag and item.size == len(event("a").encode())
+    assert storage.item_get("a.ics", CALENDAR) == item
+    assert storage.item_serialize(item) == event("a")
+    assert [i.href for i in storage.collection_items(CALENDAR)] == ["a.ics"]
+
+    storage.item_delete(item)
+    assert storage.item_get("a.ics", CALENDAR) is None
+    assert list(storage.collection_items(CALENDAR)) == []
+
+
+def test_replaced_items_get_a_newer_last_modified(storage):
+    first = storage.item_upload("a.ics", CALENDAR, event("a"))
+    second = storage.item_upload("a.ics", CALENDAR, event("a", "20240202T100000Z"))
+    assert second.last_modified > first.last_modified
+    assert second.etag != first.etag
+
+
+def test_users_have_their_own_collections(storage, path):
+    bob = SQLiteStorage(path, user="bob")
+    bob.collection_create(CALENDAR)
+    storage.item_upload("a.ics", CALENDAR, event("alice"))
+    bob.item_upload("a.ics", CALENDAR, event("bob"))
+
+    assert "alice" in storage.item_serialize(storage.item_get("a.ics", CALENDAR))
+    assert "bob" in bob.item_serialize(bob.item_get("a.ics", CALENDAR))
+
+    bob.collection_delete(CALENDAR)
+    assert bob.collection_get("calendar") is None
+    assert storage.collection_get("calendar") == CALENDAR
+    assert len(storage.collection_items(CALENDAR)) == 1
+
+
+def test_sync_changes_come_from_the_revision(storage):
+    token = storage.collection_sync_token(CALENDAR)
+    storage.item_upload("a.ics", CALENDAR, event("a"))
+    item = storage.item_upload("b.ics", CALENDAR, event("b"))
+    storage.item_delete(item)
+
+    changes = storage.collection_changes(CALENDAR, token)
+    assert changes.modified == ["a.ics"]
+    assert changes.deleted == ["b.ics"]
+    assert changes.sync_token == storage.collection_sync_token(CALENDAR)
+    assert storage.collection_changes(CALENDAR, "12345") is None
+    assert storage.collection_changes(CALENDAR, "invalid") is None
+
+
+def test_ctag_changes_with_every_change(storage):
+    etag = storage.collection_etag(CALENDAR)
+    storage.item_upload("a.ics", CALENDAR, event("a"))
+    assert storage.collection_etag(CALENDAR) != etag
+
+
+def test_time_range_query(storage):
+    storage.item_upload("jan.ics", CALENDAR, event("jan"))
+    storage.item_upload("feb.ics", CALENDAR, event("feb", "20240201T100000Z"))
+    storage.item_upload("open.ics", CALENDAR, event("open", "invalid", None))
+    start = 1704067200  # 2024-01-01
+    items = storage.collection_items_in_range(CALENDAR, start, start + 86400)
+    assert [item.href for item in items] == ["jan.ics", "open.ics"]
+    assert storage.item_time_range(items[1]) == (TIME_RANGE_MIN, TIME_RANGE_MAX)
+
+
+def test_summary_and_sizes(storage):
+    storage.item_upload("a.vcf", CONTACTS, vcard("a", "Ada"))
+    storage.item_upload("b.vcf", CONTACTS, vcard("b", "Bob"))
+    summary = storage.collection_summary(CONTACTS)
+    assert summary.count == 2
+    assert summary.size == len(storage.serialize(CONTACTS).encode())
+    assert summary.etag == storage.collection_etag(CONTACTS)
+
+
+def test_upload_many_refuses_invalid_items_alone(storage):
+    uploaded = storage.item_upload_many(
+        {"a.ics": event("a"), "b.ics": vcard("b", "Bob"), "c.ics": "garbage"},
+        CALENDAR,
+    )
+    assert uploaded["a.ics"] is not None
+    assert uploaded["b.ics"] is None and uploaded["c.ics"] is None
+    assert [item.href for item in storage.collection_items(CALENDAR)] == ["a.ics"]
+
+
+def test_items_href_by_uid(storage):
+    storage.item_upload("legacy.ics", CALENDAR, event("a"))
+    assert storage.items_href_by_uid(["a", "b"], CALENDAR) == {"a": "legacy.ics"}
+
+
+def test_in_memory_databases_are_refused():
+    with pytest.raises(ValueError):
+        SQLiteStorage(":memory:")
+
+
+def test_every_thread_connection_has_the_schema(storage):
+    found = []
+    thread = threading.Thread(target=lambda: found.extend(storage.collection_list()))
+    thread.start()
+    thread.join()
+    assert found == [CALENDAR, CONTACTS]
+
+
+def test_recreated_database_gets_the_schema(storage, path):
+    storage.close()
+    os.remove(path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    assert storage.collection_list() == []
+    storage.collection_create(CALENDAR)
+    assert storage.collection_list() == [CALENDAR]
+
+
+def test_close_closes_the_connections_of_every_thread(storage):
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(storage.connection))
+    thread.start()
+    thread.join()
+    storage.close()
+    with pytest.raises(Exception):
+        connections[0].execute("SELECT 1")
+    # Reopened on the next call
+    assert storage.collection_list() == [CALENDAR, CONTACTS]
+
+
+def test_propfind(storage):
+    storage.item_upload("a.ics", CALENDAR, event("a"))
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_ETAG, {"Depth": "1"})
+    assert response.status == 207
+    etags = response.props("{DAV:}getetag")
+    assert etags["/calendar/a.ics"] == storage.item_get("a.ics", CALENDAR).etag
@@ -0,0 +1,62 @@
+from davish import handle_dav_request
+
+from tests.helpers import CALENDAR, MemoryStorage, event, fill, make_environ, request
+
+CALENDAR_QUERY = (
+    b'<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    b"<D:prop><D:getetag/><C:calendar-data/></D:prop>"
+    b'<C:filter><C:comp-filter name="VCALENDAR"/></C:filter></C:calendar-query>'
+)
+
+PROPFIND_DATA = (
+    b'<D:propfind xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    b"<D:prop><D:getetag/><C:calendar-data/></D:prop></D:propfind>"
+)
+
+# Enough items for a few chunks of streamed content
+COUNT = 300
+
+
+def filled() -> MemoryStorage:
+    storage = MemoryStorage()
+    description = "DESCRIPTION:" + "x" * 500
+    fill(
+        storage,
+        CALENDAR,
+        {
+            "%03d.ics" % i: event("e%d" % i, "20240101T100000Z", None, description)
+            for i in range(COUNT)
+        },
+    )
+    storage.calls.clear()
+    return storage
+
+
+def streamed(storage, method, path, body=b"", headers=None):
+    environ = make_environ(method, path, body, headers)
+    return handle_dav_request(environ, storage, stream=True)
+
+
+def test_streamed_multistatus_matches_the_whole_one():
+    storage = filled()
+    for method, body, headers in (
+        ("PROPFIND", PROPFIND_DATA, {"Depth": "1"}),
+        ("REPORT", CALENDAR_QUERY, {"Depth": "1"}),
+    ):
+        expected = request(storage, method, "/calendar/", body, headers)
+        status, response_headers, content = streamed(
+            storage, method, "/calendar/", body, headers
+        )
+        assert status == expected.status == 207
+        assert not isinstance(content, bytes)
+        chunks = list(content)
+        assert len(chunks) > 1
+        assert b"".join(chunks) == expected.body
+
+
+def test_responses_are_generated_while_consumed():
+    storage = filled()
+    _, _, content = streamed(storage, "REPORT", "/calendar/", CALENDAR_QUERY)
+    next(content)
+    assert 0 < storage.calls["item_serialize"] < COUNT
+    content.close()
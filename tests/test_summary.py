@@ -0,0 +1,86 @@
+from davish.storage import BaseStorage, CollectionSummary
+
+from tests.helpers import (
+    CALENDAR,
+    PersistedStorage,
+    calendar,
+    event,
+    fill,
+    request,
+)
+
+PROPFIND_SUMMARY = (
+    b'<D:propfind xmlns:D="DAV:" xmlns:CS="http://calendarserver.org/ns/">'
+    b"<D:prop><D:getlastmodified/><D:getcontentlength/><CS:getctag/></D:prop>"
+    b"</D:propfind>"
+)
+
+
+def filled_storage() -> PersistedStorage:
+    storage = PersistedStorage()
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    return storage
+
+
+def computed_summary(storage: BaseStorage) -> CollectionSummary:
+    """The summary computed from a listing, ignoring the persisted stats."""
+    stats = storage.items_stats(storage.collection_items(CALENDAR))
+    return CollectionSummary(
+        count=stats.count,
+        last_modified=stats.last_modified,
+        size=stats.size + max(stats.count - 1, 0),
+        etag=storage.collection_etag(CALENDAR),
+    )
+
+
+def propfind(storage: PersistedStorage) -> dict[str, str]:
+    response = request(storage, "PROPFIND", "/calendar/", PROPFIND_SUMMARY)
+    assert response.status == 207
+    return response.props("{DAV:}getcontentlength")
+
+
+def test_the_summary_is_computed_once():
+    storage = filled_storage()
+    first = propfind(storage)
+    assert storage.stats["calendar"].count == 5
+
+    storage.calls.clear()
+    assert propfind(storage) == first
+    assert storage.calls["collection_items"] == 0
+    assert storage.calls["item_serialize"] == 0
+
+
+def test_put_delete_and_post_update_the_stats():
+    storage = filled_storage()
+    propfind(storage)
+
+    request(storage, "PUT", "/calendar/new.ics", event("new", "20240301T100000Z"))
+    request(storage, "PUT", "/calendar/1.ics", event("e1", "20240302T100000Z"))
+    request(storage, "DELETE", "/calendar/0.ics")
+    # A new event and a replaced one
+    response = request(
+        storage,
+        "POST",
+        "/calendar/",
+        calendar("p1", "e2"),
+        {"Content-Type": "text/calendar"},
+    )
+    assert response.status == 207
+
+    storage.calls.clear()
+    summary = storage.collection_summary(CALENDAR)
+    assert storage.calls["collection_items"] == 0
+    assert summary == computed_summary(storage)
+    assert summary.count == 6
+
+
+def test_removing_the_newest_item_drops_the_stats():
+    storage = filled_storage()
+    propfind(storage)
+    newest = max(
+        storage.collection_items(CALENDAR), key=lambda item: item.last_modified
+    )
+    request(storage, "DELETE", "/calendar/%s" % newest.href)
+    assert "calendar" not in storage.stats
+    assert storage.collection_summary(CALENDAR) == computed_summary(storage)
+    assert storage.stats["calendar"].count == 4
@@ -0,0 +1,138 @@
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from davish.index import SyncIndex
+from davish.storage import BaseStorage, Collection
+
+from tests.helpers import CALENDAR, EPOCH, LookupStorage, event, fill, request
+
+
+class UnloggedStorage(LookupStorage):
+    """Storage without a change log."""
+
+    def collection_sync_token(self, collection: Collection) -> Optional[str]:
+        return None
+
+
+def sync_body(token: str = "", limit: Optional[int] = None) -> str:
+    limit_element = ""
+    if limit is not None:
+        limit_element = "<D:limit><D:nresults>%d</D:nresults></D:limit>" % limit
+    return (
+        '<D:sync-collection xmlns:D="DAV:">'
+        "<D:sync-token>%s</D:sync-token><D:sync-level>1</D:sync-level>%s"
+        "<D:prop><D:getetag/></D:prop></D:sync-collection>"
+        % (escape(token), limit_element)
+    )
+
+
+def sync(storage: BaseStorage, token: str = "", limit: Optional[int] = None):
+    response = request(storage, "REPORT", "/calendar/", sync_body(token, limit))
+    if response.status != 207:
+        return response, None
+    return response, response.xml().findtext("{DAV:}sync-token")
+
+
+def filled(storage: LookupStorage) -> LookupStorage:
+    fill(storage, CALENDAR, {"%d.ics" % i: event("e%d" % i) for i in range(5)})
+    return storage
+
+
+def change(storage: LookupStorage) -> None:
+    storage.item_upload("1.ics", CALENDAR, event("e1", "20240105T100000Z"))
+    storage.item_upload("new.ics", CALENDAR, event("new"))
+    storage.item_delete(storage.item_get("3.ics", CALENDAR))
+
+
+def test_initial_sync_lists_the_collection():
+    storage = filled(LookupStorage())
+    response, token = sync(storage)
+    assert response.status == 207
+    assert response.hrefs() == ["/calendar/%d.ics" % i for i in range(5)]
+    assert token
+
+
+def test_changes_since_a_token():
+    storage = filled(LookupStorage())
+    _, token = sync(storage)
+    change(storage)
+    storage.calls.clear()
+
+    response, new_token = sync(storage, token)
+    assert set(response.props("{DAV:}getetag")) == {
+        "/calendar/1.ics",
+        "/calendar/new.ics",
+    }
+    assert response.statuses() == {"/calendar/3.ics": "HTTP/1.1 404 Not Found"}
+    assert new_token != token
+    assert storage.calls["collection_items"] == 0
+
+    response, _ = sync(storage, new_token)
+    assert response.hrefs() == []
+
+
+def test_unknown_tokens_are_refused():
+    storage = filled(LookupStorage())
+    _, token = sync(storage)
+    for unknown in (token + "0", "http://example.com/sync/1"):
+        response, _ = sync(storage, unknown)
+        assert response.status == 403
+        assert response.xml().find("{DAV:}valid-sync-token") is not None
+
+
+def test_truncated_syncs_continue():
+    storage = filled(LookupStorage())
+    _, token = sync(storage)
+    change(storage)
+
+    first, continuation = sync(storage, token, limit=2)
+    # With a 507 response for the collection, read rfc6578-3.6
+    assert sorted(first.hrefs()) == ["/calendar/", "/calendar/1.ics", "/calendar/3.ics"]
+    second, final = sync(storage, continuation, limit=2)
+    assert second.hrefs() == ["/calendar/new.ics"]
+    assert final == sync(storage)[1]
+
+
+def test_changes_without_a_change_log():
+    storage = filled(UnloggedStorage())
+    _, token = sync(storage)
+    change(storage)
+
+    response, new_token = sync(storage, token)
+    assert response.status == 207
+    assert set(response.props("{DAV:}getetag")) == {
+        "/calendar/1.ics",
+        "/calendar/new.ics",
+    }
+    assert response.statuses() == {"/calendar/3.ics": "HTTP/1.1 404 Not Found"}
+    assert new_token != token
+
+    response, same_token = sync(storage, new_token)
+    assert response.hrefs() == [] and same_token == new_token
+
+
+def test_forgotten_tokens_without_a_change_log_are_refused():
+    storage = filled(UnloggedStorage())
+    _, token = sync(storage)
+    change(storage)
+    BaseStorage.indexes.clear()
+    response, _ = sync(storage, token)
+    assert response.status == 403
+
+    storage.indexes = None
+    _, token = sync(storage)
+    storage.item_upload("new.ics", CALENDAR, event("newer"))
+    response, _ = sync(storage, token)
+    assert response.status == 403
+
+
+def test_tokens_seen_with_different_items_send_them_again():
+    index = SyncIndex()
+    index.last_modified = {"a": EPOCH, "b": EPOCH}
+    index.remember("token")
+    index.last_modified = {"a": EPOCH, "c": EPOCH}
+    index.remember("token")
+    index.last_modified = {"a": EPOCH, "c": EPOCH}
+    changed, deleted = index.changes("token")
+    assert changed == ["c"] and deleted == ["b"]
+    assert index.changes("other") is None
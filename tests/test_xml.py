@@ -0,0 +1,89 @@
+import gzip
+
+import pytest
+
+from davish.utils import utils_app
+
+from tests.helpers import CALENDAR, MemoryStorage, event, fill, make_environ, request
+
+MULTIGET = (
+    '<C:calendar-multiget xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+    "<D:prop><D:getetag/></D:prop>%s</C:calendar-multiget>"
+)
+
+
+def multiget(*hrefs: str) -> str:
+    return MULTIGET % "".join("<D:href>%s</D:href>" % href for href in hrefs)
+
+
+def nested(depth: int) -> bytes:
+    return ("<a>" * depth + "</a>" * depth).encode()
+
+
+def parse(body: bytes, headers=None, **limits):
+    environ = make_environ("REPORT", "/", body, headers)
+    return utils_app.read_xml_request_body(environ, **limits)
+
+
+def test_bodies_are_parsed_in_chunks():
+    hrefs = ["/calendar/%d.ics" % i for i in range(10_000)]
+    root = parse(multiget(*hrefs).encode())
+    assert [href.text for href in root.iter("{DAV:}href")] == hrefs
+    assert parse(b"") is None
+
+
+def test_limits_are_enforced():
+    assert parse(nested(4), max_depth=4).tag == "a"
+    with pytest.raises(RuntimeError, match="nested"):
+        parse(nested(5), max_depth=4)
+
+    assert parse(b"<a><b/><b/></a>", max_elements=3).tag == "a"
+    with pytest.raises(RuntimeError, match="elements"):
+        parse(b"<a><b/><b/><b/></a>", max_elements=3)
+
+    body = multiget(*("/calendar/%d.ics" % i for i in range(10_000))).encode()
+    with pytest.raises(RuntimeError, match="too large"):
+        parse(body, max_size=64 * 1024)
+
+
+def test_compressed_bodies_count_their_decoded_size():
+    body = multiget(*("/calendar/%d.ics" % i for i in range(10_000))).encode()
+    compressed = gzip.compress(body)
+    assert len(compressed) < 64 * 1024 < len(body)
+    headers = {"Content-Encoding": "gzip"}
+    assert parse(compressed, headers).tag.endswith("calendar-multiget")
+    with pytest.raises(RuntimeError, match="too large"):
+        parse(compressed, headers, max_size=64 * 1024)
+
+
+def test_charset_of_the_request_is_used():
+    body = '<D:displayname xmlns:D="DAV:">Café</D:displayname>'.encode("latin-1")
+    root = parse(body, {"Content-Type": "text/xml; charset=latin-1"})
+    assert root.text == "Café"
+    with pytest.raises(RuntimeError):
+        parse(body, {"Content-Type": "text/xml; charset=unknown"})
+
+
+def test_invalid_bodies_are_bad_requests(monkeypatch):
+    storage = MemoryStorage()
+    assert request(storage, "PROPFIND", "/calendar/", b"<a>").status == 400
+
+    monkeypatch.setattr(utils_app, "MAX_XML_DEPTH", 4)
+    assert request(storage, "PROPFIND", "/calendar/", nested(5)).status == 400
+
+    monkeypatch.setattr(utils_app, "MAX_XML_ELEMENTS", 10)
+    body = multiget(*("/calendar/%d.ics" % i for i in range(10)))
+    assert request(storage, "REPORT", "/calendar/", body).status == 400
+
+
+def test_multiget():
+    storage = MemoryStorage()
+    fill(storage, CALENDAR, {"a.ics": event("a"), "b.ics": event("b")})
+    body = multiget("/calendar/a.ics", "/calendar/missing.ics", "/calendar/b.ics")
+    response = request(storage, "REPORT", "/calendar/", body)
+    assert response.status == 207
+    assert set(response.props("{DAV:}getetag")) == {
+        "/calendar/a.ics",
+        "/calendar/b.ics",
+    }
+    assert response.statuses() == {"/calendar/missing.ics": "HTTP/1.1 404 Not Found"}